@@ -0,0 +1,880 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+   benchmyancestors.py - Benchmark getmyancestors against a local FamilySearch stub server
+   Copyright (C) 2014-2016 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+   and by Benoît Fontaine <benoitfontaine.ba@gmail.com>
+"""
+
+from __future__ import print_function
+
+# global import
+import gc
+import io
+import os
+import re
+import sys
+import json
+import time
+import array
+import shlex
+import shutil
+import tempfile
+import threading
+import unittest
+import argparse
+import subprocess
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# local import
+import getmyancestors as gt
+import mergemyancestors as mm
+import diffmyancestors as dm
+
+sys.path.append(os.path.dirname(sys.argv[0]))
+
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+GIVEN = (
+    ("John", "William", "James", "Peter", "Henry", "Thomas", "Louis"),
+    ("Mary", "Anna", "Elizabeth", "Sarah", "Jane", "Margaret", "Marie"),
+)
+SURNAMES = ("Smith", "Miller", "Taylor", "Brown", "Wilson", "Moore", "Clark", "Martin", "Hall")
+# name, latitude, longitude
+PLACES = (
+    ("Boston, Suffolk, Massachusetts, United States", 42.35, -71.06),
+    ("Lyon, Rhône, France", 45.75, 4.85),
+    ("Bern, Switzerland", 46.95, 7.45),
+    ("York, Yorkshire, England", 53.96, -1.08),
+    ("Québec, Québec, Canada", 46.81, -71.21),
+)
+FID = re.compile(r"[0-9A-Z]{4}-[0-9A-Z]{3}")
+PERSON = re.compile(r"/platform/tree/persons/(%s)(?:/([a-z]+))?(?:\.json)?" % FID.pattern)
+COUPLE = re.compile(
+    r"/platform/tree/couple-relationships/R(%s)(?:/([a-z]+))?(?:\.json)?" % FID.pattern
+)
+SESSION = "stub-session"
+
+
+class Deleted(KeyError):
+    """ a resource of a person deleted from the tree, answered with 410: gone """
+# getmyancestors as run by the benchmark, with the stub server URL as first argument
+CHILD = (
+    "import sys, getmyancestors as gt\n"
+    "gt.LOGIN_URL = gt.IDENT_URL = gt.API_URL = sys.argv.pop(1)\n"
+    "gt.main()\n"
+)
+# a getmyancestors run failing after its downloads
+FAILING = CHILD.replace("gt.main()", "gt.Tree.print = None\ngt.main()")
+
+
+class SyntheticTree:
+    """ A generated FamilySearch tree: the pedigree of the first person, where each couple
+        has branching children, the ancestor and its siblings
+        persons are numbered breadth first and their FamilySearch IDs are these numbers
+        in base 36, so that only a few arrays are kept in memory and the JSON is built
+        on request
+        :param size: maximum number of persons
+        :param branching: number of children of each couple
+    """
+
+    def __init__(self, size, branching=2):
+        self.branching = max(1, branching)
+        # couple of the parents and of the person, -1 if none
+        self.famc = array.array("i", [-1]) * size
+        self.fams = array.array("i", [-1]) * size
+        self.generation = array.array("H", [0]) * size
+        # (husband, wife, children)
+        self.couples = list()
+        todo = deque([0])
+        n = 1
+        while todo and n + 2 <= size:
+            child = todo.popleft()
+            husb, wife = n, n + 1
+            children = [child] + list(range(n + 2, min(n + 1 + self.branching, size)))
+            n += 1 + len(children)
+            self.fams[husb] = self.fams[wife] = len(self.couples)
+            for x in children:
+                self.famc[x] = len(self.couples)
+                self.generation[x] = self.generation[child]
+            self.generation[husb] = self.generation[wife] = self.generation[child] + 1
+            self.couples.append((husb, wife, children))
+            todo.extend((husb, wife))
+        self.size = n
+        for x in (self.famc, self.fams, self.generation):
+            del x[n:]
+        # persons deleted from FamilySearch, still linked to their relatives
+        self.deleted = set()
+
+    @staticmethod
+    def fid(i):
+        """ return the FamilySearch ID of a person number """
+        digits = ""
+        for _ in range(7):
+            i, digit = divmod(i, 36)
+            digits = ALPHABET[digit] + digits
+        return digits[:4] + "-" + digits[4:]
+
+    def index(self, fid):
+        """ return the person number of a FamilySearch ID, None if it is not in the tree """
+        i = int(fid.replace("-", ""), 36)
+        return i if i < self.size else None
+
+    def male(self, i):
+        if self.fams[i] >= 0:
+            return self.couples[self.fams[i]][0] == i
+        return i % 2 == 0
+
+    def year(self, i):
+        return 1990 - 25 * self.generation[i]
+
+    def current(self):
+        return {
+            "users": [
+                {"personId": self.fid(0), "preferredLanguage": "en", "displayName": "Stub User"}
+            ]
+        }
+
+    def person(self, i):
+        """ return the GEDCOM X person of a person number """
+        fid = self.fid(i)
+        male = self.male(i)
+        given = GIVEN[not male][i % len(GIVEN[0])]
+        surname = SURNAMES[(i if male else i // 2) % len(SURNAMES)]
+        year = self.year(i)
+        place = i % len(PLACES)
+        attribution = {"contributor": {"resourceId": "STUB-001"}, "modified": 1500000000000}
+        person = {
+            "id": fid,
+            "living": False,
+            "names": [
+                {
+                    "preferred": True,
+                    "type": "http://gedcomx.org/BirthName",
+                    "nameForms": [
+                        {
+                            "fullText": "%s %s" % (given, surname),
+                            "parts": [
+                                {"type": "http://gedcomx.org/Given", "value": given},
+                                {"type": "http://gedcomx.org/Surname", "value": surname},
+                            ],
+                        }
+                    ],
+                    "attribution": attribution,
+                }
+            ],
+            "gender": {"type": "http://gedcomx.org/%s" % ("Male" if male else "Female")},
+            "facts": [
+                {
+                    "type": "http://gedcomx.org/Birth",
+                    "date": {"original": str(year), "formal": "+%s" % year},
+                    "place": {"original": PLACES[place][0], "description": "#%s" % place},
+                    "attribution": attribution,
+                }
+            ],
+            "sources": [{"descriptionId": "S" + fid, "attribution": attribution}],
+            "display": {
+                "name": "%s %s" % (given, surname),
+                "gender": "Male" if male else "Female",
+                "birthDate": str(year),
+                "lifespan": "%s-%s" % (year, year + 70),
+            },
+        }
+        if i % 4 == 0:
+            person["evidence"] = [{"id": "M" + fid, "resource": "#M" + fid}]
+        return person
+
+    def child_and_parents(self, k, child):
+        husb, wife, _ = self.couples[k]
+        return {
+            "id": "P" + self.fid(child),
+            "parent1": {"resourceId": self.fid(husb)},
+            "parent2": {"resourceId": self.fid(wife)},
+            "child": {"resourceId": self.fid(child)},
+        }
+
+    def couple(self, k):
+        husb, wife, _ = self.couples[k]
+        return {
+            "id": "R" + self.fid(husb),
+            "type": "http://gedcomx.org/Couple",
+            "person1": {"resourceId": self.fid(husb)},
+            "person2": {"resourceId": self.fid(wife)},
+        }
+
+    def persons(self, indexes):
+        """ return the persons.json answer for a list of person numbers, as FamilySearch,
+            with the relationships of these persons and the places of their facts
+        """
+        parents = dict()
+        couples = dict()
+        for i in indexes:
+            if self.famc[i] >= 0:
+                parents[i] = self.child_and_parents(self.famc[i], i)
+            k = self.fams[i]
+            if k >= 0:
+                couples[k] = self.couple(k)
+                for child in self.couples[k][2]:
+                    parents[child] = self.child_and_parents(k, child)
+        places = {i % len(PLACES) for i in indexes}
+        return {
+            "persons": [self.person(i) for i in indexes],
+            "places": [
+                {"id": str(p), "latitude": PLACES[p][1], "longitude": PLACES[p][2]}
+                for p in sorted(places)
+            ],
+            "childAndParentsRelationships": list(parents.values()),
+            "relationships": list(couples.values()),
+        }
+
+    def changes(self, i, what):
+        return {
+            "updated": 1500000000000 + i,
+            "entries": [
+                {
+                    "title": "%s added" % what,
+                    "updated": 1500000000000 + i,
+                    "contributors": [{"name": "Contributor %s" % (i % 7)}],
+                }
+            ],
+        }
+
+    def person_resource(self, i, resource):
+        """ return the answer for a resource of a person, None if there is nothing to return """
+        fid = self.fid(i)
+        if resource is None:
+            data = self.persons([i])
+            data["description"] = "#SD-" + fid
+            return data
+        if resource == "sources":
+            return {
+                "persons": [{"sources": [{"descriptionId": "S" + fid, "attribution": {}}]}],
+                "sourceDescriptions": [
+                    {
+                        "id": "S" + fid,
+                        "about": "https://familysearch.org/ark:/61903/1:1:%s" % fid,
+                        "titles": [{"value": "Birth record of %s" % fid}],
+                        "citations": [{"value": "Parish register, %s" % self.year(i)}],
+                    }
+                ],
+            }
+        if resource == "memories":
+            return {
+                "sourceDescriptions": [
+                    {
+                        "id": "M" + fid,
+                        "mediaType": "image/jpeg",
+                        "about": "https://familysearch.org/photos/artifacts/%s" % i,
+                        "links": {},
+                        "titles": [{"value": "Portrait"}],
+                    }
+                ]
+            }
+        if resource == "notes":
+            if i % 3:
+                return None
+            note = {"subject": "Biography", "text": "Born in %s." % PLACES[i % len(PLACES)][0]}
+            return {"persons": [{"notes": [note]}]}
+        if resource == "changes":
+            return self.changes(i, "Birth")
+        if resource == "ordinances":
+            ordinance = {
+                "type": "http://lds.org/Baptism",
+                "status": "http://familysearch.org/v1/Completed",
+                "date": {"formal": "+%s" % (self.year(i) + 9)},
+                "templeCode": "SLAKE",
+            }
+            return {"persons": [{"ordinances": [ordinance]}]}
+        raise KeyError(resource)
+
+    def couple_resource(self, k, resource):
+        """ return the answer for a resource of a couple, None if there is nothing to return """
+        husb = self.couples[k][0]
+        fid = self.fid(husb)
+        if resource is None:
+            data = self.couple(k)
+            data["facts"] = [
+                {
+                    "type": "http://gedcomx.org/Marriage",
+                    "date": {"original": str(self.year(husb) + 25)},
+                    "attribution": {},
+                }
+            ]
+            data["sources"] = [{"descriptionId": "C" + fid, "attribution": {}}]
+            return {"relationships": [data]}
+        if resource == "sources":
+            return {
+                "sourceDescriptions": [
+                    {"id": "C" + fid, "titles": [{"value": "Marriage record of %s" % fid}]}
+                ]
+            }
+        if resource == "notes":
+            return None
+        if resource == "changes":
+            return self.changes(husb, "Marriage")
+        raise KeyError(resource)
+
+    def answer(self, url):
+        """ answer a platform request as FamilySearch, raise KeyError for a missing resource,
+            Deleted for a resource of a deleted person
+            :param url: the path and query of the request
+            return the JSON data, None if there is nothing to return, and the number of
+            persons it contains
+        """
+        url = urlsplit(url)
+        if url.path == "/platform/users/current.json":
+            return self.current(), 0
+        if url.path in ("/platform/tree/persons.json", "/platform/tree/persons"):
+            fids = parse_qs(url.query).get("pids", [""])[0].split(",")
+            indexes = [self.index(fid) for fid in fids if FID.fullmatch(fid)]
+            indexes = [i for i in indexes if i is not None and i not in self.deleted]
+            return (self.persons(indexes) if indexes else None), len(indexes)
+        match = PERSON.fullmatch(url.path)
+        if match:
+            fid, resource = match.groups()
+            i = self.index(fid)
+            if i is None:
+                raise KeyError(fid)
+            if i in self.deleted:
+                raise Deleted(fid)
+            return self.person_resource(i, resource), int(resource is None)
+        match = COUPLE.fullmatch(url.path)
+        if match:
+            fid, resource = match.groups()
+            i = self.index(fid)
+            if i is None or self.fams[i] < 0:
+                raise KeyError(fid)
+            return self.couple_resource(self.fams[i], resource), 0
+        raise KeyError(url.path)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Answer the requests to the FamilySearch servers made by this project: the login
+        redirect chain, then the platform resources, which need the session cookie
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body=b"", headers=()):
+        self.send_response(code)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, path):
+        self.send(302, headers=[("Location", self.server.url + path)])
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        if url.path != "/cis-web/oauth2/v3/authorization" or form.get("params") != ["stub"]:
+            self.send(200, b"Invalid Oauth2 Request")
+        elif not form.get("userName") or not form.get("password"):
+            self.send(200, b"The username or password was incorrect")
+        else:
+            self.redirect("/auth/familysearch/callback?code=stub")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/auth/familysearch/login":
+            return self.redirect("/cis-web/oauth2/v3/authorization?client_id=stub")
+        if url.path == "/cis-web/oauth2/v3/authorization":
+            return self.send(200, b'<form><input type="hidden" name="params" value="stub"></form>')
+        if url.path == "/auth/familysearch/callback":
+            return self.send(200, headers=[("Set-Cookie", "fssessionid=%s; Path=/" % SESSION)])
+        if "fssessionid=%s" % SESSION not in self.headers.get("Cookie", ""):
+            return self.send(401)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        try:
+            data, persons = self.server.tree.answer(self.path)
+        except Deleted:
+            return self.send(410)
+        except KeyError:
+            return self.send(404)
+        with self.server.lock:
+            self.server.counter += 1
+            self.server.persons += persons
+        if data is None:
+            return self.send(204)
+        body = json.dumps(data).encode("utf-8")
+        self.send(200, body, [("Content-Type", "application/x-fs-v1+json")])
+
+
+class StubServer(ThreadingHTTPServer):
+    """ A local stand-in for the FamilySearch servers, serving a SyntheticTree
+        :param tree: a SyntheticTree
+        :param latency: seconds waited before answering each platform request
+        :param port: the TCP port on localhost, 0 for any free port
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, tree, latency=0.0, port=0):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.tree = tree
+        self.latency = latency
+        self.url = "http://127.0.0.1:%s" % self.server_address[1]
+        self.lock = threading.Lock()
+        # platform requests answered and persons sent
+        self.counter = 0
+        self.persons = 0
+
+    def start(self):
+        """ serve in a background thread
+            return the server
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def benchmark(size, branching=2, latency=0.0, options=()):
+    """ Download a whole synthetic tree with getmyancestors, run as a separate process
+        against a local stub server, its peak memory being that of this process only
+        :param size: maximum number of persons of the tree
+        :param branching: number of children of each couple
+        :param latency: seconds waited by the server before answering each request
+        :param options: more getmyancestors options, like -m or -r
+        return a dict of the persons downloaded, HTTP requests, seconds and peak RSS in MB
+    """
+    tree = SyntheticTree(size, branching)
+    server = StubServer(tree, latency).start()
+    directory = tempfile.mkdtemp()
+    outfile = os.path.join(directory, "tree.ged")
+    # enough generations to reach the first couple, then one down for the siblings
+    command = [sys.executable, "-c", CHILD, server.url, "-u", "stub", "-p", "stub"]
+    command += ["-a", str(max(tree.generation) + 1), "-d", "1", "-o", outfile] + list(options)
+    try:
+        start = time.time()
+        process = subprocess.Popen(
+            command, cwd=os.path.dirname(os.path.abspath(gt.__file__)), stdout=subprocess.DEVNULL
+        )
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.time() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        with open(outfile, "rb") as f:
+            persons = f.read().count(b" INDI\n")
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    rss = usage.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+    return {"persons": persons, "requests": server.counter, "seconds": seconds, "rss": rss}
+
+
+class CannedSession(gt.Session):
+    """ A Session answering from a SyntheticTree in memory, for the micro-benchmarks
+        answers are kept, so that repeated runs only measure getmyancestors
+        :param tree: a SyntheticTree
+    """
+
+    def __init__(self, tree):
+        self.synthetic = tree
+        self.answers = dict()
+        super().__init__("stub", "stub", timeout=0)
+
+    def login(self):
+        self.set_current()
+        return True
+
+    def get_url(self, url):
+        self.counter += 1
+        if url not in self.answers:
+            try:
+                self.answers[url] = self.synthetic.answer(url)[0]
+            except KeyError:
+                self.answers[url] = None
+        return self.answers[url]
+
+
+def canned_tree(size, branching=2):
+    """ return the Tree of a whole SyntheticTree, downloaded from a CannedSession
+        with marriages, notes and contributors
+    """
+    fs = CannedSession(SyntheticTree(size, branching))
+    tree = gt.Tree(fs)
+    tree.add_indis([fs.fid])
+    todo = {fs.fid}
+    while todo:
+        todo = tree.add_parents(todo) - todo
+    tree.add_children(set(tree.indi))
+    tree.add_spouses(set(tree.indi))
+    for indi in tree.indi.values():
+        indi.get_notes()
+        indi.get_contributors()
+    for fam in tree.fam.values():
+        fam.get_notes()
+    tree.reset_num()
+    return tree
+
+
+def micro_cases(size):
+    """ the CPU bound steps growing with the size of the tree, set up on a canned tree
+        return a dict of name: function to time
+    """
+    tree = canned_tree(size)
+    file = io.StringIO()
+    tree.print(file)
+    gedcom = file.getvalue()
+    persons = tree.fs.synthetic.persons(range(tree.fs.synthetic.size))["persons"]
+    strings = ["0 @N%s@ NOTE %s" % (i, "word " * (i % 120)) for i in range(size)]
+    # the notes of two files to merge
+    merged = gt.Tree()
+    for ged in mm.parse_files([io.StringIO(gedcom), io.StringIO(gedcom)], merged, 1):
+        mm.merge_gedcom(ged, merged)
+
+    def add_data():
+        other = gt.Tree(tree.fs)
+        for person in persons:
+            gt.Indi(person["id"], other).add_data(person)
+
+    return {
+        "cont": lambda: [gt.cont(string) for string in strings],
+        "add_data": add_data,
+        "reset_num": tree.reset_num,
+        "print": lambda: tree.print(io.StringIO()),
+        "parse": lambda: mm.Gedcom(io.StringIO(gedcom), gt.Tree()),
+        "merge_notes": lambda: mm.merge_notes(merged),
+    }
+
+
+def best(function, repeat=3):
+    """ return the shortest time of several calls of a function, in seconds """
+    timings = list()
+    for _ in range(repeat):
+        with gt.no_gc():
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        gc.collect()
+    return min(timings)
+
+
+def calibrate(repeat=3):
+    """ time a fixed pure Python workload, to compare timings across machines """
+
+    def work():
+        squares = dict()
+        for i in range(200000):
+            squares[str(i)] = i * i
+        return sorted(squares, key=squares.get)
+
+    return best(work, repeat)
+
+
+def micro(sizes, repeat=3):
+    """ Time the micro-benchmarks on canned trees of increasing sizes
+        :param sizes: the numbers of persons of the trees
+        :param repeat: the number of runs of each micro-benchmark, the best one is kept
+        return a dict of the calibration time and of the timings by name and size
+    """
+    results = {"calibration": calibrate(repeat), "cases": dict()}
+    for size in sizes:
+        for name, function in micro_cases(size).items():
+            results["cases"].setdefault(name, dict())[str(size)] = best(function, repeat)
+    return results
+
+
+def regressions(results, baseline, threshold=0.25):
+    """ Compare micro-benchmark results to a baseline, scaled by their calibration times
+        :param threshold: the slowdown allowed, as a fraction of the baseline
+        return a list of (name, size, ratio to the baseline) of the regressions
+    """
+    slower = list()
+    scale = baseline["calibration"] / results["calibration"]
+    for name, timings in results["cases"].items():
+        for size, seconds in timings.items():
+            reference = baseline["cases"].get(name, dict()).get(size)
+            if reference and seconds * scale > reference * (1 + threshold):
+                slower.append((name, int(size), seconds * scale / reference))
+    return slower
+
+
+class TestStub(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(SyntheticTree(100, 3)).start()
+        self.urls = gt.LOGIN_URL, gt.IDENT_URL, gt.API_URL
+        gt.LOGIN_URL = gt.IDENT_URL = gt.API_URL = self.server.url
+
+    def tearDown(self):
+        gt.LOGIN_URL, gt.IDENT_URL, gt.API_URL = self.urls
+        self.server.stop()
+
+    def test_tree(self):
+        tree = SyntheticTree(100, 3)
+        self.assertEqual(tree.size, 100)
+        self.assertEqual(tree.index(tree.fid(99)), 99)
+        self.assertIsNone(tree.index(tree.fid(100)))
+        # the root, then its parents and their other children
+        self.assertEqual(tree.couples[0], (1, 2, [0, 3, 4]))
+        self.assertEqual([tree.generation[i] for i in range(5)], [0, 1, 1, 0, 0])
+
+    def test_session(self):
+        self.assertFalse(gt.Session("stub", "", timeout=1).logged)
+        fs = gt.Session("stub", "stub", timeout=1)
+        self.assertTrue(fs.logged)
+        self.assertEqual(fs.fid, "0000-000")
+        tree = gt.Tree(fs)
+        tree.add_indis([fs.fid])
+        todo = {fs.fid}
+        while todo:
+            todo = tree.add_parents(todo) - todo
+        tree.add_children(set(tree.indi))
+        tree.add_spouses(set(tree.indi))
+        self.assertEqual(len(tree.indi), 100)
+        fam = tree.fam[("0000-001", "0000-002")]
+        self.assertEqual(fam.chil_fid, {"0000-000", "0000-003", "0000-004"})
+        self.assertEqual(len(fam.facts), 1)
+        self.assertEqual(len(tree.indi["0000-000"].memories), 1)
+        self.assertEqual(self.server.persons, 100)
+
+    def test_archive(self):
+        """ a tree rebuilt from an archive is the tree downloaded while archiving it,
+            with no request to FamilySearch
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            archive = os.path.join(directory, "tree.jsonl.gz")
+            for i, options in enumerate((["--archive", archive], ["--from-archive", archive])):
+                command = [sys.executable, "-c", CHILD, self.server.url, "-u", "stub"]
+                command += ["-p", "stub", "-a", "3", "-d", "1", "-m"]
+                command += ["-o", os.path.join(directory, "tree%s.ged" % i)] + options
+                subprocess.run(
+                    command,
+                    cwd=os.path.dirname(os.path.abspath(gt.__file__)),
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    check=True,
+                )
+                if i == 0:
+                    requests = self.server.counter
+            self.assertEqual(self.server.counter, requests)
+            # records are numbered in the order of the downloads, compared by content
+            with open(os.path.join(directory, "tree0.ged"), encoding="utf-8") as f, open(
+                os.path.join(directory, "tree1.ged"), encoding="utf-8"
+            ) as g, dm.Records(f) as old, dm.Records(g) as new:
+                self.assertEqual(len(new.indi), len(old.indi))
+                self.assertGreater(len(old.fam), 0)
+                self.assertEqual(list(dm.diff(old, new)), [])
+
+    def test_archive_errors(self):
+        """ the archive can't be written to stdout, and keeps the responses of a failed run """
+        with tempfile.TemporaryDirectory() as directory:
+            archive = os.path.join(directory, "tree.jsonl.gz")
+            for child, options in ((CHILD, ["-"]), (FAILING, [archive])):
+                command = [sys.executable, "-c", child, self.server.url, "-u", "stub"]
+                command += ["-p", "stub", "-o", os.path.join(directory, "tree.ged")]
+                result = subprocess.run(
+                    command + ["--archive"] + options,
+                    cwd=os.path.dirname(os.path.abspath(gt.__file__)),
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                self.assertNotEqual(result.returncode, 0)
+            with open(archive, "rb") as f:
+                lines = gt.decompress(f.read()).splitlines()
+            self.assertEqual(len(lines), self.server.counter)
+
+    def test_micro(self):
+        results = micro([30], repeat=1)
+        self.assertEqual(
+            sorted(results["cases"]),
+            ["add_data", "cont", "merge_notes", "parse", "print", "reset_num"],
+        )
+        self.assertEqual(regressions(results, results), [])
+        # a machine twice as slow, on which parse was as fast
+        baseline = json.loads(json.dumps(results))
+        baseline["calibration"] *= 2
+        for name, timings in baseline["cases"].items():
+            if name != "parse":
+                timings["30"] *= 2
+        self.assertEqual([x[:2] for x in regressions(results, baseline)], [("parse", 30)])
+
+    def test_benchmark(self):
+        result = benchmark(50, options=["-m", "-r"])
+        self.assertEqual(result["persons"], SyntheticTree(50).size)
+        self.assertGreater(result["requests"], result["persons"])
+        self.assertGreater(result["rss"], 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark getmyancestors against a local FamilySearch stub server",
+        add_help=False,
+        usage="benchmyancestors.py [options]",
+    )
+    try:
+        parser.add_argument(
+            "-s",
+            "--sizes",
+            metavar="<INT>",
+            nargs="+",
+            type=int,
+            default=[1000, 10000, 100000],
+            help="Number of persons of the synthetic trees [1000 10000 100000]",
+        )
+        parser.add_argument(
+            "-b",
+            "--branching",
+            metavar="<INT>",
+            type=int,
+            default=2,
+            help="Number of children of each couple [2]",
+        )
+        parser.add_argument(
+            "-l",
+            "--latency",
+            metavar="<FLOAT>",
+            type=float,
+            default=0.0,
+            help="Seconds waited by the server before answering each request [0.0]",
+        )
+        parser.add_argument(
+            "-g",
+            "--getmyancestors",
+            metavar="<STR>",
+            type=shlex.split,
+            default=[],
+            help='More getmyancestors options, like "-m -r" []',
+        )
+        parser.add_argument(
+            "--micro",
+            action="store_true",
+            default=False,
+            help="Run the micro-benchmarks of the CPU bound steps on canned trees [False]",
+        )
+        parser.add_argument(
+            "--baseline",
+            metavar="<FILE>",
+            type=str,
+            default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks.json"),
+            help="Micro-benchmark baselines [benchmarks.json]",
+        )
+        parser.add_argument(
+            "--save",
+            action="store_true",
+            default=False,
+            help="Save the micro-benchmark results as the new baselines [False]",
+        )
+        parser.add_argument(
+            "-t",
+            "--threshold",
+            metavar="<FLOAT>",
+            type=float,
+            default=0.25,
+            help="Slowdown from a micro-benchmark baseline reported as a regression [0.25]",
+        )
+        parser.add_argument(
+            "-r",
+            "--repeat",
+            metavar="<INT>",
+            type=int,
+            default=3,
+            help="Number of runs of each micro-benchmark, the best one is kept [3]",
+        )
+        parser.add_argument(
+            "--serve",
+            metavar="<PORT>",
+            type=int,
+            default=None,
+            help="Serve the tree of the first size on this port until interrupted [None]",
+        )
+    except TypeError:
+        sys.stderr.write("Python >= 3.4 is required to run this script\n")
+        sys.stderr.write("(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n")
+        exit(2)
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit as e:
+        print(e.code)
+        parser.print_help()
+        exit(2)
+
+    if args.serve is not None:
+        tree = SyntheticTree(args.sizes[0], args.branching)
+        server = StubServer(tree, args.latency, args.serve)
+        sys.stderr.write(
+            "Serving %s persons on %s, root %s\n" % (tree.size, server.url, tree.fid(0))
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+        exit(0)
+
+    if args.micro:
+        results = micro(args.sizes, args.repeat)
+        baseline = None
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        scale = baseline["calibration"] / results["calibration"] if baseline else 1
+        print("%-12s %10s %10s %10s" % ("benchmark", "persons", "seconds", "baseline"))
+        for name, timings in results["cases"].items():
+            for size, seconds in timings.items():
+                reference = baseline["cases"].get(name, dict()).get(size) if baseline else None
+                print(
+                    "%-12s %10s %10.4f %10s"
+                    % (name, size, seconds, "%.4f" % (reference / scale) if reference else "-")
+                )
+        if args.save:
+            with open(args.baseline, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write("\n")
+            exit(0)
+        slower = regressions(results, baseline, args.threshold) if baseline else []
+        for name, size, ratio in slower:
+            sys.stderr.write(
+                "REGRESSION: %s on %s persons is %.0f%% slower than the baseline\n"
+                % (name, size, 100 * (ratio - 1))
+            )
+        exit(1 if slower else 0)
+
+    print(
+        "%10s %10s %10s %12s %12s %14s"
+        % ("persons", "requests", "seconds", "persons/s", "requests/s", "peak RSS (MB)")
+    )
+    for size in args.sizes:
+        result = benchmark(size, args.branching, args.latency, args.getmyancestors)
+        print(
+            "%10d %10d %10.1f %12.1f %12.1f %14.1f"
+            % (
+                result["persons"],
+                result["requests"],
+                result["seconds"],
+                result["persons"] / result["seconds"],
+                result["requests"] / result["seconds"],
+                result["rss"],
+            )
+        )
+        sys.stdout.flush()
@@ -80,6 +80,28 @@ def get_arguments():
         default='bioline',
         help="Type of ancestors [bioline]",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="<INT>",
+        type=int,
+        default=4,
+        help="Number of concurrent FamilySearch requests [4]",
+    )
+    parser.add_argument(
+        "-c",
+        "--changes-first",
+        action="store_true",
+        help="Download persons only when their latest change differs from the database",
+    )
+    parser.add_argument(
+        "-f",
+        "--full-verify",
+        metavar="<INT>",
+        type=int,
+        default=30,
+        help="Days after which unchanged persons are downloaded in full again [30]",
+    )
     parser.add_argument(
         "-d",
         "--debug",
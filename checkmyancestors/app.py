@@ -26,10 +26,21 @@
 """
 
 # global imports
+import argparse
+import contextlib
+import copy
+import functools
+import io
 import json
+import os
 import sys
+import tempfile
 import time
+import unittest
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from unittest import mock
 from checkmyancestors import databasemodule as dbm
 from checkmyancestors import sessionmodule as sem
 
@@ -104,8 +115,8 @@ class PersonObj:
             self.gender = None
             self.born = None
             self.lifespan = None
-            self.fatherids = []
-            self.motherids = []
+            self.fatherids = json.dumps([])
+            self.motherids = json.dumps([])
             self.relationships = None
         if fsperson_changes is not None:
             # FamilySearch change history(dict) for person
@@ -141,13 +152,25 @@ class PersonObj:
                 "' not found in FS.childAndParentsRelationships.")
             return []
 
+    def at_generation(self, generation):
+        """ the person reached at a generation, the download being shared by all paths
+            Args:
+                generation (int): generation relative to reference person
+            Return:
+                (PersonObj): a copy, with the generation and an undefined status
+        """
+        person = copy.copy(self)
+        person.generation = generation
+        person.status = 'undefined'
+        return person
+
     def has_bad_requests(self):
-        """ check for HTTP error code 429: too many requests
+        """ check for HTTP error code 429: too many requests, or 503: service unavailable
             Return:
-                (bool): True = code 429 happened, False = not
+                (bool): True = code 429 or 503 happened, False = not
         """
         return_code = False
-        valid_codes = (200, 301, 404, 410, 429)
+        valid_codes = (200, 301, 404, 410, 429, 503)
         status_list = json.loads(self.status_list)
         for code in status_list:
             if code not in valid_codes:
@@ -156,6 +179,9 @@ class PersonObj:
         if 429 in status_list:
             write_log('error', 'HTTP error 429: too many requests')
             return_code = True  # breaks outer loop
+        if 503 in status_list:
+            write_log('error', 'HTTP error 503: service unavailable')
+            return_code = True  # breaks outer loop
         #
         return return_code
 
@@ -246,7 +272,50 @@ def write_log(level, text):
 # ----------
 
 
-def get_person_object(person_id, generation, reference_id, timestamp, fs):
+def split_persons(fspersons, person_ids):
+    """ split a persons.json response into the responses of each person
+        Args:
+            fspersons (dict): family search dictionary downloaded for several person ids
+            person_ids (list): the person ids requested
+        Returns:
+            (dict): person id: family search dictionary, with the person and the
+                    relationships it is part of, for the persons in the response
+    """
+    def involves(rel, person_id):
+        for role in ("parent1", "parent2", "child", "person1", "person2"):
+            if role in rel and rel[role].get("resourceId") == person_id:
+                return True
+        return False
+
+    result = {}
+    if not fspersons:
+        return result
+    for person in fspersons.get("persons", []):
+        if person.get("id") not in person_ids:
+            continue
+        fsperson = {"persons": [person]}
+        for key in ("childAndParentsRelationships", "relationships"):
+            fsperson[key] = [
+                rel for rel in fspersons.get(key, []) if involves(rel, person["id"])]
+        result[person["id"]] = fsperson
+    return result
+
+
+def get_persons(person_ids, fs):
+    """ download a batch of persons from the FamilySearch site in one request
+        Args:
+            person_ids (list): at most sessionmodule.MAX_PERSONS person ids
+            fs (Session): logged in session object
+        Returns:
+            (int, dict): HTTP status code of the request,
+                         and person id: family search dictionary, see split_persons
+    """
+    fspersons = fs.get_persons(person_ids)
+    return fs.status_code, split_persons(fspersons, set(person_ids))
+
+
+def get_person_object(
+        person_id, generation, reference_id, timestamp, fs, batch=None, fs_change=None):
     """ download person data from the FamilySearch site
         Args:
             person_id (str): person id in family search
@@ -254,13 +323,28 @@ def get_person_object(person_id, generation, reference_id, timestamp, fs):
             reference_id (str): reference peerson (generation 0)
             timestamp (int): timestamp for the whole session
             fs (Session): logged in session object
+            batch (Future): download of a batch of persons with get_persons, or None
+            fs_change (dict): the change history already downloaded, or None
         Returns:
             (PersonObj)
     """
-    fs_person = fs.get_person(person_id)
-    fs_status = [fs.status_code]
-    fs_change = fs.get_change_history_person(person_id)
-    fs_status.append(fs.status_code)
+    status_code, fs_persons = batch.result() if batch else (None, {})
+    fs_person = fs_persons.get(person_id)
+    if fs_person is not None:
+        fs_status = [200]
+    elif batch and status_code not in (200, 204):
+        # the whole batch failed (throttled or unavailable), no request for each person
+        return PersonObj(
+            person_id, generation, reference_id, [status_code], None, timestamp, None)
+    else:
+        # alone, to get the HTTP status code of merged, deleted or missing persons
+        fs_person = fs.get_person(person_id)
+        fs_status = [fs.status_code]
+    if fs_change is not None:
+        fs_status.append(200)
+    else:
+        fs_change = fs.get_change_history_person(person_id)
+        fs_status.append(fs.status_code)
     return PersonObj(
         person_id,
         generation,
@@ -270,25 +354,51 @@ def get_person_object(person_id, generation, reference_id, timestamp, fs):
         timestamp,
         fs_change)
 
+
+def get_latest_change(person_id, fs):
+    """ download the latest change history entry of a person from the FamilySearch site
+        Args:
+            person_id (str): person id in family search
+            fs (Session): logged in session object
+        Returns:
+            (int, dict): HTTP status code, change history with the latest entry or None
+    """
+    fs_change = fs.get_change_history_person(person_id, count=1)
+    return fs.status_code, fs_change
+
+
+def is_unchanged(row, fs_change, timestamp, interval):
+    """ check the latest persisted row of a person against the latest change history entry
+        Args:
+            row (dict): the latest persisted row of the person, or None
+            fs_change (dict): the latest change history entry downloaded, or None
+            timestamp (int): timestamp for the whole session
+            interval (int): seconds after which the person is downloaded again in full
+        Returns:
+            (bool) True: the persisted person can be used instead of a download
+    """
+    return (
+        row is not None and fs_change is not None
+        and row['status'] != 'deleted' and row.get('fsperson') not in (None, 'null')
+        and read_nested_dict(fs_change, "updated") == row['last_modified']
+        and timestamp - (row['verified'] or 0) < interval)
+
 # ----------
 
 
-def verify_data(reference_id, checklist):
+def verify_data(reference_id, checklist, db):
     """ compare checklist with the persisted data
         Args:
             reference_id (str): the reference person who's ancestors are queried
-            checklist (list): list of all persons (str) queried
+            checklist (dict): all persons (str) queried
+            db (Database): the database of the session
     """
-    db = dbm.Database()  # SQLlite database
-    persons = db.get_persons(reference_id)
-    for person in persons:
-        pid = person['personid']
-        if pid not in checklist:
-            write_log(
-                'error',
-                'Found person ' +
-                pid +
-                ' in database, but not in FamilySearch (missing).')
+    for pid in db.get_missing_persons(reference_id, checklist):
+        write_log(
+            'error',
+            'Found person ' +
+            pid +
+            ' in database, but not in FamilySearch (missing).')
 
 # ----------
 
@@ -301,12 +411,14 @@ def checkmyancestors(args):
     now = datetime.now()
     timestamp = int(datetime.timestamp(now))
     debug_app = (args.debug == 'on')
+    interval = args.full_verify * 24 * 3600
 
     # objects
     db = dbm.Database()  # SQLlite database
     fs = sem.Session(args.username, args.password, timeout=10)  # FamilySearch
     if not fs.logged:
         write_log('info', "Failed to login as user: " + args.username)
+        db.close()
         return
     write_log('info', "Successfully logged in as user: " + args.username)
 
@@ -314,41 +426,103 @@ def checkmyancestors(args):
     reference_id = fs.fid
     if args.individual is not None:
         reference_id = args.individual
+    # the latest rows of the ancestors, compared with the downloads
+    db.load_persons(reference_id)
 
     # initialize loop
-    checklist = []
+    visited = {}  # person id: generations at which the person was reached
     changes = []
     person_count = 0
-    todolist = []
-    todolist.append(
-        {'personid': reference_id,
-         'generation': 0,
-         'referenceid': reference_id,
-         'childid': 'undefined'})
+    todolist = deque()
+    # persons are downloaded by a pool of threads, generation by generation,
+    # and processed one at a time in the order of the list
+    # each person is downloaded once, ancestors reached again through pedigree collapse
+    # reuse the download
+    executor = ThreadPoolExecutor(max_workers=max(1, args.jobs))
+    downloads = {}  # person id: Future of the PersonObj
+    stored = set()  # person ids taken from the database instead of FamilySearch
+
+    def add_todo(personid, generation, childid):
+        """ queue a person
+            Args:
+                personid (str): person id in family search
+                generation (int): generation relative to the reference person
+                childid (str): the person id of the child
+        """
+        todolist.append(
+            {'personid': personid,
+             'generation': generation,
+             'referenceid': reference_id,
+             'childid': childid})
+
+    def start_downloads():
+        """ start downloading the queued persons, the next generation:
+            in persons.json batches, then their change histories one by one
+            with changes first, the latest change history entry of each person is downloaded
+            first, and the persons which did not change since their latest row are not
+            downloaded again, unless the full-verify interval has elapsed
+        """
+        todos = [todo for todo in todolist if 'person' not in todo]
+        personids = list(dict.fromkeys(
+            todo['personid'] for todo in todos if todo['personid'] not in downloads))
+        fs_changes = {}
+        unchanged = {}
+        throttled = {}
+        if args.changes_first:
+            latest = executor.map(lambda personid: get_latest_change(personid, fs), personids)
+            for personid, (status_code, fs_change) in zip(personids, latest):
+                fs_changes[personid] = fs_change
+                if status_code in (429, 503):
+                    throttled[personid] = status_code
+                    continue
+                row = db.get_latest_person(personid, reference_id)
+                if is_unchanged(row, fs_change, timestamp, interval):
+                    unchanged[personid] = row
+        fetch = [personid for personid in personids
+                 if personid not in unchanged and personid not in throttled]
+        for i in range(0, len(fetch), sem.MAX_PERSONS):
+            batch = executor.submit(get_persons, fetch[i:i + sem.MAX_PERSONS], fs)
+            for personid in fetch[i:i + sem.MAX_PERSONS]:
+                downloads[personid] = executor.submit(
+                    get_person_object, personid, None, reference_id,
+                    timestamp, fs, batch, fs_changes.get(personid))
+        for personid, status_code in throttled.items():
+            # no more requests while throttled, the status stops the query
+            downloads[personid] = Future()
+            downloads[personid].set_result(PersonObj(
+                personid, None, reference_id, [status_code], None, timestamp, None))
+        for personid, row in unchanged.items():
+            stored.add(personid)
+            downloads[personid] = Future()
+            downloads[personid].set_result(PersonObj(
+                personid, None, reference_id, [200, 200], json.loads(row['fsperson']),
+                timestamp, fs_changes[personid]))
+        for todo in todos:
+            todo['person'] = downloads[todo['personid']]
+
+    add_todo(reference_id, 0, 'undefined')
 
     # loop thru all ancestors in the list
     while todolist:
 
         # get person data from FS
-        todo = todolist.pop(0)
-        person = get_person_object(
-            todo['personid'],
-            todo['generation'],
-            todo['referenceid'],
-            timestamp,
-            fs)
+        if 'person' not in todolist[0]:
+            start_downloads()
+        todo = todolist.popleft()
+        person = todo['person'].result().at_generation(todo['generation'])
 
         # check for circular references
-        if (person.personid in checklist):
+        generations = visited.setdefault(person.personid, [])
+        if generations:
             write_log('info',
                 'Circular reference encountered for person ID: '+person.personid+". Parent of: "+todo['childid']+".")
-            if checklist.count(person.personid)>2:
+            if len(generations)>2:
                 write_log('info', 'Circular reference counted more than twice. Stopped query.')
                 break
-        checklist.append(person.personid)
+        generations.append(person.generation)
 
         # check lifespan
-        if (person.lifespan[0:4].isdigit()):
+        if (person.lifespan and person.lifespan[0:4].isdigit()):
             year = int(person.lifespan[0:4])
             if year < 1600:
                 write_log('info', 'Reached time limit of 1600 A.D. Stopped query.')
@@ -364,33 +538,149 @@ def checkmyancestors(args):
 
         # persist person to database
         changes = changes + db.persist_person(person)
+        if person.personid not in stored:
+            db.set_verified(person.personid, person.referenceid, timestamp)
         write_log('info',
-                  'Generation: '+str(person.generation)+', '+
-                  'Person: ID='+person.personid+', Name='+person.name+' ('+person.lifespan+'), '+
-                  'Parent of '+todo['childid']+'.')
+                  'Generation: %s, Person: ID=%s, Name=%s (%s), Parent of %s.' % (
+                      person.generation, person.personid, person.name, person.lifespan,
+                      todo['childid']))
         person_count += 1
 
         # check person's father
         for fatherid in json.loads(person.fatherids):
             if ((args.type == 'bioline') or (args.type == 'patriline')):
-                todolist.append(
-                    {'personid': fatherid,
-                     'generation': person.generation + 1,
-                     'referenceid': reference_id,
-                     'childid': person.personid})
+                add_todo(fatherid, person.generation + 1, person.personid)
 
         # check person's mother
         for motherid in json.loads(person.motherids):
             if ((args.type == 'bioline') or (args.type == 'matriline')):
-                todolist.append(
-                    {'personid': motherid,
-                     'generation': person.generation + 1,
-                     'referenceid': reference_id,
-                     'childid': person.personid})
+                add_todo(motherid, person.generation + 1, person.personid)
 
-    verify_data(reference_id, checklist)
+    # downloads of the persons left when the query stopped
+    for todo in todolist:
+        if 'person' in todo:
+            todo['person'].cancel()
+    executor.shutdown()
+
+    verify_data(reference_id, visited, db)
     db.persist_session(timestamp, reference_id, person_count, changes)
-    write_log('info', 'End of query, '+str(len(checklist))+' persons found.')
+    db.close()
+    write_log('info', 'End of query, '+str(sum(map(len, visited.values())))+' persons found.')
+
+# ----------
+
+
+class TestApp(unittest.TestCase):
+    """ the crawl against the local FamilySearch stub of benchmyancestors """
+
+    class ThrottledSession:
+        """ a session of which every request is answered with 429: too many requests """
+        status_code = 429
+
+        def get_persons(self, person_ids):
+            return None
+
+        def get_person(self, person_id):
+            raise AssertionError('request for a person of a throttled batch')
+
+        def get_change_history_person(self, person_id, count=None):
+            return None
+
+    def setUp(self):
+        # the stub server, from the root of the repository
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import benchmyancestors
+        self.tree = benchmyancestors.SyntheticTree(200)
+        self.server = benchmyancestors.StubServer(self.tree).start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def check(self, jobs, database=None, changes_first=False):
+        """ check the ancestors of the stub tree in a database, new by default,
+            return its persons
+        """
+        filename = os.path.join(self.tmp.name, database or 'jobs%s.db' % jobs)
+        args = argparse.Namespace(
+            username='stub', password='stub', individual=None, type='bioline', debug='off',
+            jobs=jobs, changes_first=changes_first, full_verify=30)
+        url = self.server.url
+        with mock.patch.multiple(sem, LOGIN_URL=url, IDENT_URL=url, API_URL=url), \
+                mock.patch.object(dbm, 'Database', functools.partial(dbm.Database, filename)), \
+                contextlib.redirect_stderr(io.StringIO()):
+            checkmyancestors(args)
+        with dbm.Database(filename) as db:
+            rows = db.get_persons(self.tree.fid(0))
+        return sorted(
+            (row['personid'], row['generation'], row['name'], row['fatherids'],
+             row['motherids'], row['relationships']) for row in rows)
+
+    def test_split_persons(self):
+        fspersons = self.tree.persons([0, 1, 2])
+        persons = split_persons(fspersons, {self.tree.fid(0), self.tree.fid(1)})
+        self.assertEqual(sorted(persons), [self.tree.fid(0), self.tree.fid(1)])
+        person = PersonObj(
+            self.tree.fid(0), 0, self.tree.fid(0), [200], persons[self.tree.fid(0)], 0, None)
+        self.assertEqual(json.loads(person.fatherids), [self.tree.fid(1)])
+        self.assertEqual(json.loads(person.motherids), [self.tree.fid(2)])
+        self.assertEqual(split_persons(None, {self.tree.fid(0)}), {})
+
+    def test_throttled_batch(self):
+        fs = self.ThrottledSession()
+        batch = Future()
+        batch.set_result(get_persons(['AAAA-001', 'AAAA-002'], fs))
+        person = get_person_object('AAAA-001', 1, 'AAAA-000', 0, fs, batch)
+        self.assertEqual(person.status_list, '[429]')
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertTrue(person.has_bad_requests())
+        self.assertEqual(get_latest_change('AAAA-001', fs), (429, None))
+
+    def test_is_unchanged(self):
+        row = {'status': 'created', 'fsperson': '{}', 'last_modified': 1000, 'verified': 100}
+        day = 24 * 3600
+        self.assertTrue(is_unchanged(row, {'updated': 1000}, 100 + day, 30 * day))
+        # changed
+        self.assertFalse(is_unchanged(row, {'updated': 2000}, 100 + day, 30 * day))
+        self.assertFalse(is_unchanged(row, None, 100 + day, 30 * day))
+        # no row, or deleted
+        self.assertFalse(is_unchanged(None, {'updated': 1000}, 100 + day, 30 * day))
+        deleted = dict(row, status='deleted')
+        self.assertFalse(is_unchanged(deleted, {'updated': 1000}, 100 + day, 30 * day))
+        # no data stored, as for a person answered with 404 or 410
+        empty = dict(row, fsperson='null')
+        self.assertFalse(is_unchanged(empty, {'updated': 1000}, 100 + day, 30 * day))
+        # verified longer ago than the full-verify interval
+        self.assertFalse(is_unchanged(row, {'updated': 1000}, 100 + 31 * day, 30 * day))
+
+    def test_changes_first(self):
+        first = self.check(4)
+        persons = self.server.persons
+        self.assertEqual(self.check(4, 'jobs4.db', changes_first=True), first)
+        self.assertEqual(self.server.persons, persons)
+
+    def test_deleted(self):
+        # an ancestor deleted from FamilySearch, and so his ancestors unreachable
+        deleted = self.tree.couples[1][0]
+        self.tree.deleted.add(deleted)
+        persons_first = self.check(4)
+        self.assertIn(self.tree.fid(deleted), [person[0] for person in persons_first])
+        with dbm.Database(os.path.join(self.tmp.name, 'jobs4.db')) as db:
+            row = db.get_latest_person(self.tree.fid(deleted), self.tree.fid(0))
+        self.assertEqual(row['status'], 'deleted')
+        self.assertEqual(json.loads(row['status_list']), [410, 410])
+        self.assertEqual((row['name'], row['fatherids']), (None, '[]'))
+        # checked again changes first, the deleted person is downloaded, not rebuilt
+        persons = self.server.persons
+        self.assertEqual(self.check(4, 'jobs4.db', changes_first=True), persons_first)
+        self.assertEqual(self.server.persons, persons)
+
+    def test_jobs(self):
+        persons = self.check(1)
+        # the reference person and the parents of each couple, not their other children
+        self.assertEqual(len(persons), 1 + 2 * len(self.tree.couples))
+        self.assertEqual(self.check(8), persons)
 
 # ----------
 
@@ -27,20 +27,230 @@
 # global imports
 import os
 import json
+import zlib
+import hashlib
 import sqlite3
+import tempfile
 import unittest
 from datetime import datetime
 from sqlite3.dbapi2 import Connection, Cursor
 from checkmyancestors import app
 
+# rows inserted in one transaction, before persist_session commits the rest
+BATCH_SIZE = 1000
+
+# preset zlib dictionary of the strings common to the person payloads, most frequent last
+# (a payload is prefixed with the byte of its format, to change the dictionary later)
+BLOB_FORMAT = b'\x01'
+ZDICT = (
+    '"sourceDescriptions": [{"id": "SD-", "about": "https://familysearch.org/ark:/61903/4:1:'
+    '"identifiers": {"http://gedcomx.org/Primary": ["https://familysearch.org/ark:/61903/4:1:'
+    '"http://gedcomx.org/Persistent": ["https://familysearch.org/ark:/61903/4:1:'
+    '"links": {"person": {"href": "https://familysearch.org/platform/tree/persons/'
+    '"ancestry": {"href": "https://familysearch.org/platform/tree/ancestry?person='
+    '"descendancy": {"href": "https://familysearch.org/platform/tree/descendancy?person='
+    '"http://gedcomx.org/Couple", "http://gedcomx.org/ParentChild", '
+    '"http://gedcomx.org/Marriage", "http://gedcomx.org/Death", "http://gedcomx.org/Burial", '
+    '"http://gedcomx.org/Christening", "http://gedcomx.org/Birth", '
+    '"childAndParentsRelationships": [{"id": "", "parent1": {"resourceId": "'
+    '"parent2": {"resourceId": "", "child": {"resourceId": "'
+    '"relationships": [{"id": "", "type": "http://gedcomx.org/Couple", '
+    '"person1": {"resourceId": "", "person2": {"resourceId": "'
+    '"display": {"name": "", "gender": "Female", "gender": "Male", "lifespan": "", '
+    '"birthDate": "", "birthPlace": "", "deathDate": "", "deathPlace": "", '
+    '"ascendancyNumber": "", "familiesAsParent": [{"parent1": {"resourceId": "'
+    '"familiesAsChild": [{"parent1": {"resourceId": "'
+    '"nameForms": [{"lang": "x-Latn", "fullText": "", "parts": ['
+    '{"type": "http://gedcomx.org/Surname", "value": "'
+    '{"type": "http://gedcomx.org/Given", "value": "'
+    '"names": [{"type": "http://gedcomx.org/BirthName", "preferred": true, '
+    '"date": {"original": "", "formal": "+", "normalized": [{"lang": "en", "value": "'
+    '"place": {"original": "", "description": "#", "normalized": [{"lang": "en", "value": "'
+    '"attribution": {"contributor": {"resourceId": "", "modified": 1, "changeMessage": "'
+    '"facts": [{"id": "", "type": "http://gedcomx.org/Birth", "living": false, '
+    '"gender": {"type": "http://gedcomx.org/Male", "type": "http://gedcomx.org/Female", '
+    '"persons": [{"id": "", "description": "#SD-'
+).encode('utf-8')
+
+
+def deflate(text):
+    """ compress a person payload
+        Args:
+            text (str): the JSON payload
+        Returns:
+            (bytes): the format byte and the payload compressed with the preset dictionary
+    """
+    compressor = zlib.compressobj(9, zdict=ZDICT)
+    return BLOB_FORMAT + compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+
+def inflate(data):
+    """ decompress a person payload compressed by deflate
+        Args:
+            data (bytes): the compressed payload
+        Returns:
+            (str): the JSON payload
+    """
+    if data[:1] != BLOB_FORMAT:
+        raise ValueError('unknown blob format: ' + repr(data[:1]))
+    decompressor = zlib.decompressobj(zdict=ZDICT)
+    return (decompressor.decompress(data[1:]) + decompressor.flush()).decode('utf-8')
+
+
+def put_blob(conn, text):
+    """ store a person payload once, in the blobs table keyed by its hash
+        Args:
+            conn (Connection): the SQLite connection
+            text (str): the JSON payload
+        Returns:
+            (bytes): the hash of the payload
+    """
+    key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    if conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (key,)).fetchone() is None:
+        conn.execute('INSERT INTO blobs (hash, data) VALUES (?, ?)', (key, deflate(text)))
+    return key
+
+
+def move_fspersons(conn):
+    """ move the fsperson payloads of the persons table into the blobs table,
+        BATCH_SIZE rows at a time
+        Args:
+            conn (Connection): the SQLite connection
+    """
+    last = -1
+    while True:
+        rows = conn.execute(
+            'SELECT id, fsperson FROM persons WHERE fsperson IS NOT NULL AND id > ?'
+            ' ORDER BY id LIMIT ?', (last, BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        for rowid, fsperson in rows:
+            conn.execute(
+                'UPDATE persons SET fsperson = NULL, fsperson_hash = ? WHERE id = ?',
+                (put_blob(conn, fsperson), rowid))
+        last = rows[-1][0]
+
+
+# the latest row of each person, with its compressed payload
+LATEST_PERSONS = """
+    SELECT p.*, l.verified, b.data AS fsperson_data
+        FROM latest_persons l JOIN persons p ON p.id = l.id
+        LEFT JOIN blobs b ON b.hash = p.fsperson_hash
+"""
+
+# schema migrations, applied in order by Database.__init__ on top of the tables and view
+# a VACUUM, which cannot run in a transaction, runs after the commit of its migration
+# the schema version, stored in PRAGMA user_version, is the number of migrations applied
+MIGRATIONS = (
+    # 1: covering indexes for _get_person, get_persons and the ancestors view
+    (
+        'CREATE INDEX IF NOT EXISTS persons_by_person'
+        ' ON persons (personid, referenceid, timestamp)',
+        'CREATE INDEX IF NOT EXISTS persons_by_reference'
+        ' ON persons (referenceid, timestamp, personid)',
+        'CREATE INDEX IF NOT EXISTS persons_by_generation'
+        ' ON persons (generation, referenceid, gender, timestamp)',
+        'ANALYZE persons',
+    ),
+    # 2: the latest row of each person, maintained by a trigger in the transaction of the
+    # insert, read by the comparisons, verify_data and the ancestors view
+    (
+        """
+        CREATE TABLE latest_persons (
+            referenceid   TEXT NOT NULL,
+            personid      TEXT NOT NULL,
+            id            INTEGER NOT NULL,
+            timestamp     INTEGER NOT NULL,
+            PRIMARY KEY (referenceid, personid)) WITHOUT ROWID
+        """,
+        """
+        INSERT OR REPLACE INTO latest_persons (referenceid, personid, id, timestamp)
+            SELECT referenceid, personid, id, timestamp FROM persons ORDER BY timestamp, id
+        """,
+        """
+        CREATE TRIGGER latest_person AFTER INSERT ON persons
+            WHEN NEW.timestamp >= COALESCE(
+                (SELECT timestamp FROM latest_persons
+                 WHERE referenceid = NEW.referenceid AND personid = NEW.personid),
+                NEW.timestamp)
+            BEGIN
+                INSERT OR REPLACE INTO latest_persons (referenceid, personid, id, timestamp)
+                    VALUES (NEW.referenceid, NEW.personid, NEW.id, NEW.timestamp);
+            END
+        """,
+        'DROP VIEW IF EXISTS ancestors',
+        """
+        CREATE VIEW ancestors
+        AS
+            SELECT
+                -- latest rows of the ancestors of the latest reference person
+                p.generation, p.name, p.gender, p.lifespan, p.personid, p.fatherids,
+                p.motherids, p.referenceid, p.timestamp
+            FROM latest_persons l JOIN persons p ON p.id = l.id
+            WHERE l.referenceid = (
+                SELECT referenceid FROM latest_persons WHERE personid = referenceid
+                ORDER BY timestamp DESC LIMIT 1
+            )
+            ORDER BY p.generation ASC, p.gender DESC
+        """,
+        'DROP INDEX IF EXISTS persons_by_generation',
+        'ANALYZE latest_persons',
+    ),
+    # 3: compressed person payloads, stored once in the blobs table, keyed by their hash,
+    # then a VACUUM to return the pages freed in the persons table to the file system
+    (
+        """
+        CREATE TABLE blobs (
+            id            INTEGER PRIMARY KEY,
+            hash          BLOB NOT NULL UNIQUE,
+            data          BLOB NOT NULL)
+        """,
+        'ALTER TABLE persons ADD COLUMN fsperson_hash BLOB',
+        move_fspersons,
+        'VACUUM',
+    ),
+    # 4: when the latest row of each person was last checked against a full download,
+    # for the full-verify interval of the changes-first mode
+    (
+        'ALTER TABLE latest_persons ADD COLUMN verified INTEGER',
+        'UPDATE latest_persons SET verified = timestamp',
+        'DROP TRIGGER latest_person',
+        """
+        CREATE TRIGGER latest_person AFTER INSERT ON persons
+            WHEN NEW.timestamp >= COALESCE(
+                (SELECT timestamp FROM latest_persons
+                 WHERE referenceid = NEW.referenceid AND personid = NEW.personid),
+                NEW.timestamp)
+            BEGIN
+                INSERT OR REPLACE INTO latest_persons
+                    (referenceid, personid, id, timestamp, verified)
+                    VALUES (NEW.referenceid, NEW.personid, NEW.id, NEW.timestamp, NEW.timestamp);
+            END
+        """,
+    ),
+)
+
 
 class Database:
     """
         SQLite database for persisting FamilySearch ancestors.
+        A single connection is kept open, in WAL mode; the rows of a check run are
+        inserted in batched transactions and persist_session commits the last one.
+        Args:
+            filename (str): database file, database.db in this directory by default
     """
 
-    def __init__(self):
+    def __init__(self, filename=None):
         """ initialize the SQLite database"""
+        if filename is None:
+            path = os.path.dirname(os.path.realpath(__file__))
+            filename = path + '/' + 'database.db'
+        self.filename = filename
+        self.conn = None
+        self.pending = 0  # rows inserted since the last commit
+        self.version = 0  # schema version
+        self.cache = None  # latest rows of the persons of cache_referenceid, by person id
+        self.cache_referenceid = None
         conn: Connection = self._get_connection()
         cursor: Cursor = conn.cursor()
         try:
@@ -63,7 +273,6 @@ class Database:
 	                relationships TEXT,
 	                last_modified INTEGER);
 	                """)
-            conn.commit()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS sessions (
 	                id            INTEGER PRIMARY KEY,
@@ -72,7 +281,6 @@ class Database:
 	                status        TEXT,
 	                change_log    TEXT);
 	                """)
-            conn.commit()
             cursor.execute("""
                 CREATE VIEW IF NOT EXISTS ancestors
                 AS
@@ -90,7 +298,7 @@ class Database:
                     ORDER BY generation ASC, gender DESC
             	    """)
             conn.commit()
-            conn.close()
+            self.version = self._migrate(conn)
         #
         except sqlite3.Error as e:
             app.write_log(
@@ -98,10 +306,68 @@ class Database:
                 "SQLite CREATE TABLE error occurred:" +
                 e.args[0])
 
+    def _migrate(self, conn):
+        """ apply the migrations newer than the schema version, each in a transaction
+            Args:
+                conn (Connection): the SQLite connection
+            Returns:
+                (int): the schema version of the database
+        """
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number in range(version, len(MIGRATIONS)):
+            try:
+                conn.execute('BEGIN')
+                for sql in MIGRATIONS[number]:
+                    if callable(sql):
+                        sql(conn)
+                    elif sql != 'VACUUM':
+                        conn.execute(sql)
+                conn.execute('PRAGMA user_version = %d' % (number + 1))
+                conn.commit()
+                if 'VACUUM' in MIGRATIONS[number]:
+                    conn.execute('VACUUM')
+            except sqlite3.Error as e:
+                conn.rollback()
+                app.write_log(
+                    'error',
+                    "SQLite schema migration " + str(number + 1) + " error occurred:" +
+                    e.args[0])
+                break
+            version = number + 1
+        return version
+
     def _get_connection(self):
-        """ get SQLite connection object """
-        path = os.path.dirname(os.path.realpath(__file__))
-        return sqlite3.connect(path + '/' + 'database.db')
+        """ get the SQLite connection object, opened on first use
+            WAL and synchronous = NORMAL only sync the journal at checkpoints,
+            instead of the database and the journal at every commit
+        """
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.filename)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute('PRAGMA journal_mode = WAL')
+            self.conn.execute('PRAGMA synchronous = NORMAL')
+            self.conn.execute('PRAGMA cache_size = -16000')  # in KiB
+            self.conn.execute('PRAGMA temp_store = MEMORY')
+        return self.conn
+
+    def commit(self):
+        """ commit the rows inserted since the last commit """
+        if self.conn is not None:
+            self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        """ commit the pending rows and close the connection """
+        if self.conn is not None:
+            self.commit()
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def _insert_person(self, person):
         """ insert the person object in the SQLite database
@@ -113,11 +379,14 @@ class Database:
         sql = """
             INSERT INTO persons
                 (personid, timestamp, referenceid, status_list, status,
-                 generation, fsperson, name, gender, born,
+                 generation, fsperson_hash, name, gender, born,
                  lifespan, fatherids, motherids, relationships, last_modified)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
         try:
+            fsperson_hash = None
+            if person.fsperson is not None:
+                fsperson_hash = put_blob(conn, person.fsperson)
             cursor.execute(
                 sql,
                 (person.personid,
@@ -126,7 +395,7 @@ class Database:
                  person.status_list,
                  person.status,
                  person.generation,
-                 person.fsperson,
+                 fsperson_hash,
                  person.name,
                  person.gender,
                  person.born,
@@ -135,8 +404,14 @@ class Database:
                  person.motherids,
                  person.relationships,
                  person.last_modified))
-            conn.commit()
-            conn.close()
+            self.pending += 1
+            if person.referenceid == self.cache_referenceid:
+                cursor.execute(
+                    LATEST_PERSONS + ' WHERE l.personid = ? AND l.referenceid = ?',
+                    (person.personid, person.referenceid))
+                self.cache[person.personid] = dict(cursor.fetchone())
+            if self.pending >= BATCH_SIZE:
+                self.commit()
         #
         except sqlite3.Error as e:
             app.write_log(
@@ -144,6 +419,41 @@ class Database:
                 "SQLite INSERT person error occurred: " +
                 e.args[0])
 
+    def _person_rows(self, rows):
+        """ convert the sqlite3.Row of persons to dict, decompressing their fsperson
+            Args:
+                rows (iterable): a query of persons, with the blob data as fsperson_data
+            Returns:
+                (list) of the records (dict)
+        """
+        persons = []
+        for row in rows:
+            row = dict(row)
+            data = row.pop('fsperson_data')
+            if data is not None:
+                row['fsperson'] = inflate(data)
+            persons.append(row)
+        return persons
+
+    def load_persons(self, referenceid):
+        """ load the latest rows of the persons of the reference person in memory, with one
+            query, to be used instead of a query per person for the rest of the session
+            Args:
+                referenceid (str): the ID of the reference person
+        """
+        conn: Connection = self._get_connection()
+        cursor: Cursor = conn.cursor()
+        try:
+            cursor.execute(LATEST_PERSONS + ' WHERE l.referenceid = ?', [referenceid])
+            self.cache = {row['personid']: dict(row) for row in cursor}
+            self.cache_referenceid = referenceid
+        #
+        except sqlite3.Error as e:
+            app.write_log(
+                'error',
+                "SQLite SELECT persons error occurred:" +
+                e.args[0])
+
     def _get_person(self, personid, referenceid):
         """ Get the most recent persisted person with personid and referenceid from the SQLite database
         Args:
@@ -151,16 +461,19 @@ class Database:
             referenceid (str): the ID of the reference person
         Returns:
             (list) with the most recent matching record (dict) in [0] or None
+        Note:
+            The most recent record is found in latest_persons, whatever the history length,
+            or in the rows loaded by load_persons.
         """
+        if referenceid == self.cache_referenceid:
+            row = self.cache.get(personid)
+            return self._person_rows([row] if row else [])
         conn: Connection = self._get_connection()
-        conn.row_factory = sqlite3.Row
         cursor: Cursor = conn.cursor()
-        sql = 'SELECT * FROM persons WHERE personid = ? AND referenceid = ? ORDER BY timestamp DESC'
+        sql = LATEST_PERSONS + ' WHERE l.personid = ? AND l.referenceid = ?'
         try:
             cursor.execute(sql, (personid, referenceid))
-            rows = [dict(row)
-                    for row in cursor.fetchall()]  # convert sqlite3.Row
-            return rows
+            return self._person_rows(cursor)
         #
         except sqlite3.Error as e:
             app.write_log(
@@ -174,17 +487,14 @@ class Database:
             Args:
                 referenceid (str): the ID of the reference person
             Returns:
-                (list) with the most recent matching records (dict)
+                (list) with the most recent matching record (dict) of each person
         """
         conn: Connection = self._get_connection()
-        conn.row_factory = sqlite3.Row
         cursor: Cursor = conn.cursor()
-        sql = 'SELECT * FROM persons WHERE referenceid = ? ORDER BY timestamp DESC'
+        sql = LATEST_PERSONS + ' WHERE l.referenceid = ? ORDER BY p.timestamp DESC'
         try:
             cursor.execute(sql, [referenceid])
-            rows = [dict(row)
-                    for row in cursor.fetchall()]  # convert sqlite3.Row
-            return rows
+            return self._person_rows(cursor)
         #
         except sqlite3.Error as e:
             app.write_log(
@@ -193,6 +503,72 @@ class Database:
                 e.args[0])
             return None
 
+    def get_latest_person(self, personid, referenceid):
+        """ Get the most recent persisted person with personid and referenceid
+            Args:
+                personid (str):    the ID of the ancestor
+                referenceid (str): the ID of the reference person
+            Returns:
+                (dict) the most recent record, or None
+        """
+        rows = self._get_person(personid, referenceid)
+        return rows[0] if rows else None
+
+    def set_verified(self, personid, referenceid, timestamp):
+        """ record that the latest row of the person matches a full download
+            Args:
+                personid (str):    the ID of the ancestor
+                referenceid (str): the ID of the reference person
+                timestamp (int):   timestamp of the session
+        """
+        conn: Connection = self._get_connection()
+        try:
+            conn.execute(
+                'UPDATE latest_persons SET verified = ? WHERE referenceid = ? AND personid = ?',
+                (timestamp, referenceid, personid))
+            if referenceid == self.cache_referenceid and personid in self.cache:
+                self.cache[personid]['verified'] = timestamp
+        #
+        except sqlite3.Error as e:
+            app.write_log(
+                'error',
+                "SQLite UPDATE verified error occurred:" +
+                e.args[0])
+
+    def get_missing_persons(self, referenceid, personids):
+        """ Get the persisted persons with referenceid which are not in personids,
+            with a temporary table of personids anti-joined to latest_persons
+            Args:
+                referenceid (str): the ID of the reference person
+                personids (iterable): the IDs of the persons found in FamilySearch
+            Returns:
+                (list) of the missing person ids (str), each one once
+        """
+        conn: Connection = self._get_connection()
+        try:
+            conn.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS checked'
+                ' (personid TEXT PRIMARY KEY) WITHOUT ROWID')
+            conn.execute('DELETE FROM checked')
+            conn.executemany(
+                'INSERT OR IGNORE INTO checked (personid) VALUES (?)',
+                ((personid,) for personid in personids))
+            rows = conn.execute("""
+                SELECT l.personid FROM latest_persons l
+                    WHERE l.referenceid = ?
+                    AND NOT EXISTS (SELECT 1 FROM checked c WHERE c.personid = l.personid)
+                    ORDER BY l.personid
+            """, [referenceid]).fetchall()
+            conn.execute('DELETE FROM checked')
+            return [row['personid'] for row in rows]
+        #
+        except sqlite3.Error as e:
+            app.write_log(
+                'error',
+                "SQLite SELECT persons error occurred:" +
+                e.args[0])
+            return []
+
     def check_person(self, personid, referenceid):
         """ check if the person is in the database
         Args:
@@ -327,8 +703,7 @@ class Database:
                  person_count,
                  status,
                  json.dumps(change_log)))
-            conn.commit()
-            conn.close()
+            self.commit()
         #
         except sqlite3.Error as e:
             app.write_log(
@@ -343,7 +718,6 @@ class Database:
             (bool): True if OK, False if not.
         """
         conn: Connection = self._get_connection()
-        conn.row_factory = sqlite3.Row
         cursor: Cursor = conn.cursor()
         try:
             cursor.execute('pragma integrity_check;')
@@ -364,17 +738,161 @@ class Database:
 
 class TestSQLiteDatabase(unittest.TestCase):
 
+    def test_batched_transaction(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'test.db')
+            with Database(filename) as db:
+                for i in range(3):
+                    display = {'name': 'Name', 'gender': 'Male', 'lifespan': '1900-1970'}
+                    fsperson = {'persons': [{'display': display}], 'relationships': []}
+                    person = app.PersonObj(
+                        'AAAA-00' + str(i), i, 'AAAA-000', [200, 200], fsperson, 1, None)
+                    person.status = 'created'
+                    db.persist_person(person)
+                # visible to the connection of the run before the commit
+                self.assertTrue(db.check_person('AAAA-002', 'AAAA-000'))
+                self.assertEqual(db.pending, 3)
+                db.persist_session(1, 'AAAA-000', 3, [])
+                self.assertEqual(db.pending, 0)
+                mode = db._get_connection().execute('PRAGMA journal_mode').fetchone()[0]
+                self.assertEqual(mode, 'wal')
+            with Database(filename) as db:
+                self.assertEqual(len(db.get_persons('AAAA-000')), 3)
+
     def test_database_object(self):
-        self.db = Database()
-        self.assertIsInstance(self.db, Database, )
+        with tempfile.TemporaryDirectory() as path:
+            with Database(os.path.join(path, 'test.db')) as db:
+                self.assertIsInstance(db, Database, )
+
+    def test_schema_migration(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'test.db')
+            # a database of the first schema, without version
+            conn = sqlite3.connect(filename)
+            conn.execute('CREATE TABLE persons (id INTEGER PRIMARY KEY, personid TEXT NOT NULL,'
+                         ' timestamp INTEGER NOT NULL, referenceid TEXT NOT NULL,'
+                         ' generation INTEGER NOT NULL, gender TEXT, fsperson TEXT)')
+            conn.execute(
+                "INSERT INTO persons VALUES (1, 'AAAA-001', 1, 'AAAA-000', 1, NULL, '{}')")
+            # more payloads than a batch of move_fspersons, all alike
+            payload = json.dumps({'persons': [{'display': {'name': 'x' * 1000}}]})
+            conn.executemany(
+                "INSERT INTO persons VALUES (?, 'AAAA-002', ?, 'AAAA-000', 2, NULL, ?)",
+                [(i, i, payload) for i in range(2, BATCH_SIZE + 500)])
+            conn.commit()
+            conn.close()
+            size = os.path.getsize(filename)
+            with Database(filename) as db:
+                self.assertEqual(db.version, len(MIGRATIONS))
+                row = db._get_person('AAAA-001', 'AAAA-000')[0]
+                self.assertEqual((row['fsperson'], row['timestamp']), ('{}', 1))
+                row = db._get_person('AAAA-002', 'AAAA-000')[0]
+                self.assertEqual(row['fsperson'], payload)
+                conn = db._get_connection()
+                moved = conn.execute('SELECT count(*) FROM persons WHERE fsperson IS NULL')
+                self.assertEqual(moved.fetchone()[0], BATCH_SIZE + 499)
+                self.assertEqual(conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+                pages = conn.execute('PRAGMA page_count').fetchone()[0]
+                self.assertLess(pages * conn.execute('PRAGMA page_size').fetchone()[0], size)
+                plan = db._get_connection().execute(
+                    'EXPLAIN QUERY PLAN SELECT * FROM persons'
+                    ' WHERE personid = ? AND referenceid = ? ORDER BY timestamp DESC',
+                    ('AAAA-001', 'AAAA-000')).fetchall()
+                self.assertIn('USING INDEX persons_by_person', plan[0][3])
+            with Database(filename) as db:
+                self.assertEqual(db.version, len(MIGRATIONS))
+
+    def test_latest_persons(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'test.db')
+            with Database(filename) as db:
+                for timestamp, name in ((1, 'First'), (3, 'Third'), (2, 'Second')):
+                    display = {'name': name, 'gender': 'Male', 'lifespan': '1900-1970'}
+                    fsperson = {'persons': [{'display': display}], 'relationships': []}
+                    person = app.PersonObj(
+                        'AAAA-001', 1, 'AAAA-000', [200, 200], fsperson, timestamp, None)
+                    person.status = 'created'
+                    db.persist_person(person)
+                rows = db.get_persons('AAAA-000')
+                self.assertEqual([row['name'] for row in rows], ['Third'])
+                self.assertEqual(db._get_person('AAAA-001', 'AAAA-000')[0]['name'], 'Third')
+                # rebuilt from the history by the migration
+                conn = db._get_connection()
+                conn.execute('DROP TRIGGER latest_person')
+                conn.execute('DROP TABLE latest_persons')
+                for sql in MIGRATIONS[1]:
+                    conn.execute(sql)
+                latest = conn.execute('SELECT timestamp FROM latest_persons').fetchall()
+                self.assertEqual([row[0] for row in latest], [3])
+
+    def test_verified(self):
+        with tempfile.TemporaryDirectory() as path:
+            with Database(os.path.join(path, 'test.db')) as db:
+                fsperson = {'persons': [{'display': {'name': 'First'}}], 'relationships': []}
+                person = app.PersonObj(
+                    'AAAA-001', 1, 'AAAA-000', [200, 200], fsperson, 1, None)
+                person.status = 'created'
+                db.persist_person(person)
+                self.assertEqual(db._get_person('AAAA-001', 'AAAA-000')[0]['verified'], 1)
+                db.set_verified('AAAA-001', 'AAAA-000', 5)
+                row = db._get_person('AAAA-001', 'AAAA-000')[0]
+                self.assertEqual((row['timestamp'], row['verified']), (1, 5))
+
+    def test_row_cache(self):
+        with tempfile.TemporaryDirectory() as path:
+            with Database(os.path.join(path, 'test.db')) as db:
+                for timestamp, name in ((1, 'First'), (2, 'Second')):
+                    fsperson = {'persons': [{'display': {'name': name}}], 'relationships': []}
+                    person = app.PersonObj(
+                        'AAAA-001', 1, 'AAAA-000', [200, 200], fsperson, timestamp, None)
+                    person.status = 'created'
+                    db.persist_person(person)
+                    if timestamp == 1:
+                        db.load_persons('AAAA-000')
+                statements = []
+                db._get_connection().set_trace_callback(statements.append)
+                self.assertEqual(db._get_person('AAAA-001', 'AAAA-000')[0]['name'], 'Second')
+                self.assertEqual(db._get_person('AAAA-002', 'AAAA-000'), [])
+                self.assertEqual(statements, [])
+
+    def test_missing_persons(self):
+        with tempfile.TemporaryDirectory() as path:
+            with Database(os.path.join(path, 'test.db')) as db:
+                for timestamp, personid in ((1, 'AAAA-001'), (2, 'AAAA-001'), (2, 'AAAA-002')):
+                    fsperson = {'persons': [{'display': {}}], 'relationships': []}
+                    person = app.PersonObj(
+                        personid, 1, 'AAAA-000', [200, 200], fsperson, timestamp, None)
+                    person.status = 'created'
+                    db.persist_person(person)
+                self.assertEqual(db.get_missing_persons('AAAA-000', ['AAAA-002']), ['AAAA-001'])
+                missing = db.get_missing_persons('AAAA-000', {'AAAA-001': [1]})
+                self.assertEqual(missing, ['AAAA-002'])
+                self.assertEqual(db.get_missing_persons('AAAA-009', []), [])
+
+    def test_blobs(self):
+        with tempfile.TemporaryDirectory() as path:
+            with Database(os.path.join(path, 'test.db')) as db:
+                payload = '{"persons": [{"display": {"lifespan": "1900"}}], "relationships": []}'
+                for timestamp in (1, 2):
+                    fsperson = json.loads(payload)  # PersonObj pops from its lists
+                    person = app.PersonObj(
+                        'AAAA-001', 1, 'AAAA-000', [200, 200], fsperson, timestamp, None)
+                    person.status = 'created'
+                    db.persist_person(person)
+                conn = db._get_connection()
+                self.assertEqual(conn.execute('SELECT count(*) FROM blobs').fetchone()[0], 1)
+                row = db._get_person('AAAA-001', 'AAAA-000')[0]
+                self.assertEqual(row['fsperson'], payload)
+                self.assertEqual(row['timestamp'], 2)
 
     def test_sqlite_version(self):
         version = sqlite3.version
         self.assertGreaterEqual(version, '2.6.0')
 
     def test_sqlite_integrity(self):
-        self.db = Database()
-        self.assertTrue(self.db.check_integrity())
+        with tempfile.TemporaryDirectory() as path:
+            with Database(os.path.join(path, 'test.db')) as db:
+                self.assertTrue(db.check_integrity())
 
 
 if __name__ == "__main__":
@@ -28,12 +28,22 @@
 
 # global import
 import os
+import sys
 import time
+import threading
 import requests
 import unittest
 import json
+from unittest import mock
 from checkmyancestors import app
-from checkmyancestors import credentials
+
+# FamilySearch servers, pointed to the local stub server of benchmyancestors.py by the tests
+# of this module and of app.py
+LOGIN_URL = "https://www.familysearch.org"
+IDENT_URL = "https://ident.familysearch.org"
+API_URL = "https://familysearch.org"
+# maximum number of persons in a persons.json request, as in getmyancestors.py
+MAX_PERSONS = 500
 
 
 class Session:
@@ -48,16 +58,28 @@ class Session:
         self.timeout = timeout
         self.fid = self.lang = self.display_name = None
         self.counter = 0
+        self.local = threading.local()
         self.logged = self.login()
         self.status_code = 200
 
+    @property
+    def status_code(self):
+        """ HTTP status code of the last request of the current thread,
+            as requests are sent from several threads
+        """
+        return getattr(self.local, 'status_code', 200)
+
+    @status_code.setter
+    def status_code(self, value):
+        self.local.status_code = value
+
     def login(self):
         """ retrieve FamilySearch session ID
             (https://familysearch.org/developers/docs/guides/oauth2)
         """
         while True:
             try:
-                url = "https://www.familysearch.org/auth/familysearch/login"
+                url = LOGIN_URL + "/auth/familysearch/login"
                 app.write_log('debug', "Downloading: " + url)
                 r = requests.get(
                     url,
@@ -71,7 +93,7 @@ class Session:
                 span = r.text[idx + 21:].index('"')
                 params = r.text[idx + 21: idx + 21 + span]
 
-                url = "https://ident.familysearch.org/cis-web/oauth2/v3/authorization"
+                url = IDENT_URL + "/cis-web/oauth2/v3/authorization"
                 app.write_log('debug', "Downloading: " + url)
                 r = requests.post(
                     url,
@@ -133,7 +155,7 @@ class Session:
             try:
                 app.write_log('debug', "Downloading: " + url)
                 r = requests.get(
-                    "https://familysearch.org" + url,
+                    API_URL + url,
                     headers={"Accept": fsaccept},
                     cookies={"fssessionid": self.fssessionid},
                     timeout=self.timeout,
@@ -163,7 +185,7 @@ class Session:
                 app.write_log(
                     'debug',
                     "WARNING: code " +
-                    r.status_code +
+                    str(r.status_code) +
                     ", " +
                     url)
                 return None
@@ -212,9 +234,16 @@ class Session:
         url = "/platform/tree/persons/%s" % person_id
         return self.get_url(url, "application/x-gedcomx-v1+json")
 
-    def get_change_history_person(self, person_id):
-        """ get change history from FamilySearch """
+    def get_persons(self, person_ids):
+        """ get up to MAX_PERSONS persons from FamilySearch in one request """
+        url = "/platform/tree/persons.json?pids=%s" % ",".join(person_ids)
+        return self.get_url(url, "application/x-gedcomx-v1+json")
+
+    def get_change_history_person(self, person_id, count=None):
+        """ get change history from FamilySearch, the latest count entries or all of them """
         url = "/platform/tree/persons/%s/changes" % person_id
+        if count:
+            url += "?count=%s" % count
         return self.get_url(url, "application/x-gedcomx-atom+json")
 
     def _(self, string):
@@ -225,81 +254,68 @@ class Session:
 
 
 class TestSessionModule(unittest.TestCase):
-    fs = None
-    person = None
+    """ the session against the local FamilySearch stub of benchmyancestors """
 
     def setUp(self):
-        pass
-
-    def test_1_credentials(self):
-        # checks for the existence of file checkmyancestors/credentials.py
-        self.assertIsInstance(
-            credentials.username,
-            str,
-            "Username shall be defined.")
-        self.assertIsInstance(
-            credentials.password,
-            str,
-            "Password shall be defined")
-
-    def test_2_login(self):
-        # check for successfull login
-        self.__class__.fs = Session(
-            username=credentials.username,
-            password=credentials.password,
-            timeout=10)
-        self.assertIsInstance(self.__class__.fs, Session)
-        self.assertTrue(self.__class__.fs.logged, "Login failed.")
-
-    def test_3_get_person(self):
-        # check for download of Thomas Alva Edison
-        person = self.__class__.fs.get_person('LZ2Q-W96')
+        # the stub server, from the root of the repository
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import benchmyancestors
+        self.tree = benchmyancestors.SyntheticTree(20)
+        self.server = benchmyancestors.StubServer(self.tree).start()
+        url = self.server.url
+        self.urls = mock.patch.dict(globals(), LOGIN_URL=url, IDENT_URL=url, API_URL=url)
+        self.urls.start()
+        self.fid = self.tree.fid(0)
+
+    def tearDown(self):
+        self.urls.stop()
+        self.server.stop()
+
+    def test_1_login(self):
+        # check for failed and successfull logins
+        self.assertFalse(Session(username='stub', password='', timeout=1).logged)
+        fs = Session(username='stub', password='stub', timeout=1)
+        self.assertIsInstance(fs, Session)
+        self.assertTrue(fs.logged, "Login failed.")
+        self.assertEqual(fs.fid, self.fid)
+
+    def test_2_get_person(self):
+        # check for download of the reference person of the stub tree
+        fs = Session(username='stub', password='stub', timeout=1)
+        person = fs.get_person(self.fid)
+        self.assertEqual(fs.status_code, 200)
         self.assertIn(
             'description',
             person,
             'Dictionary shall contain "description" element.')
-        self.assertEqual(person['description'], '#SD-LZ2Q-W96')
-        self.__class__.person = person
+        self.assertEqual(person['description'], '#SD-' + self.fid)
+        self.assertIsNone(fs.get_person('ZZZZ-ZZZ'))
+        self.assertEqual(fs.status_code, 404)
 
-    def test_4_display(self):
+    def test_3_display(self):
         # check the display part of person data
-        person = self.__class__.person
-        try:
-            display = person['persons'][0]['display']
-        except BaseException:
-            self.assertTrue(
-                False, 'Missing "display" element in "person" object.')
-            return
+        fs = Session(username='stub', password='stub', timeout=1)
+        display = fs.get_person(self.fid)['persons'][0]['display']
         self.assertIn(
             'name',
             display,
             'The "display" element shall contain the "name" attribute.')
-        self.assertEqual(display['name'], 'Thomas Alva Edison')
+        self.assertEqual(display['name'], self.tree.persons([0])['persons'][0]['display']['name'])
 
-    def test_5_relationships(self):
-        # check the relationships part of person data
-        person = self.__class__.person
-        self.assertIn(
-            'childAndParentsRelationships',
-            person,
-            'The "person" object shall contain the "childAndParentsRelationships" attribute.')
-        try:
+    def test_4_relationships(self):
+        # check the relationships part of person data, and of a batch of persons
+        fs = Session(username='stub', password='stub', timeout=1)
+        for person in (fs.get_person(self.fid), fs.get_persons([self.fid, self.tree.fid(1)])):
+            self.assertIn(
+                'childAndParentsRelationships',
+                person,
+                'The "person" object shall contain the "childAndParentsRelationships" attribute.')
             for relation in person["childAndParentsRelationships"]:
-                self.assertIn(
-                    'parent1',
-                    relation,
-                    'Relationship shall contain "parent1" element.')
-                self.assertIn(
-                    'parent2',
-                    relation,
-                    'Relationship shall contain "parent2" element.')
-                self.assertIn(
-                    'child',
-                    relation,
-                    'Relationship shall contain "child" element.')
-        except BaseException:
-            self.assertTrue(
-                False, 'Missing "relationships" element(s) in "person" object.')
+                for role in ('parent1', 'parent2', 'child'):
+                    self.assertIn(
+                        role, relation, 'Relationship shall contain "%s" element.' % role)
+        changes = fs.get_change_history_person(self.fid, count=1)
+        self.assertIn('updated', changes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+   diffmyancestors.py - Compare two GEDCOM files produced by getmyancestors
+   Copyright (C) 2014-2016 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+   and by Benoît Fontaine <benoitfontaine.ba@gmail.com>
+"""
+
+from __future__ import print_function
+
+# global import
+import io
+import os
+import re
+import sys
+import mmap
+import hashlib
+import unittest
+import argparse
+from collections import Counter
+
+# local import
+import getmyancestors as gt
+import mergemyancestors as mm
+
+sys.path.append(os.path.dirname(sys.argv[0]))
+
+RECORD = re.compile(rb"0 (@[ISFN][0-9]+@) (INDI|FAM|SOUR|NOTE)\b")
+FSFTID = re.compile(rb"^1 _FSFTID ([^\r\n]+)", re.M)
+SPOUSE = re.compile(rb"^1 (HUSB|WIFE) (@I[0-9]+@)", re.M)
+REFN = re.compile(rb"^1 (?:REFN|TITL) ([^\r\n]*)", re.M)
+NOTE_LINE = re.compile(rb"^[0-9]+ (CONT|CONC) ?([^\r\n]*)", re.M)
+
+
+class Records:
+    """ The individuals and families of a GEDCOM file, keyed by FamilySearch IDs,
+        with a fingerprint of their content
+        pointers are replaced by what they point to (FamilySearch IDs, note text, source REFN)
+        as numbers are only meaningful within a file
+        :param file: a GEDCOM file object, possibly compressed
+    """
+
+    def __init__(self, file):
+        self.buf = mm.map_file(file)
+        self.targets = dict()
+        # key: (fingerprint, start, end) of the record lines after its level 0 line
+        self.indi = dict()
+        self.fam = dict()
+        self.__scan()
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __scan(self):
+        """ Find the records of the buffer, then fingerprint individuals and families """
+        buf = self.buf
+        size = len(buf)
+        indi = list()
+        fam = list()
+        pos = 0
+        while pos < size:
+            # records are split on their level 0 line, cheaper than a multiline regex
+            match = RECORD.match(buf, pos)
+            pos = buf.find(b"\n0 ", pos) + 1 or size
+            if not match:
+                continue
+            start = min(buf.find(b"\n", match.end()) + 1 or size, pos)
+            end = pos
+            pointer, tag = match.group(1), match.group(2)
+            body = buf[start:end]
+            if tag == b"INDI":
+                fid = FSFTID.search(body)
+                fid = fid.group(1).strip() if fid else pointer
+                self.targets[pointer] = b" " + fid
+                indi.append((fid.decode("utf-8"), start, end))
+            elif tag == b"FAM":
+                fam.append((pointer, dict(SPOUSE.findall(body)), start, end))
+            elif tag == b"SOUR":
+                refn = REFN.findall(body)
+                self.targets[pointer] = b" " + (refn[-1] if refn else pointer)
+            else:
+                text = buf[match.end() : start].strip(b"\r\n")[1:]
+                for kind, value in NOTE_LINE.findall(body):
+                    text += (b"\n" if kind == b"CONT" else b"") + value
+                self.targets[pointer] = b" " + repr(text.decode("utf-8", "replace")).encode()
+        for i, (pointer, spouses, start, end) in enumerate(fam):
+            key = "+".join(
+                self.targets.get(spouses.get(x), b" ")[1:].decode("utf-8")
+                for x in (b"HUSB", b"WIFE")
+            )
+            self.targets[pointer] = b" " + key.encode("utf-8")
+            fam[i] = (key, start, end)
+        for records, items in ((self.indi, indi), (self.fam, fam)):
+            for key, start, end in items:
+                groups = sorted(self.groups(start, end))
+                digest = hashlib.blake2b(b"\n1 ".join(groups), digest_size=16).digest()
+                records[key] = (digest, start, end)
+
+    def groups(self, start, end):
+        """ The level 1 substructures of a record, with their lower level lines
+            and resolved pointers
+        """
+
+        def resolve(match):
+            return self.targets.get(match.group(1), match.group(0))
+
+        record = mm.POINTER.sub(resolve, self.buf[start:end]).replace(b"\r\n", b"\n")
+        return (b"\n" + record.rstrip(b"\n")).split(b"\n1 ")[1:]
+
+
+def diff(old, new):
+    """ Compare the individuals and families of two GEDCOM files
+        :param old: the Records of the first file
+        :param new: the Records of the second file
+        yield (change, tag, key, removed, added) for each record added (+), removed (-)
+        or modified (~), where removed and added are the level 1 substructures which differ
+    """
+    for tag, a, b in (("INDI", old.indi, new.indi), ("FAM", old.fam, new.fam)):
+        for key in sorted(a.keys() | b.keys()):
+            if key not in b:
+                yield "-", tag, key, old.groups(*a[key][1:]), []
+            elif key not in a:
+                yield "+", tag, key, [], new.groups(*b[key][1:])
+            elif a[key][0] != b[key][0]:
+                x, y = Counter(old.groups(*a[key][1:])), Counter(new.groups(*b[key][1:]))
+                yield "~", tag, key, sorted((x - y).elements()), sorted((y - x).elements())
+
+
+def print_diff(changes, out):
+    """ Write the changes yielded by diff
+        return a Counter of the changes by (change, tag)
+    """
+    counts = Counter()
+    for change, tag, key, removed, added in changes:
+        counts[(change, tag)] += 1
+        out.write("%s %s %s\n" % (change, tag, key))
+        for sign, groups in (("-", removed), ("+", added)):
+            for group in groups:
+                for line in (b"1 " + group).decode("utf-8", "replace").split("\n"):
+                    out.write("  %s %s\n" % (sign, line))
+    return counts
+
+
+class TestDiff(unittest.TestCase):
+    @staticmethod
+    def gedcom(tree):
+        file = io.StringIO()
+        tree.reset_num()
+        tree.print(file)
+        file.seek(0)
+        return file
+
+    def setUp(self):
+        """ a couple and a child, the child having a note """
+        self.tree = gt.Tree()
+        self.tree.display_name, self.tree.lang = "Tester", "English"
+        for fid, given in (("AAAA-001", "Adam"), ("AAAA-002", "Eve"), ("AAAA-003", "Cain")):
+            self.tree.indi[fid] = gt.Indi(fid, self.tree)
+            self.tree.indi[fid].name = gt.Name()
+            self.tree.indi[fid].name.given = given
+        self.tree.add_trio("AAAA-001", "AAAA-002", "AAAA-003")
+        self.tree.indi["AAAA-003"].notes.add(gt.Note("a note", self.tree))
+
+    def diff(self, old):
+        new = self.gedcom(self.tree)
+        with Records(old) as a, Records(new) as b:
+            return list(diff(a, b))
+
+    def test_renumbered(self):
+        old = self.gedcom(self.tree)
+        for o in list(self.tree.indi.values()) + list(self.tree.fam.values()):
+            o.num += 10
+        self.tree.notes[0].num += 10
+        self.assertEqual(self.diff(old), [])
+
+    def test_changes(self):
+        old = self.gedcom(self.tree)
+        self.tree.indi["AAAA-002"].name.given = "Eva"
+        self.tree.indi["AAAA-004"] = gt.Indi("AAAA-004", self.tree)
+        self.tree.add_trio("AAAA-001", "AAAA-002", "AAAA-004")
+        self.tree.indi["AAAA-003"].notes = {gt.Note("another note", self.tree)}
+        changes = {(change, tag, key): (x, y) for change, tag, key, x, y in self.diff(old)}
+        self.assertEqual(
+            sorted(changes),
+            [
+                ("+", "INDI", "AAAA-004"),
+                ("~", "FAM", "AAAA-001+AAAA-002"),
+                ("~", "INDI", "AAAA-002"),
+                ("~", "INDI", "AAAA-003"),
+            ],
+        )
+        self.assertEqual(changes[("~", "INDI", "AAAA-002")], ([b"NAME Eve //"], [b"NAME Eva //"]))
+        self.assertEqual(changes[("~", "FAM", "AAAA-001+AAAA-002")], ([], [b"CHIL AAAA-004"]))
+        self.assertEqual(
+            changes[("~", "INDI", "AAAA-003")], ([b"NOTE 'a note'"], [b"NOTE 'another note'"])
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare two GEDCOM files from FamilySearch Tree (4 Jul 2016)",
+        add_help=False,
+        usage="diffmyancestors.py -i old.ged new.ged [options]",
+    )
+    try:
+        parser.add_argument(
+            "-i",
+            metavar="<FILE>",
+            nargs=2,
+            type=argparse.FileType("r", encoding="UTF-8"),
+            required=True,
+            help="old and new GEDCOM files, possibly compressed",
+        )
+        parser.add_argument(
+            "-o",
+            metavar="<FILE>",
+            nargs="?",
+            type=gt.output_file,
+            default=sys.stdout,
+            help="output report of the added (+), removed (-) and modified (~) records [stdout]",
+        )
+    except TypeError:
+        sys.stderr.write("Python >= 3.4 is required to run this script\n")
+        sys.stderr.write("(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n")
+        exit(2)
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit as e:
+        print(e.code)
+        parser.print_help()
+        exit(2)
+
+    with Records(args.i[0]) as old, Records(args.i[1]) as new:
+        counts = print_diff(diff(old, new), args.o)
+    if args.o and args.o is not sys.stdout:
+        args.o.close()
+    for tag, label in (("INDI", "Individuals"), ("FAM", "Families")):
+        sys.stderr.write(
+            "%s: %s added, %s removed, %s modified\n"
+            % (label, counts[("+", tag)], counts[("-", tag)], counts[("~", tag)])
+        )
+    exit(1 if counts else 0)
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+   extractmyancestors.py - Extract subtrees from large GEDCOM files
+   Copyright (C) 2014-2016 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+   and by Benoît Fontaine <benoitfontaine.ba@gmail.com>
+"""
+
+from __future__ import print_function
+
+# global import
+import io
+import os
+import re
+import sys
+import mmap
+import struct
+import tempfile
+import unittest
+import argparse
+
+# local import
+import getmyancestors as gt
+import mergemyancestors as mm
+
+sys.path.append(os.path.dirname(sys.argv[0]))
+
+# sidecar index: header, record counts, then (num, offset) tables sorted by num for each
+# record type and a (fid, num) table of individuals sorted by fid
+MAGIC = b"GEDIDX01"
+HEADER = struct.Struct("<8sQqQQ")
+COUNTS = struct.Struct("<5Q")
+ENTRY = struct.Struct("<QQ")
+KINDS = (b"I", b"F", b"S", b"N")
+
+RECORD = re.compile(rb"^0 @([ISFN])([0-9]+)@ (?:INDI|FAM|SOUR|NOTE)\b", re.M)
+FSFTID = re.compile(rb"^1 _FSFTID ([^\r\n]+)", re.M)
+LINK = re.compile(rb"^1 (FAMC|FAMS|HUSB|WIFE|CHIL) @([IF])([0-9]+)@", re.M)
+FAM_LINK = re.compile(rb"^[0-9]+ (?:FAMC|FAMS|HUSB|WIFE|CHIL) @([IF][0-9]+)@\r?\n", re.M)
+REFERENCE = re.compile(rb" @([SN][0-9]+)@\r?$", re.M)
+
+
+def index_name(filename):
+    """ name of the sidecar index of a GEDCOM file """
+    return filename + ".idx"
+
+
+def build_index(buf, size=0, mtime=0):
+    """ Build the sidecar index of a GEDCOM byte buffer
+        :param size: size of the indexed file, to detect a stale index
+        :param mtime: modification time of the indexed file, in nanoseconds
+        return the index as bytes
+    """
+    tables = {kind: list() for kind in KINDS}
+    fids = list()
+    header_end = None
+    fid_matches = FSFTID.finditer(buf)
+    fid_match = next(fid_matches, None)
+    records = list(RECORD.finditer(buf))
+    for i, match in enumerate(records):
+        start = match.start()
+        if header_end is None:
+            header_end = start
+        kind, num = match.group(1), int(match.group(2))
+        tables[kind].append((num, start))
+        if kind != b"I":
+            continue
+        # the _FSFTID lines of this individual lie before the next record
+        end = records[i + 1].start() if i + 1 < len(records) else len(buf)
+        while fid_match and fid_match.start() < start:
+            fid_match = next(fid_matches, None)
+        if fid_match and fid_match.start() < end:
+            fids.append((fid_match.group(1).strip(), num))
+    width = max((len(fid) for fid, _ in fids), default=0)
+    data = io.BytesIO()
+    data.write(HEADER.pack(MAGIC, size, mtime, header_end or 0, width))
+    data.write(COUNTS.pack(*(len(tables[kind]) for kind in KINDS), len(fids)))
+    for kind in KINDS:
+        for num, offset in sorted(tables[kind]):
+            data.write(ENTRY.pack(num, offset))
+    fid_entry = struct.Struct("<%dsQ" % width)
+    for fid, num in sorted(fids):
+        data.write(fid_entry.pack(fid, num))
+    return data.getvalue()
+
+
+def search(data, start, count, entry, key):
+    """ Binary search of a table of fixed size entries sorted by their first field
+        return the second field of the entry matching key or None
+    """
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        value = entry.unpack_from(data, start + middle * entry.size)
+        if value[0] < key:
+            low = middle + 1
+        elif value[0] > key:
+            high = middle
+        else:
+            return value[1]
+    return None
+
+
+class Index:
+    """ Random access to the records of a GEDCOM file through its sidecar index
+        the index is built, or rebuilt when stale, and written next to the file if possible
+    """
+
+    def __init__(self, filename, rebuild=False):
+        self.filename = filename
+        self.f = open(filename, "rb")
+        self.buf = mm.map_file(self.f)
+        stat = os.stat(filename)
+        self.data = None
+        if not rebuild:
+            self.data = self.__read_index(stat)
+        if self.data is None:
+            self.data = build_index(self.buf, stat.st_size, stat.st_mtime_ns)
+            self.__write_index(stat)
+        _, _, _, self.header_end, width = HEADER.unpack_from(self.data)
+        counts = COUNTS.unpack_from(self.data, HEADER.size)
+        self.tables = dict()
+        offset = HEADER.size + COUNTS.size
+        for kind, count in zip(KINDS, counts):
+            self.tables[kind] = (offset, count)
+            offset += count * ENTRY.size
+        self.fid_entry = struct.Struct("<%dsQ" % width)
+        self.fid_table = (offset, counts[4])
+
+    def __read_index(self, stat):
+        """ Map the sidecar index if it exists and matches the GEDCOM file """
+        try:
+            with open(index_name(self.filename), "rb") as f:
+                data = mm.map_file(f)
+        except OSError:
+            return None
+        if len(data) >= HEADER.size:
+            magic, size, mtime, _, _ = HEADER.unpack_from(data)
+            if magic == MAGIC and size == stat.st_size and mtime == stat.st_mtime_ns:
+                return data
+        return None
+
+    def __write_index(self, stat):
+        """ Write the sidecar index atomically, an index that cannot be written stays in memory """
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        try:
+            fd, tmp = tempfile.mkstemp(suffix=".idx", dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.data)
+            os.chmod(tmp, stat.st_mode & 0o666)
+            os.replace(tmp, index_name(self.filename))
+        except OSError:
+            pass
+
+    def close(self):
+        for data in (self.buf, self.data):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def offset(self, pointer):
+        """ byte offset of a record from its pointer (e.g. b"I12") or None """
+        start, count = self.tables[pointer[:1]]
+        return search(self.data, start, count, ENTRY, int(pointer[1:]))
+
+    def pointer(self, fid):
+        """ pointer of the individual with a given FamilySearch ID or None """
+        if len(fid) > self.fid_entry.size - 8:
+            return None
+        start, count = self.fid_table
+        key = fid.encode("utf-8").ljust(self.fid_entry.size - 8, b"\0")
+        num = search(self.data, start, count, self.fid_entry, key)
+        return b"I%d" % num if num is not None else None
+
+    def record(self, pointer):
+        """ bytes of a record from its pointer, or b"" if there is no such record """
+        start = self.offset(pointer)
+        if start is None:
+            return b""
+        end = self.buf.find(b"\n0 ", start)
+        return self.buf[start : end + 1 if end >= 0 else len(self.buf)]
+
+    def links(self, pointer):
+        """ family links of an individual or a family as (tag, pointer) pairs """
+        return [
+            (tag.decode(), kind + num) for tag, kind, num in LINK.findall(self.record(pointer))
+        ]
+
+
+def subtree(index, fids, ascend=4, descend=0, marriage=False):
+    """ Walk the family links of a GEDCOM file from some individuals, as getmyancestors
+        downloads them: descendants of all the individuals found, with the other parent
+        of each child, then spouses of all of them
+        :param index: the Index of the GEDCOM file
+        :param fids: FamilySearch IDs of the starting individuals
+        :param ascend: number of generations to ascend
+        :param descend: number of generations to descend
+        :param marriage: add spouses and couples
+        return the pointers of the individuals and of the families
+    """
+    indi = set(p for p in map(index.pointer, fids) if p)
+    fam = set()
+
+    def walk(generation, fam_tag, tags, partners=()):
+        """ add the families of a generation with their members of tags and partners,
+            return the members of tags not found before
+        """
+        new, found = set(), set()
+        for p in generation:
+            for tag, f in index.links(p):
+                if tag != fam_tag:
+                    continue
+                fam.add(f)
+                for tag, x in index.links(f):
+                    if tag in tags:
+                        new.add(x)
+                    elif tag in partners:
+                        found.add(x)
+        new -= indi
+        indi.update(new, found)
+        return new
+
+    generation = set(indi)
+    for _ in range(ascend):
+        generation = walk(generation, "FAMC", ("HUSB", "WIFE"))
+    generation = set(indi)
+    for _ in range(descend):
+        generation = walk(generation, "FAMS", ("CHIL",), ("HUSB", "WIFE"))
+    if marriage:
+        walk(set(indi), "FAMS", ("HUSB", "WIFE"))
+    return indi, fam
+
+
+def extract(index, indi, fam, out):
+    """ Write a GEDCOM file with some records of an indexed GEDCOM file
+        links to individuals and families left out are removed, and the sources and notes
+        referenced by the records are added
+        :param indi: the pointers of the individuals
+        :param fam: the pointers of the families
+        :param out: the output file object
+    """
+    kept = set(indi) | set(fam)
+
+    def link(match):
+        return match.group(0) if match.group(1) in kept else b""
+
+    def key(pointer):
+        return int(pointer[1:])
+
+    out.write(index.buf[: index.header_end].decode("utf-8"))
+    references = set()
+    for pointers in (indi, fam):
+        for p in sorted(pointers, key=key):
+            record = FAM_LINK.sub(link, index.record(p))
+            references.update(REFERENCE.findall(record))
+            out.write(record.decode("utf-8"))
+    sources = sorted((p for p in references if p[:1] == b"S"), key=key)
+    records = [index.record(p) for p in sources]
+    for record in records:
+        references.update(REFERENCE.findall(record))
+        out.write(record.decode("utf-8"))
+    for p in sorted((p for p in references if p[:1] == b"N"), key=key):
+        out.write(index.record(p).decode("utf-8"))
+    out.write("0 TRLR\n")
+
+
+class TestExtract(unittest.TestCase):
+    def setUp(self):
+        """ a GEDCOM file with three generations: grandparents, parents and a child,
+            an aunt, and a half-sibling from another partner of the father
+        """
+        tree = gt.Tree()
+        tree.display_name, tree.lang = "Tester", "English"
+        fids = ["AAAA-%03d" % i for i in range(1, 11)]
+        for fid in fids:
+            tree.indi[fid] = gt.Indi(fid, tree)
+        tree.add_trio("AAAA-001", "AAAA-002", "AAAA-005")
+        tree.add_trio("AAAA-001", "AAAA-002", "AAAA-008")
+        tree.add_trio("AAAA-003", "AAAA-004", "AAAA-006")
+        tree.add_trio("AAAA-005", "AAAA-006", "AAAA-007")
+        tree.add_trio("AAAA-005", "AAAA-010", "AAAA-009")
+        tree.indi["AAAA-001"].notes.add(gt.Note("grandfather", tree))
+        tree.reset_num()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, "tree.ged")
+        with open(self.filename, "w", encoding="utf-8") as f:
+            tree.print(f)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def extract(self, fids, ascend, descend=0, marriage=False):
+        out = io.StringIO()
+        with Index(self.filename) as index:
+            extract(index, *subtree(index, fids, ascend, descend, marriage), out)
+        out.seek(0)
+        return mm.Gedcom(out, gt.Tree())
+
+    def fids(self, ged):
+        return sorted(o.fid for o in ged.indi.values())
+
+    def test_ascend(self):
+        ged = self.extract(["AAAA-007"], 1)
+        self.assertEqual(self.fids(ged), ["AAAA-005", "AAAA-006", "AAAA-007"])
+        self.assertEqual(len(ged.fam), 1)
+        ged = self.extract(["AAAA-007"], 2)
+        self.assertEqual(len(ged.indi), 7)
+        self.assertEqual(len(ged.fam), 3)
+        self.assertEqual([n.text for n in ged.tree.notes], ["grandfather"])
+
+    def test_descend(self):
+        ged = self.extract(["AAAA-001"], 0, 1)
+        self.assertEqual(self.fids(ged), ["AAAA-001", "AAAA-002", "AAAA-005", "AAAA-008"])
+        ged = self.extract(["AAAA-001"], 0, 2)
+        self.assertEqual(len(ged.indi), 8)
+        self.assertEqual(len(ged.fam), 3)
+
+    def test_getmyancestors_options(self):
+        """ the individuals getmyancestors downloads with -a, -d and -m: descendants of
+            the ancestors too, with the other parent of each child
+        """
+        ged = self.extract(["AAAA-007"], 1, 1)
+        fids = ["AAAA-005", "AAAA-006", "AAAA-007", "AAAA-009", "AAAA-010"]
+        self.assertEqual(self.fids(ged), fids)
+        self.assertEqual(len(ged.fam), 2)
+        ged = self.extract(["AAAA-007"], 2, 1)
+        self.assertEqual(len(ged.indi), 10)
+        ged = self.extract(["AAAA-009"], 0, 0, marriage=True)
+        self.assertEqual(self.fids(ged), ["AAAA-009"])
+        ged = self.extract(["AAAA-009"], 1, 0, marriage=True)
+        self.assertEqual(self.fids(ged), ["AAAA-005", "AAAA-006", "AAAA-009", "AAAA-010"])
+
+    def test_stale_index(self):
+        with Index(self.filename) as index:
+            self.assertIn(b"1 _FSFTID AAAA-007\n", index.record(index.pointer("AAAA-007")))
+        with open(self.filename, "a", encoding="utf-8") as f:
+            f.write("\n")
+        os.utime(self.filename, ns=(0, 0))
+        with Index(self.filename) as index:
+            self.assertEqual(HEADER.unpack_from(index.data)[2], 0)
+            self.assertIsNone(index.pointer("ZZZZ-999"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Extract subtrees from GEDCOM files through a sidecar index (4 Jul 2016)",
+        add_help=False,
+        usage="extractmyancestors.py -g input.ged -i ID1 ID2 ... [options]",
+    )
+    try:
+        parser.add_argument(
+            "-g",
+            "--gedcom",
+            metavar="<FILE>",
+            type=str,
+            required=True,
+            help="input GEDCOM file, indexed into <FILE>.idx",
+        )
+        parser.add_argument(
+            "-i",
+            "--individuals",
+            metavar="<STR>",
+            nargs="+",
+            type=str,
+            default=[],
+            help="List of individual FamilySearch IDs for whom to extract the subtree",
+        )
+        parser.add_argument(
+            "-a",
+            "--ascend",
+            metavar="<INT>",
+            type=int,
+            default=4,
+            help="Number of generations to ascend [4]",
+        )
+        parser.add_argument(
+            "-d",
+            "--descend",
+            metavar="<INT>",
+            type=int,
+            default=0,
+            help="Number of generations to descend [0]",
+        )
+        parser.add_argument(
+            "-m",
+            "--marriage",
+            action="store_true",
+            default=False,
+            help="Add spouses and couples information [False]",
+        )
+        parser.add_argument(
+            "--reindex",
+            action="store_true",
+            default=False,
+            help="Rebuild the index even if it is up to date [False]",
+        )
+        parser.add_argument(
+            "-o",
+            metavar="<FILE>",
+            nargs="?",
+            type=gt.output_file,
+            default=sys.stdout,
+            help="output GEDCOM file, compressed if it ends with .gz or .zst [stdout]",
+        )
+    except TypeError:
+        sys.stderr.write("Python >= 3.4 is required to run this script\n")
+        sys.stderr.write("(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n")
+        exit(2)
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit as e:
+        print(e.code)
+        parser.print_help()
+        exit(2)
+
+    with Index(args.gedcom, args.reindex) as index:
+        if args.individuals:
+            for fid in args.individuals:
+                if not index.pointer(fid):
+                    sys.stderr.write("Individual not found: %s\n" % fid)
+            indi, fam = subtree(index, args.individuals, args.ascend, args.descend, args.marriage)
+            extract(index, indi, fam, args.o)
+    if args.o and args.o is not sys.stdout:
+        args.o.close()
@@ -14,11 +14,14 @@ from threading import Thread
 from diskcache import Cache
 
 # local import
-from getmyancestors import Session, Tree, Indi, Fam
-from mergemyancestors import Gedcom
+from getmyancestors import Session, Tree, open_output
+from mergemyancestors import merge_files
 from translation import translations
 
 
+# file extension of binary tree snapshots
+SNAPSHOT = ".gms"
+
 tmp_dir = os.path.join(tempfile.gettempdir(), "fstogedcom")
 cache = Cache(tmp_dir)
 lang = cache.get("lang")
@@ -132,12 +135,14 @@ class Merge(Frame):
         )
         self.files_to_merge = FilesToMerge(self)
         self.btn_add_file = Button(self, text=_("Add files"), command=self.add_files)
+        self.info = Label(self)
         buttons = Frame(self, borderwidth=20)
         self.btn_quit = Button(buttons, text=_("Quit"), command=self.quit)
         self.btn_save = Button(buttons, text=_("Merge"), command=self.save)
         warning.pack()
         self.files_to_merge.pack()
         self.btn_add_file.pack()
+        self.info.pack()
         self.btn_quit.pack(side="left", padx=(0, 40))
         self.btn_save.pack(side="right", padx=(40, 0))
         buttons.pack(side="bottom")
@@ -147,7 +152,7 @@ class Merge(Frame):
         for filename in filedialog.askopenfilenames(
             title=_("Open"),
             defaultextension=".ged",
-            filetypes=(("GEDCOM", ".ged"), (_("All files"), "*.*")),
+            filetypes=(("GEDCOM", ".ged"), (_("Snapshot"), SNAPSHOT), (_("All files"), "*.*")),
         ):
             self.files_to_merge.add_file(filename)
 
@@ -160,74 +165,37 @@ class Merge(Frame):
         filename = filedialog.asksaveasfilename(
             title=_("Save as"),
             defaultextension=".ged",
-            filetypes=(("GEDCOM", ".ged"), (_("All files"), "*.*")),
+            filetypes=(("GEDCOM", ".ged"), (_("Snapshot"), SNAPSHOT), (_("All files"), "*.*")),
         )
-        tree = Tree()
-
-        indi_counter = 0
-        fam_counter = 0
-
-        # read the GEDCOM data
-        for file in self.files_to_merge.files.values():
-            ged = Gedcom(file, tree)
-
-            # add informations about individuals
-            for num in ged.indi:
-                fid = ged.indi[num].fid
-                if fid not in tree.indi:
-                    indi_counter += 1
-                    tree.indi[fid] = Indi(tree=tree, num=indi_counter)
-                    tree.indi[fid].tree = tree
-                    tree.indi[fid].fid = ged.indi[num].fid
-                tree.indi[fid].fams_fid |= ged.indi[num].fams_fid
-                tree.indi[fid].famc_fid |= ged.indi[num].famc_fid
-                tree.indi[fid].name = ged.indi[num].name
-                tree.indi[fid].birthnames = ged.indi[num].birthnames
-                tree.indi[fid].nicknames = ged.indi[num].nicknames
-                tree.indi[fid].aka = ged.indi[num].aka
-                tree.indi[fid].married = ged.indi[num].married
-                tree.indi[fid].gender = ged.indi[num].gender
-                tree.indi[fid].facts = ged.indi[num].facts
-                tree.indi[fid].notes = ged.indi[num].notes
-                tree.indi[fid].sources = ged.indi[num].sources
-                tree.indi[fid].memories = ged.indi[num].memories
-                tree.indi[fid].baptism = ged.indi[num].baptism
-                tree.indi[fid].confirmation = ged.indi[num].confirmation
-                tree.indi[fid].endowment = ged.indi[num].endowment
-                if not (tree.indi[fid].sealing_child and tree.indi[fid].sealing_child.famc):
-                    tree.indi[fid].sealing_child = ged.indi[num].sealing_child
-
-            # add informations about families
-            for num in ged.fam:
-                husb, wife = (ged.fam[num].husb_fid, ged.fam[num].wife_fid)
-                if (husb, wife) not in tree.fam:
-                    fam_counter += 1
-                    tree.fam[(husb, wife)] = Fam(husb, wife, tree, fam_counter)
-                    tree.fam[(husb, wife)].tree = tree
-                tree.fam[(husb, wife)].chil_fid |= ged.fam[num].chil_fid
-                tree.fam[(husb, wife)].fid = ged.fam[num].fid
-                tree.fam[(husb, wife)].facts = ged.fam[num].facts
-                tree.fam[(husb, wife)].notes = ged.fam[num].notes
-                tree.fam[(husb, wife)].sources = ged.fam[num].sources
-                tree.fam[(husb, wife)].sealing_spouse = ged.fam[num].sealing_spouse
-
-        # merge notes by text
-        tree.notes = sorted(tree.notes, key=lambda x: x.text)
-        for i, n in enumerate(tree.notes):
-            if i == 0:
-                n.num = 1
-                continue
-            if n.text == tree.notes[i - 1].text:
-                n.num = tree.notes[i - 1].num
-            else:
-                n.num = tree.notes[i - 1].num + 1
+        if not filename:
+            return
+        self.btn_save.config(state="disabled")
+        self.btn_add_file.config(state="disabled")
+        Thread(target=self.merge, args=(filename,)).start()
 
-        # compute number for family relationships and print GEDCOM file
-        tree.reset_num()
-        with open(filename, "w", encoding="utf-8") as file:
-            tree.print(file)
+    def merge(self, filename):
+        """ merge GEDCOM files in a thread, keeping the window responsive """
+        files = self.files_to_merge.files.values()
+        try:
+            if filename.endswith(SNAPSHOT):
+                with open(filename, "wb") as file:
+                    merge_files(files, None, progress=self.progress, snapshot=file)
+            else:
+                with open_output(filename) as file:
+                    merge_files(files, file, progress=self.progress)
+        except Exception as e:
+            messagebox.showinfo(_("Error"), message=_("Merge failed: ") + str(e))
+            return
+        finally:
+            self.info.config(text="")
+            self.btn_save.config(state="normal")
+            self.btn_add_file.config(state="normal")
         messagebox.showinfo(_("Info"), message=_("Files successfully merged"))
 
+    def progress(self, done, total):
+        """ display the number of files read """
+        self.info.config(text=_("Files read: %s/%s") % (done, total))
+
     def quit(self):
         """ prevent exception on quit during download """
         super(Merge, self).quit()
@@ -425,11 +393,15 @@ class Download(Frame):
         filename = filedialog.asksaveasfilename(
             title=_("Save as"),
             defaultextension=".ged",
-            filetypes=(("GEDCOM", ".ged"), (_("All files"), "*.*")),
+            filetypes=(("GEDCOM", ".ged"), (_("Snapshot"), SNAPSHOT), (_("All files"), "*.*")),
         )
         if not filename:
             return
-        with open(filename, "w", encoding="utf-8") as file:
+        if filename.endswith(SNAPSHOT):
+            with open(filename, "wb") as file:
+                self.tree.save_snapshot(file)
+            return
+        with open_output(filename) as file:
             self.tree.print(file)
 
     def login(self):
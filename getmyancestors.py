@@ -23,9 +23,22 @@
 
 # global import
 from __future__ import print_function
+import gc
+import io
+import os
 import re
+import ast
 import sys
+import gzip
+import json
+import zlib
 import time
+import queue
+import threading
+import array
+import struct
+import sqlite3
+import contextlib
 import getpass
 import asyncio
 import argparse
@@ -44,8 +57,70 @@ except ImportError:
     )
     sys.exit(2)
 
+try:
+    import zstandard
+except ImportError:
+    # only needed for .zst files
+    zstandard = None
+
 # is subject to change: see https://www.familysearch.org/developers/docs/api/tree/Persons_resource
 MAX_PERSONS = 500
+PERSONS_URL = "/platform/tree/persons.json?pids="
+# FamilySearch servers, pointed to a local stub server by benchmyancestors.py
+LOGIN_URL = "https://www.familysearch.org"
+IDENT_URL = "https://ident.familysearch.org"
+API_URL = "https://familysearch.org"
+
+# binary snapshot of a Tree: magic and format version, then the packed records in JSON
+# (data only, so that a snapshot from anywhere can be loaded safely)
+SNAPSHOT = struct.Struct("<6sH")
+SNAPSHOT_MAGIC = b"GMSNAP"
+SNAPSHOT_VERSION = 2
+
+# tables exported by Tree.save_columns and Tree.save_sqlite, and the NumPy .npy 1.0 header
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_DESCR = {"i": "<i4", "q": "<i8", "B": "|u1"}
+COLUMNS = {
+    "individuals": (("num", int), ("fid", str), ("gender", str)),
+    "names": (
+        ("indi", int),
+        ("kind", str),
+        ("given", str),
+        ("surname", str),
+        ("prefix", str),
+        ("suffix", str),
+        ("note", int),
+    ),
+    "facts": (
+        ("indi", int),
+        ("fam", int),
+        ("type", str),
+        ("value", str),
+        ("date", str),
+        ("place", str),
+        ("note", int),
+    ),
+    "families": (("num", int), ("fid", str), ("husb", int), ("wife", int)),
+    "children": (("fam", int), ("indi", int)),
+    "sources": (("num", int), ("fid", str), ("title", str), ("citation", str), ("url", str)),
+    "citations": (("indi", int), ("fam", int), ("source", int), ("page", str)),
+    "notes": (("num", int), ("text", str)),
+}
+SQLITE_TYPES = {int: "INTEGER", str: "TEXT"}
+SQLITE_INDEXES = (
+    ("individuals", "fid"),
+    ("names", "indi"),
+    ("facts", "indi"),
+    ("facts", "fam"),
+    ("families", "husb"),
+    ("families", "wife"),
+    ("children", "fam"),
+    ("children", "indi"),
+    ("sources", "fid"),
+    ("citations", "indi"),
+    ("citations", "fam"),
+    ("citations", "source"),
+)
 
 FACT_TAGS = {
     "http://gedcomx.org/Birth": "BIRT",
@@ -88,6 +163,132 @@ ORDINANCES_STATUS = {
 }
 
 
+@contextlib.contextmanager
+def no_gc():
+    """ suspend the cyclic garbage collector while building many objects """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def zstd():
+    """ return the zstandard module, needed for .zst files """
+    if zstandard is None:
+        raise ImportError(
+            "You need to install the zstandard module to read or write .zst files\n"
+            '(run this in your terminal: "python3 -m pip install zstandard")'
+        )
+    return zstandard
+
+
+# compressors of the output files, by file extension, with compress and flush methods
+COMPRESSORS = {
+    ".gz": lambda: zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+    ".zst": lambda: zstd().ZstdCompressor().compressobj(),
+}
+
+
+class CompressedWriter(io.RawIOBase):
+    """ Binary file compressing the data written in a background thread,
+        so that compression overlaps the serialization done by the writer
+        :param file: the binary file object receiving the compressed data
+        :param compressor: an object of COMPRESSORS
+    """
+
+    def __init__(self, file, compressor):
+        super().__init__()
+        self.file = file
+        self.name = file.name
+        self.compressor = compressor
+        self.error = None
+        self.queue = queue.Queue(8)
+        self.thread = threading.Thread(target=self.__compress, daemon=True)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.error:
+            raise self.error
+        self.queue.put(bytes(b))
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+            self.file.close()
+            super().close()
+            if self.error:
+                raise self.error
+
+    def __compress(self):
+        """ Compress and write the queued data until None """
+        try:
+            for data in iter(self.queue.get, None):
+                self.file.write(self.compressor.compress(data))
+            self.file.write(self.compressor.flush())
+        except Exception as e:
+            self.error = e
+            # unblock the writer until it closes the file
+            for data in iter(self.queue.get, None):
+                pass
+
+
+def open_output(filename):
+    """ Open a text file for writing, compressed in a background thread
+        if its name ends with an extension of COMPRESSORS (.gz or .zst)
+    """
+    for extension, compressor in COMPRESSORS.items():
+        if filename.endswith(extension):
+            compressor = compressor()
+            raw = CompressedWriter(open(filename, "wb"), compressor)
+            return io.TextIOWrapper(io.BufferedWriter(raw, 1 << 20), encoding="utf-8")
+    return open(filename, "w", encoding="utf-8")
+
+
+def output_file(filename):
+    """ argparse type of output GEDCOM files, possibly compressed, "-" being stdout """
+    if filename == "-":
+        return sys.stdout
+    try:
+        return open_output(filename)
+    except (OSError, ImportError) as e:
+        raise argparse.ArgumentTypeError("can't open '%s': %s" % (filename, e))
+
+
+def archive_file(filename):
+    """ argparse type of the --archive file, possibly compressed, stdout being the GEDCOM """
+    if filename == "-":
+        raise argparse.ArgumentTypeError("the archive can't be written to stdout")
+    return output_file(filename)
+
+
+def decompressor(buf):
+    """ return a binary file object reading the content of a gzip or zstd compressed
+        buffer (bytes, mmap...), or None if the buffer is not compressed
+    """
+    if buf[:2] == b"\x1f\x8b":
+        return gzip.GzipFile(fileobj=buf if hasattr(buf, "read") else io.BytesIO(buf))
+    if buf[:4] == b"\x28\xb5\x2f\xfd":
+        return zstd().ZstdDecompressor().stream_reader(buf, read_across_frames=True)
+    return None
+
+
+def decompress(buf):
+    """ return the content of a gzip or zstd compressed buffer, or the buffer itself """
+    reader = decompressor(buf)
+    if reader is None:
+        return buf
+    with reader:
+        return reader.read()
+
+
 def cont(string):
     """ parse a GEDCOM line adding CONT and CONT tags if necessary """
     level = int(string[:1]) + 1
@@ -119,14 +320,17 @@ class Session:
         :param verbose: True to active verbose mode
         :param logfile: a file object or similar
         :param timeout: time before retry a request
+        :param archive: a text file object receiving the JSON responses, one per line
     """
 
-    def __init__(self, username, password, verbose=False, logfile=False, timeout=60):
+    def __init__(self, username, password, verbose=False, logfile=False, timeout=60, archive=None):
         self.username = username
         self.password = password
         self.verbose = verbose
         self.logfile = logfile
         self.timeout = timeout
+        self.archive = archive
+        self.archive_lock = threading.Lock()
         self.fid = self.lang = self.display_name = None
         self.counter = 0
         self.logged = self.login()
@@ -145,7 +349,7 @@ class Session:
         """
         while True:
             try:
-                url = "https://www.familysearch.org/auth/familysearch/login"
+                url = LOGIN_URL + "/auth/familysearch/login"
                 self.write_log("Downloading: " + url)
                 r = requests.get(url, params={"ldsauth": False}, allow_redirects=False)
                 url = r.headers["Location"]
@@ -155,7 +359,7 @@ class Session:
                 span = r.text[idx + 21 :].index('"')
                 params = r.text[idx + 21 : idx + 21 + span]
 
-                url = "https://ident.familysearch.org/cis-web/oauth2/v3/authorization"
+                url = IDENT_URL + "/cis-web/oauth2/v3/authorization"
                 self.write_log("Downloading: " + url)
                 r = requests.post(
                     url,
@@ -202,11 +406,21 @@ class Session:
     def get_url(self, url):
         """ retrieve JSON structure from a FamilySearch URL """
         self.counter += 1
+        data = self.__get_url(url)
+        if self.archive:
+            line = json.dumps({"url": url, "time": time.time(), "data": data})
+            # requests are sent from several threads
+            with self.archive_lock:
+                self.archive.write(line + "\n")
+        return data
+
+    def __get_url(self, url):
+        """ retrieve JSON structure from a FamilySearch URL, retrying until it succeeds """
         while True:
             try:
                 self.write_log("Downloading: " + url)
                 r = requests.get(
-                    "https://familysearch.org" + url,
+                    API_URL + url,
                     cookies={"fssessionid": self.fssessionid},
                     timeout=self.timeout,
                 )
@@ -271,6 +485,70 @@ class Session:
         return string
 
 
+class ArchiveSession(Session):
+    """ Replay the FamilySearch responses archived by a Session, without network access
+        individuals are served one by one, so that they can be requested in other batches
+        than when they were downloaded (different options, sets in another order)
+        :param filename: an archive written with --archive, possibly compressed
+        :param verbose: True to active verbose mode
+        :param logfile: a file object or similar
+    """
+
+    def __init__(self, filename, verbose=False, logfile=False):
+        self.filename = filename
+        self.responses = dict()
+        self.persons = dict()
+        self.places = dict()
+        self.relationships = dict()
+        super().__init__(None, None, verbose, logfile, 0)
+
+    def login(self):
+        """ read the archive, keeping the last response of each URL """
+        self.write_log("Reading archive: " + self.filename)
+        with open(self.filename, "rb") as f:
+            lines = decompress(f.read()).splitlines()
+        for line in lines:
+            response = json.loads(line)
+            url, data = response["url"], response["data"]
+            if not url.startswith(PERSONS_URL):
+                self.responses[url] = data
+                continue
+            data = data or dict()
+            for person in data.get("persons", []):
+                self.persons[person["id"]] = person
+            for place in data.get("places", []):
+                self.places[place["id"]] = place
+            for key in ("childAndParentsRelationships", "relationships"):
+                for rel in data.get(key, []):
+                    for role in ("parent1", "parent2", "child", "person1", "person2"):
+                        if role in rel:
+                            rels = self.relationships.setdefault(rel[role]["resourceId"], dict())
+                            rels[rel.get("id", id(rel))] = (key, rel)
+        self.set_current()
+        return True
+
+    def get_url(self, url):
+        """ retrieve JSON structure of a FamilySearch URL from the archive """
+        self.counter += 1
+        self.write_log("Reading: " + url)
+        if url.startswith(PERSONS_URL):
+            fids = url[len(PERSONS_URL) :].split(",")
+            data = {"persons": [self.persons[fid] for fid in fids if fid in self.persons]}
+            if not data["persons"]:
+                return None
+            data["places"] = list(self.places.values())
+            for fid in fids:
+                for key, rel in self.relationships.get(fid, dict()).values():
+                    data.setdefault(key, dict())[id(rel)] = rel
+            for key in ("childAndParentsRelationships", "relationships"):
+                if key in data:
+                    data[key] = list(data[key].values())
+            return data
+        if url not in self.responses:
+            self.write_log("WARNING: not in archive: " + url)
+        return self.responses.get(url)
+
+
 class Note:
     """ GEDCOM Note class
         :param text: the Note content
@@ -829,6 +1107,274 @@ class Fam:
                 file.write(cont("2 PAGE " + quote))
 
 
+def pack_source(o, note):
+    """ Pack a Source into a tuple
+        :param note: function returning the packed form of a Note
+    """
+    return (o.fid, o.title, o.citation, o.url, tuple(note(n) for n in o.notes))
+
+
+def unpack_source(data, note, num=None):
+    """ Rebuild a Source packed by pack_source
+        :param note: function returning a Note from its packed form
+    """
+    o = Source(num=num)
+    o.fid, o.title, o.citation, o.url = data[:4]
+    o.notes = set(note(n) for n in data[4])
+    return o
+
+
+def pack_indi(o, note, source, fam):
+    """ Pack an individual into a tuple of plain values
+        :param note: function returning the packed form of a Note
+        :param source: function returning the packed form of a Source
+        :param fam: function returning the packed form of a Fam
+    """
+
+    def name(x):
+        return (x.given, x.surname, x.prefix, x.suffix, note(x.note) if x.note else None)
+
+    return (
+        o.num,
+        o.fid,
+        o.gender,
+        name(o.name) if o.name else None,
+        tuple(name(x) for x in o.birthnames),
+        tuple(name(x) for x in o.nicknames),
+        tuple(name(x) for x in o.aka),
+        tuple(name(x) for x in o.married),
+        tuple(pack_fact(x, note) for x in o.facts),
+        tuple(note(x) for x in o.notes),
+        tuple((source(x), page) for x, page in o.sources),
+        tuple((x.description, x.url) for x in o.memories),
+        tuple(
+            pack_ordinance(x, fam)
+            for x in (o.baptism, o.confirmation, o.initiatory, o.endowment, o.sealing_child)
+        ),
+        tuple(o.famc_fid),
+        tuple(o.fams_fid),
+        tuple(o.famc_num),
+        tuple(o.fams_num),
+    )
+
+
+def unpack_indi(data, tree, note, source, fam):
+    """ Rebuild an individual packed by pack_indi
+        :param note: function returning a Note from its packed form
+        :param source: function returning a Source from its packed form
+        :param fam: function returning a Fam from its packed form
+    """
+
+    def name(x):
+        n = Name()
+        n.given, n.surname, n.prefix, n.suffix = x[:4]
+        n.note = note(x[4]) if x[4] is not None else None
+        return n
+
+    o = Indi(data[1], tree, data[0])
+    o.gender = data[2]
+    o.name = name(data[3]) if data[3] else None
+    o.birthnames = set(name(x) for x in data[4])
+    o.nicknames = set(name(x) for x in data[5])
+    o.aka = set(name(x) for x in data[6])
+    o.married = set(name(x) for x in data[7])
+    o.facts = set(unpack_fact(x, note) for x in data[8])
+    o.notes = set(note(x) for x in data[9])
+    o.sources = set((source(x), page) for x, page in data[10])
+    for description, url in data[11]:
+        memorie = Memorie()
+        memorie.description, memorie.url = description, url
+        o.memories.add(memorie)
+    o.baptism, o.confirmation, o.initiatory, o.endowment, o.sealing_child = (
+        unpack_ordinance(x, fam) for x in data[12]
+    )
+    o.famc_fid, o.fams_fid = set(data[13]), set(data[14])
+    o.famc_num, o.fams_num = set(data[15]), set(data[16])
+    return o
+
+
+def pack_fam(o, note, source, fam):
+    """ Pack a family into a tuple of plain values (see pack_indi) """
+    return (
+        o.num,
+        o.husb_fid,
+        o.wife_fid,
+        o.husb_num,
+        o.wife_num,
+        o.fid,
+        tuple(pack_fact(x, note) for x in o.facts),
+        pack_ordinance(o.sealing_spouse, fam),
+        tuple(o.chil_fid),
+        tuple(o.chil_num),
+        tuple(note(x) for x in o.notes),
+        tuple((source(x), page) for x, page in o.sources),
+    )
+
+
+def unpack_fam(data, tree, note, source, fam):
+    """ Rebuild a family packed by pack_fam (see unpack_indi) """
+    o = Fam(data[1], data[2], tree, data[0])
+    o.husb_num, o.wife_num, o.fid = data[3:6]
+    o.facts = set(unpack_fact(x, note) for x in data[6])
+    o.sealing_spouse = unpack_ordinance(data[7], fam)
+    o.chil_fid, o.chil_num = set(data[8]), set(data[9])
+    o.notes = set(note(x) for x in data[10])
+    o.sources = set((source(x), page) for x, page in data[11])
+    return o
+
+
+def pack_fact(o, note):
+    """ Pack a Fact into a tuple """
+    return (o.type, o.value, o.date, o.place, o.map, note(o.note) if o.note else None)
+
+
+def unpack_fact(data, note):
+    """ Rebuild a Fact packed by pack_fact """
+    o = Fact()
+    o.type, o.value, o.date, o.place, o.map = data[:5]
+    o.note = note(data[5]) if data[5] is not None else None
+    return o
+
+
+def pack_ordinance(o, fam):
+    """ Pack an Ordinance into a tuple """
+    if o:
+        return (o.date, o.temple_code, o.status, fam(o.famc) if o.famc else None)
+    return None
+
+
+def unpack_ordinance(data, fam):
+    """ Rebuild an Ordinance packed by pack_ordinance """
+    if data:
+        o = Ordinance()
+        o.date, o.temple_code, o.status = data[:3]
+        o.famc = fam(data[3]) if data[3] is not None else None
+        return o
+    return None
+
+
+def write_npy(filename, typecode, values):
+    """ Write a one-dimensional array in NumPy .npy format, without needing NumPy
+        :param typecode: an array typecode among NPY_DESCR
+    """
+    data = array.array(typecode, values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%s,), }" % (
+        NPY_DESCR[typecode],
+        len(data),
+    )
+    # the data starts on a 64 bytes boundary
+    header += " " * (-(len(NPY_MAGIC) + 3 + len(header)) % 64) + "\n"
+    with open(filename, "wb") as file:
+        file.write(NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin-1"))
+        data.tofile(file)
+
+
+def read_npy(filename):
+    """ Read a one-dimensional array written by write_npy into an array.array """
+    with open(filename, "rb") as file:
+        if file.read(len(NPY_MAGIC)) != NPY_MAGIC:
+            raise ValueError("not a NumPy .npy file (format 1.0): %s" % filename)
+        size = struct.unpack("<H", file.read(2))[0]
+        header = ast.literal_eval(file.read(size).decode("latin-1"))
+        typecode = {descr: code for code, descr in NPY_DESCR.items()}[header["descr"]]
+        data = array.array(typecode, file.read())
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data
+
+
+def write_columns(directory, tables):
+    """ Write tables as one .npy file per column (see COLUMNS)
+        integers are int32, -1 when missing
+        strings are dictionary encoded: <table>.<column>.npy holds int32 codes (-1 when missing)
+        and the dictionary is stored Arrow-like, as UTF-8 bytes in <table>.<column>.data.npy
+        and int64 offsets in <table>.<column>.offsets.npy
+        :param tables: a dict of table names to lists of rows
+    """
+    os.makedirs(directory, exist_ok=True)
+    for table, columns in COLUMNS.items():
+        for i, (column, kind) in enumerate(columns):
+            path = os.path.join(directory, "%s.%s" % (table, column))
+            values = [row[i] for row in tables[table]]
+            if kind is int:
+                write_npy(path + ".npy", "i", (-1 if x is None else x for x in values))
+                continue
+            codes = {None: -1}
+            write_npy(path + ".npy", "i", (codes.setdefault(x, len(codes) - 1) for x in values))
+            data = [x.encode("utf-8") for x in codes if x is not None]
+            offsets = [0]
+            for x in data:
+                offsets.append(offsets[-1] + len(x))
+            write_npy(path + ".offsets.npy", "q", offsets)
+            write_npy(path + ".data.npy", "B", b"".join(data))
+
+
+def read_columns(directory):
+    """ Read the tables written by write_columns, strings decoded and missing values as None
+        return a dict of table names to dicts of column names to lists of values
+    """
+    tables = dict()
+    for table, columns in COLUMNS.items():
+        tables[table] = dict()
+        for column, kind in columns:
+            path = os.path.join(directory, "%s.%s" % (table, column))
+            values = read_npy(path + ".npy")
+            if kind is int:
+                tables[table][column] = [None if x == -1 else x for x in values]
+                continue
+            offsets = read_npy(path + ".offsets.npy")
+            data = read_npy(path + ".data.npy").tobytes()
+            strings = [
+                data[offsets[i] : offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)
+            ]
+            tables[table][column] = [None if x == -1 else strings[x] for x in values]
+    return tables
+
+
+def write_sqlite(filename, tables):
+    """ Write tables into a new SQLite database (see COLUMNS), then replace filename with it
+        the rows are inserted in a single transaction and the indexes created afterwards
+        :param tables: a dict of table names to lists of rows
+    """
+    tmp = filename + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp, isolation_level=None)
+    try:
+        # a new database, only renamed once complete: no need for a journal
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+        for table, columns in COLUMNS.items():
+            conn.execute(
+                "CREATE TABLE %s (%s)"
+                % (
+                    table,
+                    ", ".join(
+                        "num INTEGER PRIMARY KEY"
+                        if column == "num"
+                        else "%s %s" % (column, SQLITE_TYPES[kind])
+                        for column, kind in columns
+                    ),
+                )
+            )
+            conn.executemany(
+                "INSERT INTO %s VALUES (%s)" % (table, ", ".join("?" * len(columns))),
+                tables[table],
+            )
+        for table, column in SQLITE_INDEXES:
+            conn.execute("CREATE INDEX %s_%s ON %s (%s)" % (table, column, table, column))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.close()
+        os.remove(tmp)
+        raise
+    conn.close()
+    os.replace(tmp, filename)
+
+
 class Tree:
     """ family tree class
         :param fs: a Session object
@@ -863,9 +1409,7 @@ class Tree:
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         while new_fids:
-            data = self.fs.get_url(
-                "/platform/tree/persons.json?pids=" + ",".join(new_fids[:MAX_PERSONS])
-            )
+            data = self.fs.get_url(PERSONS_URL + ",".join(new_fids[:MAX_PERSONS]))
             if data:
                 if "places" in data:
                     for place in data["places"]:
@@ -1009,6 +1553,188 @@ class Tree:
                 elif (o["spouse"]["resourceId"], fid) in self.fam:
                     self.fam[(o["spouse"]["resourceId"], fid)].sealing_spouse = Ordinance(o)
 
+    def save_snapshot(self, file):
+        """ save the family tree into a binary snapshot
+            :param file: a binary file object
+        """
+        with no_gc():
+            file.write(SNAPSHOT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+            state = json.dumps(self.__snapshot_state(), ensure_ascii=False, separators=(",", ":"))
+            file.write(state.encode("utf-8"))
+
+    def __snapshot_state(self):
+        """ Pack the family tree into tuples of plain values """
+        notes = list(self.notes)
+        note_index = {id(n): i for i, n in enumerate(notes)}
+        sources = list(self.sources.values())
+        source_index = {id(s): i for i, s in enumerate(sources)}
+
+        def note(n):
+            if id(n) not in note_index:
+                note_index[id(n)] = len(notes)
+                notes.append(n)
+            return note_index[id(n)]
+
+        def source(s):
+            if id(s) not in source_index:
+                source_index[id(s)] = len(sources)
+                sources.append(s)
+            return source_index[id(s)]
+
+        def fam(f):
+            return (f.husb_fid, f.wife_fid)
+
+        indi = list()
+        for o in self.indi.values():
+            data = pack_indi(o, note, source, fam)
+            indi.append(data + (tuple(o.parents), tuple(o.spouses), tuple(o.children)))
+        fams = [pack_fam(o, note, source, fam) for o in self.fam.values()]
+        return {
+            "display_name": self.display_name,
+            "lang": self.lang,
+            "places": tuple(self.places.items()),
+            "indi": tuple(indi),
+            "fam": tuple(fams),
+            "sources": tuple((s.num,) + pack_source(s, note) for s in sources),
+            "tree_sources": tuple((fid, source_index[id(s)]) for fid, s in self.sources.items()),
+            "notes": tuple((n.num, n.text) for n in notes),
+            "tree_notes": len(self.notes),
+        }
+
+    def load_snapshot(self, file):
+        """ load a family tree saved by save_snapshot into this empty tree
+            :param file: a binary file object
+        """
+        header = file.read(SNAPSHOT.size)
+        if len(header) < SNAPSHOT.size or SNAPSHOT.unpack(header)[0] != SNAPSHOT_MAGIC:
+            raise ValueError("not a getmyancestors snapshot")
+        version = SNAPSHOT.unpack(header)[1]
+        if version != SNAPSHOT_VERSION:
+            raise ValueError("unsupported snapshot version: %s" % version)
+        strings = dict()
+
+        def plain(x):
+            # JSON arrays back into tuples, equal strings (fids, fact types...) shared
+            if isinstance(x, list):
+                return tuple(map(plain, x))
+            if isinstance(x, str):
+                return strings.setdefault(x, x)
+            return x
+
+        with no_gc():
+            state = json.loads(file.read().decode("utf-8"))
+            if not isinstance(state, dict):
+                raise ValueError("not a getmyancestors snapshot")
+            self.__load_snapshot({key: plain(value) for key, value in state.items()})
+
+    def __load_snapshot(self, state):
+        """ Rebuild the family tree from the state saved by save_snapshot """
+        self.display_name = state["display_name"]
+        self.lang = state["lang"]
+        self.places = dict(state["places"])
+        notes = list()
+        for num, text in state["notes"]:
+            n = Note(num=num)
+            n.text = text
+            notes.append(n)
+        self.notes = notes[: state["tree_notes"]]
+        sources = [
+            unpack_source(data[1:], notes.__getitem__, data[0]) for data in state["sources"]
+        ]
+        for s in sources:
+            s.tree = self
+        self.sources = {fid: sources[i] for fid, i in state["tree_sources"]}
+
+        def fam(key):
+            # resolved once the families are loaded
+            return key
+
+        ordinances = list()
+        for data in state["indi"]:
+            o = unpack_indi(data, self, notes.__getitem__, sources.__getitem__, fam)
+            o.parents, o.spouses, o.children = set(data[17]), set(data[18]), set(data[19])
+            ordinances += [o.baptism, o.confirmation, o.initiatory, o.endowment, o.sealing_child]
+            self.indi[o.fid] = o
+        for data in state["fam"]:
+            o = unpack_fam(data, self, notes.__getitem__, sources.__getitem__, fam)
+            ordinances.append(o.sealing_spouse)
+            self.fam[(o.husb_fid, o.wife_fid)] = o
+        for ordinance in ordinances:
+            if ordinance and ordinance.famc:
+                ordinance.famc = self.fam.get(ordinance.famc)
+        # objects added later must not reuse the numbers of the snapshot
+        for cls, objects in (
+            (Indi, self.indi.values()),
+            (Fam, self.fam.values()),
+            (Note, notes),
+            (Source, sources),
+        ):
+            cls.counter = max([cls.counter] + [o.num for o in objects if o.num])
+
+    def save_columns(self, directory):
+        """ export the family tree as columnar tables (see COLUMNS)
+            :param directory: the directory receiving one .npy file per column (see write_columns)
+        """
+        with no_gc():
+            write_columns(directory, self.__tables())
+
+    def save_sqlite(self, filename):
+        """ export the family tree into a new SQLite database (see COLUMNS)
+            :param filename: the database file, replaced if it exists
+        """
+        with no_gc():
+            write_sqlite(filename, self.__tables())
+
+    def __tables(self):
+        """ Flatten the family tree into the rows of the tables of COLUMNS,
+            keyed by the GEDCOM identifiers
+        """
+        tables = {table: [] for table in COLUMNS}
+
+        def add(table, *row):
+            tables[table].append(row)
+
+        def num(fid):
+            return self.indi[fid].num if fid in self.indi else None
+
+        def facts(o, indi, fam):
+            for x in o.facts:
+                add("facts", indi, fam, x.type, x.value, x.date, x.place, x.note and x.note.num)
+
+        def citations(o, indi, fam):
+            for source, page in o.sources:
+                add("citations", indi, fam, source.num, page)
+
+        notes = dict()
+        for n in self.notes:
+            notes.setdefault(n.num, n)
+        for o in sorted(self.indi.values(), key=lambda x: x.num):
+            add("individuals", o.num, o.fid, o.gender)
+            names = [("preferred", o.name)] if o.name else []
+            for kind, x in (
+                ("birthname", o.birthnames),
+                ("nickname", o.nicknames),
+                ("aka", o.aka),
+                ("married", o.married),
+            ):
+                names += [(kind, name) for name in x]
+            for kind, x in names:
+                note = x.note and x.note.num
+                add("names", o.num, kind, x.given, x.surname, x.prefix, x.suffix, note)
+            facts(o, o.num, None)
+            citations(o, o.num, None)
+        for o in sorted(self.fam.values(), key=lambda x: x.num):
+            add("families", o.num, o.fid, num(o.husb_fid), num(o.wife_fid))
+            for fid in sorted(o.chil_fid, key=lambda x: self.indi[x].num):
+                add("children", o.num, num(fid))
+            facts(o, None, o.num)
+            citations(o, None, o.num)
+        for o in sorted(self.sources.values(), key=lambda x: x.num):
+            add("sources", o.num, o.fid, o.title, o.citation, o.url)
+        for o in sorted(notes.values(), key=lambda x: x.num):
+            add("notes", o.num, o.text)
+        return tables
+
     def reset_num(self):
         """ reset all GEDCOM identifiers """
         for husb, wife in self.fam:
@@ -1025,8 +1751,8 @@ class Tree:
                 self.fam[(husb, wife)].num for husb, wife in self.indi[fid].fams_fid
             )
 
-    def print(self, file=sys.stdout):
-        """ print family tree in GEDCOM format """
+    def print_header(self, file=sys.stdout):
+        """ print GEDCOM header and submitter """
         file.write("0 HEAD\n")
         file.write("1 CHAR UTF-8\n")
         file.write("1 GEDC\n")
@@ -1042,6 +1768,9 @@ class Tree:
         file.write("1 NAME %s\n" % self.display_name)
         file.write("1 LANG %s\n" % self.lang)
 
+    def print(self, file=sys.stdout):
+        """ print family tree in GEDCOM format """
+        self.print_header(file)
         for fid in sorted(self.indi, key=lambda x: self.indi.__getitem__(x).num):
             self.indi[fid].print(file)
         for husb, wife in sorted(self.fam, key=lambda x: self.fam.__getitem__(x).num):
@@ -1132,9 +1861,9 @@ def main():
             "-o",
             "--outfile",
             metavar="<FILE>",
-            type=argparse.FileType("w", encoding="UTF-8"),
+            type=output_file,
             default=sys.stdout,
-            help="output GEDCOM file [stdout]",
+            help="output GEDCOM file, compressed if it ends with .gz or .zst [stdout]",
         )
         parser.add_argument(
             "-l",
@@ -1144,6 +1873,42 @@ def main():
             default=False,
             help="output log file [stderr]",
         )
+        parser.add_argument(
+            "--snapshot",
+            metavar="<FILE>",
+            type=argparse.FileType("wb"),
+            default=None,
+            help="output binary snapshot of the tree, to be reloaded quickly [None]",
+        )
+        parser.add_argument(
+            "--columns",
+            metavar="<DIR>",
+            type=str,
+            default=None,
+            help="output directory of columnar tables (NumPy .npy files) for analytics [None]",
+        )
+        parser.add_argument(
+            "--sqlite",
+            metavar="<FILE>",
+            type=str,
+            default=None,
+            help="output SQLite database of the tree, replaced if it exists [None]",
+        )
+        parser.add_argument(
+            "--archive",
+            metavar="<FILE>",
+            type=archive_file,
+            default=None,
+            help="output archive of the FamilySearch responses, one JSON per line, "
+            "compressed if it ends with .gz or .zst [None]",
+        )
+        parser.add_argument(
+            "--from-archive",
+            metavar="<FILE>",
+            type=str,
+            default=None,
+            help="rebuild the tree from an archive instead of FamilySearch [None]",
+        )
     except TypeError:
         sys.stderr.write("Python >= 3.4 is required to run this script\n")
         sys.stderr.write("(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n")
@@ -1161,10 +1926,13 @@ def main():
             if not re.match(r"[A-Z0-9]{4}-[A-Z0-9]{3}", fid):
                 sys.exit("Invalid FamilySearch ID: " + fid)
 
-    args.username = args.username if args.username else input("Enter FamilySearch username: ")
-    args.password = (
-        args.password if args.password else getpass.getpass("Enter FamilySearch password: ")
-    )
+    if not args.from_archive:
+        args.username = (
+            args.username if args.username else input("Enter FamilySearch username: ")
+        )
+        args.password = (
+            args.password if args.password else getpass.getpass("Enter FamilySearch password: ")
+        )
 
     time_count = time.time()
 
@@ -1185,84 +1953,108 @@ def main():
                     formatting.format(action.option_strings[-1], parse_action(action))
                 )
 
-    # initialize a FamilySearch session and a family tree object
-    print("Login to FamilySearch...")
-    fs = Session(args.username, args.password, args.verbose, args.logfile, args.timeout)
-    if not fs.logged:
-        sys.exit(2)
-    _ = fs._
-    tree = Tree(fs)
-
-    # check LDS account
-    if (
-        args.get_ordinances
-        and fs.get_url("/platform/tree/persons/%s/ordinances.json" % fs.fid) == "error"
-    ):
-        sys.exit(2)
-
-    # add list of starting individuals to the family tree
-    todo = args.individuals if args.individuals else [fs.fid]
-    print(_("Downloading starting individuals..."))
-    tree.add_indis(todo)
-
-    # download ancestors
-    todo = set(todo)
-    done = set()
-    for i in range(args.ascend):
-        if not todo:
-            break
-        done |= todo
-        print(_("Downloading %s. of generations of ancestors...") % (i + 1))
-        todo = tree.add_parents(todo) - done
-
-    # download descendants
-    todo = set(tree.indi.keys())
-    done = set()
-    for i in range(args.descend):
-        if not todo:
-            break
-        done |= todo
-        print(_("Downloading %s. of generations of descendants...") % (i + 1))
-        todo = tree.add_children(todo) - done
-
-    # download spouses
-    if args.marriage:
-        print(_("Downloading spouses and marriage information..."))
+    try:
+        # initialize a FamilySearch session and a family tree object
+        if args.from_archive:
+            print("Reading archive...")
+            fs = ArchiveSession(args.from_archive, args.verbose, args.logfile)
+        else:
+            print("Login to FamilySearch...")
+            fs = Session(
+                args.username,
+                args.password,
+                args.verbose,
+                args.logfile,
+                args.timeout,
+                args.archive,
+            )
+        if not fs.logged:
+            sys.exit(2)
+        _ = fs._
+        tree = Tree(fs)
+
+        # check LDS account
+        if (
+            args.get_ordinances
+            and fs.get_url("/platform/tree/persons/%s/ordinances.json" % fs.fid) == "error"
+        ):
+            sys.exit(2)
+
+        # add list of starting individuals to the family tree
+        todo = args.individuals if args.individuals else [fs.fid]
+        print(_("Downloading starting individuals..."))
+        tree.add_indis(todo)
+
+        # download ancestors
+        todo = set(todo)
+        done = set()
+        for i in range(args.ascend):
+            if not todo:
+                break
+            done |= todo
+            print(_("Downloading %s. of generations of ancestors...") % (i + 1))
+            todo = tree.add_parents(todo) - done
+
+        # download descendants
         todo = set(tree.indi.keys())
-        tree.add_spouses(todo)
-
-    # download ordinances, notes and contributors
-    async def download_stuff(loop):
-        futures = set()
-        for fid, indi in tree.indi.items():
-            futures.add(loop.run_in_executor(None, indi.get_notes))
-            if args.get_ordinances:
-                futures.add(loop.run_in_executor(None, tree.add_ordinances, fid))
-            if args.get_contributors:
-                futures.add(loop.run_in_executor(None, indi.get_contributors))
-        for fam in tree.fam.values():
-            futures.add(loop.run_in_executor(None, fam.get_notes))
-            if args.get_contributors:
-                futures.add(loop.run_in_executor(None, fam.get_contributors))
-        for future in futures:
-            await future
-
-    loop = asyncio.get_event_loop()
-    print(
-        _("Downloading notes")
-        + (
-            (("," if args.get_contributors else _(" and")) + _(" ordinances"))
-            if args.get_ordinances
-            else ""
-        )
-        + (_(" and contributors") if args.get_contributors else "")
-        + "..."
-    )
-    loop.run_until_complete(download_stuff(loop))
+        done = set()
+        for i in range(args.descend):
+            if not todo:
+                break
+            done |= todo
+            print(_("Downloading %s. of generations of descendants...") % (i + 1))
+            todo = tree.add_children(todo) - done
+
+        # download spouses
+        if args.marriage:
+            print(_("Downloading spouses and marriage information..."))
+            todo = set(tree.indi.keys())
+            tree.add_spouses(todo)
+
+        # download ordinances, notes and contributors
+        async def download_stuff(loop):
+            futures = set()
+            for fid, indi in tree.indi.items():
+                futures.add(loop.run_in_executor(None, indi.get_notes))
+                if args.get_ordinances:
+                    futures.add(loop.run_in_executor(None, tree.add_ordinances, fid))
+                if args.get_contributors:
+                    futures.add(loop.run_in_executor(None, indi.get_contributors))
+            for fam in tree.fam.values():
+                futures.add(loop.run_in_executor(None, fam.get_notes))
+                if args.get_contributors:
+                    futures.add(loop.run_in_executor(None, fam.get_contributors))
+            for future in futures:
+                await future
 
-    # compute number for family relationships and print GEDCOM file
-    tree.reset_num()
-    tree.print(args.outfile)
+        loop = asyncio.get_event_loop()
+        print(
+            _("Downloading notes")
+            + (
+                (("," if args.get_contributors else _(" and")) + _(" ordinances"))
+                if args.get_ordinances
+                else ""
+            )
+            + (_(" and contributors") if args.get_contributors else "")
+            + "..."
+        )
+        loop.run_until_complete(download_stuff(loop))
+
+        # compute number for family relationships and print GEDCOM file
+        tree.reset_num()
+        tree.print(args.outfile)
+        if args.outfile is not sys.stdout:
+            args.outfile.close()
+    finally:
+        # keep the responses downloaded before an error or an interruption
+        if args.archive:
+            args.archive.close()
+    if args.snapshot:
+        tree.save_snapshot(args.snapshot)
+    if args.columns:
+        tree.save_columns(args.columns)
+    if args.sqlite:
+        tree.save_sqlite(args.sqlite)
     print(
         _(
             "Downloaded %s individuals, %s families, %s sources and %s notes "
@@ -24,12 +24,34 @@
 from __future__ import print_function
 
 # global import
+import io
 import os
+import re
 import sys
+import heapq
+import mmap
+import pickle
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import unittest
 import argparse
+from itertools import groupby
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
 
 # local import
 import getmyancestors as gt
+from getmyancestors import (
+    no_gc,
+    pack_source,
+    unpack_source,
+    pack_indi,
+    unpack_indi,
+    pack_fam,
+    unpack_fam,
+)
 
 sys.path.append(os.path.dirname(sys.argv[0]))
 
@@ -41,25 +63,128 @@ def reversed_dict(d):
 FACT_TYPES = reversed_dict(gt.FACT_TAGS)
 ORDINANCES = reversed_dict(gt.ORDINANCES_STATUS)
 
+LEVELS = {str(level).encode(): level for level in range(100)}
+TAGS = dict()
+RECORD = re.compile(rb"^0 @([IF][0-9]+)@ (?:INDI|FAM)\r?\n", re.M)
+POINTER = re.compile(rb" (@[A-Z]+[0-9]+@)\r?$", re.M)
+LINKS = {b"FAMS ", b"FAMC ", b"HUSB ", b"WIFE ", b"CHIL "}
+
+
+def map_file(file, directory=None):
+    """ return a read-only byte buffer with the content of a file object
+        the file is memory-mapped if possible, otherwise read into memory (stdin, pipes...)
+        gzip and zstd compressed files are decompressed into memory, or in chunks into
+        a memory-mapped temporary file if a directory is given
+        :param directory: the directory of the temporary file
+    """
+    try:
+        buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        buf = getattr(file, "buffer", file).read()
+        buf = buf.encode("utf-8") if isinstance(buf, str) else buf
+    reader = gt.decompressor(buf)
+    if reader is None:
+        return buf
+    with reader:
+        if directory is None:
+            data = reader.read()
+        else:
+            with tempfile.TemporaryFile(dir=directory) as tmp:
+                shutil.copyfileobj(reader, tmp, 1 << 20)
+                tmp.flush()
+                # an empty file cannot be memory-mapped
+                data = mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ) if tmp.tell() else b""
+    if isinstance(buf, mmap.mmap):
+        buf.close()
+    return data
+
+
+def tokenize(buf, pos=0, chunk=1 << 20):
+    """ iterate over the lines of a GEDCOM byte buffer
+        :param buf: a bytes-like object (bytes, mmap...)
+        :param pos: offset of the first line to read
+        :param chunk: approximate number of bytes split into lines at once
+        yield (level, pointer, tag, value) where value is the undecoded bytes of the line value
+    """
+    size = len(buf)
+    while pos < size:
+        end = buf.rfind(b"\n", pos, pos + chunk) + 1 if pos + chunk < size else size
+        if end <= pos:
+            end = buf.find(b"\n", pos + chunk) + 1 or size
+        for line in buf[pos:end].splitlines():
+            words = line.split(b" ", 2)
+            try:
+                level = LEVELS[words[0]]
+                tag = words[1]
+            except (KeyError, IndexError):
+                # blank or malformed line
+                continue
+            if tag[:1] == b"@":
+                pointer = tag.decode("utf-8")
+                words = words[2].split(b" ", 1) if len(words) > 2 else [b""]
+                tag = words[0]
+                value = words[1] if len(words) > 1 else b""
+            else:
+                pointer = None
+                value = words[2] if len(words) > 2 else b""
+            if tag not in TAGS:
+                TAGS[tag] = tag.decode("utf-8")
+            yield level, pointer, TAGS[tag], value
+        pos = end
+
+
+def fingerprint(record):
+    """ content fingerprint of a record
+        :param record: the lines of the record after its level 0 line, with resolved pointers
+        level 1 substructures are sorted, as the order of sets in a GEDCOM file is arbitrary,
+        and links to families and children, which are merged anyway, are left out
+    """
+    groups = (b"\n" + record.replace(b"\r\n", b"\n")).split(b"\n1 ")
+    groups = [group for group in groups if group[:5] not in LINKS]
+    groups.sort()
+    return hashlib.blake2b(b"\n1 ".join(groups), digest_size=16).digest()
+
 
 class Gedcom:
-    """ Parse a GEDCOM file into a Tree """
+    """ Parse a GEDCOM file into a Tree
+        :param file: a GEDCOM file object, or None for an empty Gedcom
+        :param directory: the directory where compressed files are decompressed [memory]
+    """
 
-    def __init__(self, file, tree):
+    def __init__(self, file, tree, directory=None):
         self.f = file
         self.num = None
         self.tree = tree
         self.level = 0
         self.pointer = None
         self.tag = None
-        self.data = None
         self.flag = False
         self.indi = dict()
         self.fam = dict()
         self.note = dict()
         self.sour = dict()
-        self.__parse()
-        self.__add_id()
+        self.indi_fingerprint = dict()
+        self.fam_fingerprint = dict()
+        self.__value = b""
+        self.__data = None
+        if file is None:
+            return
+        buf = map_file(file, directory)
+        self.__lines = tokenize(buf)
+        with no_gc():
+            self.__parse()
+            self.__add_id()
+            self.__add_fingerprints(buf)
+        self.__lines = None
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+    @property
+    def data(self):
+        """ value of the current line, decoded on first access """
+        if self.__data is None:
+            self.__data = self.__value.decode("utf-8")
+        return self.__data
 
     def __parse(self):
         """ Parse the GEDCOM file into self.tree """
@@ -102,19 +227,11 @@ class Gedcom:
         if self.flag:
             self.flag = False
             return True
-        words = self.f.readline().split()
-
-        if not words:
+        line = next(self.__lines, None)
+        if not line:
             return False
-        self.level = int(words[0])
-        if words[1][0] == "@":
-            self.pointer = words[1]
-            self.tag = words[2]
-            self.data = " ".join(words[3:])
-        else:
-            self.pointer = None
-            self.tag = words[1]
-            self.data = " ".join(words[2:])
+        self.level, self.pointer, self.tag, self.__value = line
+        self.__data = None
         return True
 
     def __get_indi(self):
@@ -183,7 +300,7 @@ class Gedcom:
         name.given = parts[0].strip()
         name.surname = parts[1].strip()
         if parts[2]:
-            name.suffix = parts[2]
+            name.suffix = parts[2].strip()
         if not self.indi[self.num].name:
             self.indi[self.num].name = name
             added = True
@@ -254,16 +371,17 @@ class Gedcom:
 
     def __get_text(self):
         """ Parse a multiline text """
-        text = self.data
+        text = [self.data]
         while self.__get_line():
             if self.tag == "CONT":
-                text += "\n" + self.data
+                text.append("\n")
+                text.append(self.data)
             elif self.tag == "CONC":
-                text += self.data
+                text.append(self.data)
             else:
                 break
         self.flag = True
-        return text
+        return "".join(text)
 
     def __get_source(self):
         """ Parse a source """
@@ -348,6 +466,754 @@ class Gedcom:
             for fams in self.indi[num].fams_num:
                 self.indi[num].fams_fid.add((self.fam[fams].husb_fid, self.fam[fams].wife_fid))
 
+    def __add_fingerprints(self, buf):
+        """ Fingerprint the individuals and families of the GEDCOM buffer
+            pointers are replaced by what they point to (note text digest, source REFN,
+            family fids) as numbers are only meaningful within a file; pointers to
+            individuals only appear in links left out of the fingerprints
+        """
+        targets = dict()
+        for num, o in self.note.items():
+            digest = hashlib.blake2b(o.text.encode("utf-8"), digest_size=16).hexdigest()
+            targets[b"@N%d@" % num] = b" " + digest.encode()
+        for num, o in self.sour.items():
+            targets[b"@S%d@" % num] = b" " + repr(o.fid or o.title).encode("utf-8")
+        for num, o in self.fam.items():
+            targets[b"@F%d@" % num] = b" " + repr((o.husb_fid, o.wife_fid)).encode("utf-8")
+
+        def resolve(match):
+            return targets.get(match.group(1), match.group(0))
+
+        size = len(buf)
+        for match in RECORD.finditer(buf):
+            end = buf.find(b"\n0 ", match.end() - 1)
+            record = POINTER.sub(resolve, buf[match.end() : end + 1 if end >= 0 else size])
+            tag, num = match.group(1)[:1], int(match.group(1)[1:])
+            if tag == b"I" and num in self.indi:
+                self.indi_fingerprint[num] = fingerprint(record)
+            elif tag == b"F" and num in self.fam:
+                self.fam_fingerprint[num] = fingerprint(record)
+
+    def __getstate__(self):
+        """ Compact picklable state: the parsed records as tuples of plain values """
+        notes = {id(n): i for i, n in enumerate(self.tree.notes)}
+        sources = list()
+        index = dict()
+        for source in list(self.sour.values()) + list(self.tree.sources.values()):
+            if id(source) not in index:
+                index[id(source)] = len(sources)
+                sources.append(source)
+
+        def note(n):
+            return notes[id(n)]
+
+        def source(o):
+            return index[id(o)]
+
+        def fam(o):
+            return o.num
+
+        return {
+            "display_name": self.tree.display_name,
+            "lang": self.tree.lang,
+            "notes": tuple((n.num, n.text) for n in self.tree.notes),
+            "sources": tuple((o.num,) + pack_source(o, note) for o in sources),
+            "tree_sources": tuple((fid, index[id(o)]) for fid, o in self.tree.sources.items()),
+            "sour": tuple((num, index[id(o)]) for num, o in self.sour.items()),
+            "indi": tuple(pack_indi(o, note, source, fam) for o in self.indi.values()),
+            "fam": tuple(pack_fam(o, note, source, fam) for o in self.fam.values()),
+            "indi_fingerprint": tuple(self.indi_fingerprint.items()),
+            "fam_fingerprint": tuple(self.fam_fingerprint.items()),
+        }
+
+    def __setstate__(self, state):
+        """ Rebuild the parsed records from the state made by __getstate__ """
+        with no_gc():
+            self.__load(state)
+
+    def __load(self, state):
+        """ Rebuild the parsed records """
+        self.f = self.num = self.pointer = self.tag = None
+        self.level = 0
+        self.flag = False
+        self.tree = gt.Tree()
+        self.tree.display_name = state["display_name"]
+        self.tree.lang = state["lang"]
+        notes = list()
+        for num, text in state["notes"]:
+            n = gt.Note(tree=self.tree, num=num)
+            n.text = text
+            notes.append(n)
+        sources = [
+            unpack_source(data[1:], notes.__getitem__, data[0]) for data in state["sources"]
+        ]
+        self.tree.sources = {fid: sources[i] for fid, i in state["tree_sources"]}
+        self.sour = {num: sources[i] for num, i in state["sour"]}
+        self.note = {n.num: n for n in notes}
+        self.indi = dict()
+        self.fam = dict()
+        self.indi_fingerprint = dict(state["indi_fingerprint"])
+        self.fam_fingerprint = dict(state["fam_fingerprint"])
+        sealings = list()
+
+        def fam(num):
+            o = gt.Fam(num=num)
+            sealings.append(o)
+            return o
+
+        for data in state["indi"]:
+            o = unpack_indi(data, self.tree, notes.__getitem__, sources.__getitem__, fam)
+            self.indi[o.num] = o
+        for data in state["fam"]:
+            o = unpack_fam(data, self.tree, notes.__getitem__, sources.__getitem__, fam)
+            self.fam[o.num] = o
+        for o in self.indi.values():
+            for name in ("baptism", "confirmation", "initiatory", "endowment", "sealing_child"):
+                ordinance = getattr(o, name)
+                if ordinance and ordinance.famc:
+                    ordinance.famc = self.fam.get(ordinance.famc.num)
+        for o in self.fam.values():
+            if o.sealing_spouse and o.sealing_spouse.famc:
+                o.sealing_spouse.famc = self.fam.get(o.sealing_spouse.famc.num)
+
+
+def is_snapshot(file):
+    """ tell whether a file object or a file name is a snapshot saved by Tree.save_snapshot """
+    name = file if isinstance(file, str) else getattr(file, "name", None)
+    if not isinstance(name, str) or not os.path.isfile(name):
+        return False
+    with open(name, "rb") as f:
+        return f.read(len(gt.SNAPSHOT_MAGIC)) == gt.SNAPSHOT_MAGIC
+
+
+def load_snapshot(file):
+    """ Load a Tree snapshot as a Gedcom, its records numbered as in the saved Tree
+        :param file: a file object or a file name
+    """
+    tree = gt.Tree()
+    with open(file if isinstance(file, str) else file.name, "rb") as f:
+        tree.load_snapshot(f)
+    ged = Gedcom(None, tree)
+    ged.indi = {o.num: o for o in tree.indi.values()}
+    ged.fam = {o.num: o for o in tree.fam.values()}
+    return ged
+
+
+def parse_file(file, directory=None):
+    """ Parse a GEDCOM file, or load a Tree snapshot, into its own Tree
+        :param file: a file object, or a file name (in a worker process)
+        :param directory: the directory where compressed files are decompressed [memory]
+    """
+    if is_snapshot(file):
+        return load_snapshot(file)
+    if isinstance(file, str):
+        with open(file, "r", encoding="utf-8") as f:
+            return parse_file(f, directory)
+    ged = Gedcom(file, gt.Tree(), directory)
+    ged.f = None
+    return ged
+
+
+def map_files(function, files, jobs=None, *args):
+    """ Apply a function to GEDCOM files in worker processes
+        the function receives a file name in a worker, or the file object when
+        the files cannot be reopened by name (stdin) or there is a single job
+        :param files: an iterable of file objects or file names
+        :param jobs: the number of worker processes [number of processors]
+        yield the results in input order
+    """
+    files = list(files)
+    names = [file if isinstance(file, str) else getattr(file, "name", None) for file in files]
+    names = [name for name in names if isinstance(name, str) and os.path.isfile(name)]
+    jobs = jobs or os.cpu_count() or 1
+    if len(names) < 2 or len(names) < len(files) or jobs < 2:
+        for file in files:
+            yield function(file, *args)
+        return
+    with ProcessPoolExecutor(min(jobs, len(names))) as executor:
+        yield from executor.map(function, names, *([arg] * len(names) for arg in args))
+
+
+def attach(ged, tree):
+    """ Attach a Gedcom parsed into its own Tree to a shared Tree
+        sources already known by tree are substituted by their REFN identifier
+    """
+    if not tree.display_name or not tree.lang:
+        tree.display_name = ged.tree.display_name
+        tree.lang = ged.tree.lang
+    tree.notes.extend(ged.tree.notes)
+    for fid, source in ged.tree.sources.items():
+        if fid not in tree.sources:
+            tree.sources[fid] = source
+
+    def link(sources):
+        return set((tree.sources.get(source.fid, source), page) for source, page in sources)
+
+    for indi in ged.indi.values():
+        indi.sources = link(indi.sources)
+    for fam in ged.fam.values():
+        fam.sources = link(fam.sources)
+    ged.tree = tree
+    return ged
+
+
+def parse_files(files, tree, jobs=None):
+    """ Parse GEDCOM files in worker processes
+        :param files: an iterable of file objects or file names
+        :param tree: the Tree receiving notes and sources
+        :param jobs: the number of worker processes [number of processors]
+        yield a Gedcom object for each file, in input order
+    """
+    for ged in map_files(parse_file, files, jobs):
+        yield attach(ged, tree)
+
+
+def fam_key(husb, wife):
+    """ sort key of a family """
+    return (husb or "", wife or "")
+
+
+def write_run(records, directory):
+    """ Write (key, fingerprint, links, record) tuples sorted by key into a temporary run file
+        the record is pickled on its own so that it is only loaded when needed
+    """
+    fd, filename = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb") as run:
+        for key, digest, links, data in sorted(records, key=itemgetter(0)):
+            payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+            pickle.dump((key, digest, links, payload), run)
+    return filename
+
+
+def read_run(filename, index=0):
+    """ Iterate over the records of a run file
+        yield (key, index, fingerprint, links, record) where index identifies the input file
+    """
+    with open(filename, "rb") as run:
+        while True:
+            try:
+                key, digest, links, data = pickle.load(run)
+            except EOFError:
+                return
+            yield key, index, digest, links, data
+
+
+def write_runs(file, directory):
+    """ Sort the records of a GEDCOM file into temporary runs
+        individuals are sorted by _FSFTID and families by husband and wife,
+        notes and sources are stored with the records referencing them
+        :param file: a file object, or a file name (in a worker process)
+        :param directory: the directory of the run files
+        return the submitter, the language and the names of the run files
+    """
+    ged = parse_file(file, directory)
+
+    def note(n):
+        return n.text
+
+    def source(o):
+        return pack_source(o, note)
+
+    def fam(o):
+        return (o.husb_fid, o.wife_fid)
+
+    with no_gc():
+        indi = write_run(
+            (
+                (
+                    o.fid or "",
+                    ged.indi_fingerprint.get(num),
+                    (tuple(o.famc_fid), tuple(o.fams_fid)),
+                    pack_indi(o, note, source, fam),
+                )
+                for num, o in ged.indi.items()
+            ),
+            directory,
+        )
+        fam = write_run(
+            (
+                (
+                    fam_key(o.husb_fid, o.wife_fid),
+                    ged.fam_fingerprint.get(num),
+                    tuple(o.chil_fid),
+                    pack_fam(o, note, source, fam),
+                )
+                for num, o in ged.fam.items()
+            ),
+            directory,
+        )
+    return ged.tree.display_name, ged.tree.lang, indi, fam
+
+
+def load_versions(group, versions):
+    """ Load the distinct versions of a record from a group of run records, in input order
+        a record with the same fingerprint as the previous one is not unpickled
+        :param versions: list receiving the input index of each distinct version
+        return the loaded records and the links of all the run records
+    """
+    records = list()
+    links = list()
+    last = None
+    for _, index, digest, link, payload in group:
+        links.append(link)
+        if digest is None or digest != last:
+            records.append(pickle.loads(payload))
+            if digest is not None:
+                versions.append(index)
+            last = digest
+    return records, links
+
+
+def merge_indi(records, links):
+    """ Merge the packed records of an individual, in input order
+        the last record wins, family links are added and a sealing to parents
+        linked to a family is kept
+        :param links: the (famc, fams) links of every record
+    """
+    data = list(records[-1])
+    famc = set()
+    fams = set()
+    for x, y in links:
+        famc.update(x)
+        fams.update(y)
+    sealing = None
+    for record in records:
+        if not (sealing and sealing[3]):
+            sealing = record[12][4]
+    data[12] = data[12][:4] + (sealing,)
+    data[13] = tuple(famc)
+    data[14] = tuple(fams)
+    return data
+
+
+def merge_fam(records, links):
+    """ Merge the packed records of a family, in input order
+        the last record wins, children are added and fid, facts, notes and sources
+        are kept unless empty in the last record
+        :param links: the children of every record
+    """
+    data = list(records[-1])
+    chil = set()
+    for x in links:
+        chil.update(x)
+    for record in records:
+        for i in (5, 6, 10, 11):
+            if record[i]:
+                data[i] = record[i]
+    data[8] = tuple(chil)
+    return data
+
+
+def stream_merge(files, out, jobs=None, directory=None, progress=None, conflicts=None):
+    """ Merge GEDCOM files with a bounded memory
+        the records of each input are sorted into temporary runs, the runs are merged
+        (k-way) and each merged record is written out as soon as it is complete;
+        only the identifiers of individuals, families, notes and sources are kept in memory
+        :param files: an iterable of file objects or file names, in merge order
+        :param out: the output file object
+        :param jobs: the number of worker processes [number of processors]
+        :param directory: the directory of temporary files [system default]
+        :param progress: function called with (number of files sorted, number of files)
+        :param conflicts: list receiving the (type, key, input indexes) of the records
+        differing between input files
+    """
+    files = list(files)
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        tree = gt.Tree()
+        indi_runs = list()
+        fam_runs = list()
+        for display_name, lang, indi, fam in map_files(write_runs, files, jobs, tmp):
+            if not tree.display_name or not tree.lang:
+                tree.display_name = display_name
+                tree.lang = lang
+            indi_runs.append(indi)
+            fam_runs.append(fam)
+            if progress:
+                progress(len(indi_runs), len(files))
+
+        # families are numbered first: individuals refer to them
+        fam_num = dict()
+        runs = heapq.merge(*map(read_run, fam_runs), key=itemgetter(0))
+        for key, _ in groupby(runs, itemgetter(0)):
+            fam_num[key] = len(fam_num) + 1
+
+        indi_num = dict()
+        notes = dict()
+        sources = dict()
+        note_file = open(os.path.join(tmp, "notes"), "w+", encoding="utf-8")
+        source_file = open(os.path.join(tmp, "sources"), "w+", encoding="utf-8")
+
+        def note(text):
+            key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            if key not in notes:
+                notes[key] = len(notes) + 1
+                gt.Note(text, num=notes[key]).print(note_file)
+            return gt.Note(num=notes[key])
+
+        def source(data):
+            key = data[0] or data
+            if key not in sources:
+                sources[key] = len(sources) + 1
+                unpack_source(data, note, sources[key]).print(source_file)
+            return gt.Source(num=sources[key])
+
+        def fam(data):
+            num = fam_num.get(fam_key(*data))
+            return gt.Fam(num=num) if num else None
+
+        def families(links):
+            return set(fam_num[key] for key in (fam_key(*x) for x in links) if key in fam_num)
+
+        tree.print_header(out)
+        runs = heapq.merge(*map(read_run, indi_runs, range(len(files))), key=itemgetter(0))
+        for key, group in groupby(runs, itemgetter(0)):
+            versions = list()
+            data = merge_indi(*load_versions(group, versions))
+            if conflicts is not None and len(versions) > 1:
+                conflicts.append(("INDI", key, versions))
+            indi_num[data[1]] = data[0] = len(indi_num) + 1
+            o = unpack_indi(data, tree, note, source, fam)
+            o.famc_num = families(o.famc_fid)
+            o.fams_num = families(o.fams_fid)
+            o.print(out)
+
+        runs = heapq.merge(*map(read_run, fam_runs, range(len(files))), key=itemgetter(0))
+        for key, group in groupby(runs, itemgetter(0)):
+            versions = list()
+            data = merge_fam(*load_versions(group, versions))
+            if conflicts is not None and len(versions) > 1:
+                conflicts.append(("FAM", "%s+%s" % key, versions))
+            data[0] = fam_num[key]
+            o = unpack_fam(data, tree, note, source, fam)
+            o.husb_num = indi_num.get(o.husb_fid) if o.husb_fid else None
+            o.wife_num = indi_num.get(o.wife_fid) if o.wife_fid else None
+            o.chil_num = set(indi_num[chil] for chil in o.chil_fid if chil in indi_num)
+            o.print(out)
+
+        for spool in (source_file, note_file):
+            spool.seek(0)
+            shutil.copyfileobj(spool, out)
+            spool.close()
+        out.write("0 TRLR\n")
+
+
+def is_unchanged(versions, key, digest, index):
+    """ Tell whether a record is identical to the last merged version of its key
+        otherwise the new version is recorded in versions with its input index
+        records without fingerprint (loaded from a snapshot) are always merged
+    """
+    if digest is None:
+        return False
+    known = versions.setdefault(key, list())
+    if known and known[-1][0] == digest:
+        return True
+    known.append((digest, index))
+    return False
+
+
+def merge_gedcom(ged, tree, versions=None, index=0):
+    """ Merge the records of a parsed Gedcom into tree
+        individuals are merged by fid and families by husband and wife fids:
+        the last file wins, family links and children are added
+        :param versions: dict of the (fingerprint, input index) of the distinct versions of
+        each record merged so far; a record identical to the last version is not copied
+        :param index: the input index of ged
+    """
+    if versions is None:
+        versions = dict()
+    for num in ged.indi:
+        fid = ged.indi[num].fid
+        if fid not in tree.indi:
+            tree.indi[fid] = gt.Indi(tree=tree, num=len(tree.indi) + 1)
+            tree.indi[fid].fid = ged.indi[num].fid
+        tree.indi[fid].fams_fid |= ged.indi[num].fams_fid
+        tree.indi[fid].famc_fid |= ged.indi[num].famc_fid
+        if is_unchanged(versions, ("INDI", fid), ged.indi_fingerprint.get(num), index):
+            continue
+        tree.indi[fid].name = ged.indi[num].name
+        tree.indi[fid].birthnames = ged.indi[num].birthnames
+        tree.indi[fid].nicknames = ged.indi[num].nicknames
+        tree.indi[fid].aka = ged.indi[num].aka
+        tree.indi[fid].married = ged.indi[num].married
+        tree.indi[fid].gender = ged.indi[num].gender
+        tree.indi[fid].facts = ged.indi[num].facts
+        tree.indi[fid].notes = ged.indi[num].notes
+        tree.indi[fid].sources = ged.indi[num].sources
+        tree.indi[fid].memories = ged.indi[num].memories
+        tree.indi[fid].baptism = ged.indi[num].baptism
+        tree.indi[fid].confirmation = ged.indi[num].confirmation
+        tree.indi[fid].initiatory = ged.indi[num].initiatory
+        tree.indi[fid].endowment = ged.indi[num].endowment
+        if not (tree.indi[fid].sealing_child and tree.indi[fid].sealing_child.famc):
+            tree.indi[fid].sealing_child = ged.indi[num].sealing_child
+
+    for num in ged.fam:
+        husb, wife = (ged.fam[num].husb_fid, ged.fam[num].wife_fid)
+        if (husb, wife) not in tree.fam:
+            tree.fam[(husb, wife)] = gt.Fam(husb, wife, tree, len(tree.fam) + 1)
+        tree.fam[(husb, wife)].chil_fid |= ged.fam[num].chil_fid
+        digest = ged.fam_fingerprint.get(num)
+        if is_unchanged(versions, ("FAM", fam_key(husb, wife)), digest, index):
+            continue
+        if ged.fam[num].fid:
+            tree.fam[(husb, wife)].fid = ged.fam[num].fid
+        if ged.fam[num].facts:
+            tree.fam[(husb, wife)].facts = ged.fam[num].facts
+        if ged.fam[num].notes:
+            tree.fam[(husb, wife)].notes = ged.fam[num].notes
+        if ged.fam[num].sources:
+            tree.fam[(husb, wife)].sources = ged.fam[num].sources
+        tree.fam[(husb, wife)].sealing_spouse = ged.fam[num].sealing_spouse
+
+
+def merge_notes(tree):
+    """ Number the notes of tree, notes with the same text share the same number """
+    nums = dict()
+    for n in tree.notes:
+        n.num = nums.setdefault(n.text, len(nums) + 1)
+
+
+def print_conflicts(conflicts, files, file):
+    """ Write a report of the records differing between input files
+        one line per record: its type, its key and the input files of its successive versions
+    """
+    names = [
+        f if isinstance(f, str) else getattr(f, "name", "<%s>" % i) for i, f in enumerate(files)
+    ]
+    for tag, key, versions in conflicts:
+        file.write("%s %s: %s\n" % (tag, key, ", ".join(str(names[i]) for i in versions)))
+
+
+def merge_files(
+    files, out, jobs=None, stream=False, progress=None, conflicts=None, snapshot=None
+):
+    """ Merge GEDCOM files, or Tree snapshots, produced by getmyancestors
+        records identical in several files (same content fingerprint) are only merged once
+        :param files: an iterable of file objects or file names, in merge order
+        :param out: the output file object, or None
+        :param jobs: the number of worker processes [number of processors]
+        :param stream: merge through temporary files with a bounded memory
+        :param progress: function called with (number of files read, number of files)
+        :param conflicts: file object receiving a report of the records differing between files
+        :param snapshot: binary file object receiving a snapshot of the merged Tree
+        return the merged Tree, or None when streaming
+    """
+    if stream and snapshot:
+        raise ValueError("a streaming merge cannot save a snapshot")
+    files = list(files)
+    report = list()
+    if stream:
+        stream_merge(files, out, jobs, progress=progress, conflicts=report)
+        tree = None
+    else:
+        tree = gt.Tree()
+        versions = dict()
+        with no_gc():
+            for i, ged in enumerate(parse_files(files, tree, jobs)):
+                merge_gedcom(ged, tree, versions, i)
+                if progress:
+                    progress(i + 1, len(files))
+            merge_notes(tree)
+            tree.reset_num()
+            for (tag, key), known in versions.items():
+                if len(known) > 1:
+                    key = "%s+%s" % key if tag == "FAM" else key
+                    report.append((tag, key, [i for _, i in known]))
+            versions = None
+        if out:
+            tree.print(out)
+        if snapshot:
+            tree.save_snapshot(snapshot)
+    if conflicts:
+        print_conflicts(report, files, conflicts)
+    return tree
+
+
+class TestMergeFiles(unittest.TestCase):
+    @staticmethod
+    def gedcom(names, note):
+        """ a GEDCOM file with a couple and a child, the child having a note """
+        tree = gt.Tree()
+        tree.display_name, tree.lang = "Tester", "English"
+        for fid, given in zip(("AAAA-001", "AAAA-002", "AAAA-003"), names):
+            tree.indi[fid] = gt.Indi(fid, tree)
+            tree.indi[fid].name = gt.Name()
+            tree.indi[fid].name.given = given
+        tree.add_trio("AAAA-001", "AAAA-002", "AAAA-003")
+        tree.indi["AAAA-003"].notes.add(gt.Note(note, tree))
+        tree.reset_num()
+        file = io.StringIO()
+        tree.print(file)
+        file.seek(0)
+        return file
+
+    def merge(self, stream):
+        out = io.StringIO()
+        files = [
+            self.gedcom(("Adam", "Eve", "Cain"), "same note"),
+            self.gedcom(("Adam", "Eva", "Kain"), "same note"),
+        ]
+        merge_files(files, out, stream=stream)
+        return out.getvalue()
+
+    def test_conflicts(self):
+        for stream in (False, True):
+            report = io.StringIO()
+            files = [
+                self.gedcom(("Adam", "Eve", "Cain"), "same note"),
+                self.gedcom(("Adam", "Eve", "Cain"), "same note"),
+                self.gedcom(("Adam", "Eva", "Cain"), "other note"),
+            ]
+            merge_files(files, io.StringIO(), stream=stream, conflicts=report)
+            self.assertEqual(
+                sorted(report.getvalue().splitlines()),
+                ["INDI AAAA-002: <0>, <2>", "INDI AAAA-003: <0>, <2>"],
+            )
+
+    def test_last_file_wins(self):
+        for stream in (False, True):
+            merged = self.merge(stream)
+            self.assertEqual(merged.count(" INDI\n"), 3)
+            self.assertEqual(merged.count(" FAM\n"), 1)
+            self.assertIn("1 NAME Eva //", merged)
+            self.assertIn("1 NAME Kain //", merged)
+            self.assertNotIn("1 NAME Eve //", merged)
+
+    def test_notes_merged_by_text(self):
+        for stream in (False, True):
+            merged = self.merge(stream)
+            self.assertEqual(merged.count(" NOTE same note\n"), 1)
+
+    def test_columns(self):
+        tree = merge_files([self.gedcom(("Adam", "Eve", "Cain"), "a note")], None)
+        with tempfile.TemporaryDirectory() as tmp:
+            tree.save_columns(tmp)
+            tables = gt.read_columns(tmp)
+        indi = dict(zip(tables["individuals"]["fid"], tables["individuals"]["num"]))
+        self.assertEqual(sorted(indi), ["AAAA-001", "AAAA-002", "AAAA-003"])
+        self.assertEqual(len(tables["families"]["num"]), 1)
+        self.assertEqual(tables["families"]["husb"], [indi["AAAA-001"]])
+        self.assertEqual(tables["families"]["wife"], [indi["AAAA-002"]])
+        self.assertEqual(tables["children"]["indi"], [indi["AAAA-003"]])
+        given = dict(zip(tables["names"]["indi"], tables["names"]["given"]))
+        self.assertEqual(given[indi["AAAA-003"]], "Cain")
+        self.assertEqual(tables["names"]["prefix"], [None] * 3)
+        self.assertEqual(tables["notes"]["text"], ["a note"])
+
+    def test_sqlite(self):
+        tree = merge_files([self.gedcom(("Adam", "Eve", "Cain"), "a note")], None)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "tree.db")
+            tree.save_sqlite(filename)
+            tree.save_sqlite(filename)
+            conn = sqlite3.connect(filename)
+            rows = conn.execute(
+                "SELECT c.fid, f.fid, m.fid FROM families "
+                "JOIN individuals f ON f.num = families.husb "
+                "JOIN individuals m ON m.num = families.wife "
+                "JOIN children ON children.fam = families.num "
+                "JOIN individuals c ON c.num = children.indi"
+            ).fetchall()
+            names = conn.execute("SELECT count(*) FROM names WHERE prefix IS NULL").fetchone()
+            conn.close()
+            self.assertEqual(os.listdir(tmp), ["tree.db"])
+        self.assertEqual(rows, [("AAAA-003", "AAAA-001", "AAAA-002")])
+        self.assertEqual(names, (3,))
+
+    def test_jobs(self):
+        """ files parsed in worker processes merge as when parsed in this process """
+        with tempfile.TemporaryDirectory() as tmp:
+            names = list()
+            for i, given in enumerate((("Adam", "Eve", "Cain"), ("Adam", "Eva", "Kain"))):
+                tree = gt.Tree()
+                tree.display_name, tree.lang = "Tester", "English"
+                for fid, name in zip(("AAAA-001", "AAAA-002", "AAAA-003"), given):
+                    tree.indi[fid] = gt.Indi(fid, tree)
+                    tree.indi[fid].name = gt.Name()
+                    tree.indi[fid].name.given = name
+                tree.add_trio("AAAA-001", "AAAA-002", "AAAA-003")
+                tree.indi["AAAA-003"].notes.add(gt.Note("note %s" % i, tree))
+                # a source in both files, to be substituted by attach
+                source = gt.Source({"id": "SSSS-001", "titles": [{"value": "Register"}]}, tree)
+                tree.sources[source.fid] = source
+                tree.indi["AAAA-003"].sources.add((source, "page %s" % i))
+                tree.reset_num()
+                names.append(os.path.join(tmp, "tree%s.ged" % i))
+                with open(names[-1], "w", encoding="utf-8") as file:
+                    tree.print(file)
+            merged = list()
+            for jobs in (1, 2):
+                out = io.StringIO()
+                merge_files(names, out, jobs=jobs)
+                # only the date of the header may differ
+                merged.append(re.sub(r"1 DATE .*\n2 TIME .*\n", "", out.getvalue(), 1))
+        self.assertEqual(merged[1], merged[0])
+        self.assertEqual(merged[0].count(" SOUR \n"), 1)
+        self.assertIn("2 PAGE page 1\n", merged[0])
+
+    def test_compressed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "tree.ged.gz")
+            with gt.open_output(filename) as out:
+                merge_files([self.gedcom(("Adam", "Eve", "Cain"), "same note")], out)
+            with open(filename, "rb") as file:
+                self.assertEqual(file.read(2), b"\x1f\x8b")
+            out = io.StringIO()
+            merge_files([filename, self.gedcom(("Adam", "Eva", "Kain"), "same note")], out)
+            streamed = io.StringIO()
+            files = [filename, self.gedcom(("Adam", "Eva", "Kain"), "same note")]
+            merge_files(files, streamed, stream=True)
+            with open(filename, "rb") as file, tempfile.TemporaryDirectory() as directory:
+                content = gt.decompress(file.read())
+                file.seek(0)
+                buf = map_file(file, directory)
+                self.assertIsInstance(buf, mmap.mmap)
+                self.assertEqual(buf[:], content)
+                buf.close()
+        merged = out.getvalue()
+        self.assertEqual(merged.count(" INDI\n"), 3)
+        self.assertIn("1 NAME Kain //", merged)
+        self.assertEqual(merged.count(" NOTE same note\n"), 1)
+        self.assertEqual(streamed.getvalue().count(" INDI\n"), 3)
+        self.assertIn("1 NAME Kain //", streamed.getvalue())
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "tree.gms")
+            with open(filename, "wb") as file:
+                files = [self.gedcom(("Adam", "Eve", "Cain"), "same note")]
+                merge_files(files, None, snapshot=file)
+            tree = gt.Tree()
+            with open(filename, "rb") as file:
+                tree.load_snapshot(file)
+            self.assertEqual(len(tree.indi), 3)
+            self.assertEqual(len(tree.fam), 1)
+            self.assertEqual(tree.indi["AAAA-003"].name.given, "Cain")
+            out = io.StringIO()
+            merge_files([filename, self.gedcom(("Adam", "Eva", "Kain"), "same note")], out)
+            merged = out.getvalue()
+            self.assertEqual(merged.count(" INDI\n"), 3)
+            self.assertIn("1 NAME Kain //", merged)
+            self.assertEqual(merged.count(" NOTE same note\n"), 1)
+
+    def test_snapshot_data_only(self):
+        """ a snapshot is data only: code in an input file is never run """
+
+        class Payload:
+            def __reduce__(self):
+                return (open, (marker, "w"))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "tree.gms")
+            marker = os.path.join(tmp, "marker")
+            for version in (1, gt.SNAPSHOT_VERSION):
+                with open(filename, "wb") as file:
+                    file.write(gt.SNAPSHOT.pack(gt.SNAPSHOT_MAGIC, version))
+                    file.write(pickle.dumps(Payload()))
+                with self.assertRaises(ValueError):
+                    merge_files([filename], io.StringIO())
+            self.assertFalse(os.path.exists(marker))
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -361,16 +1227,60 @@ if __name__ == "__main__":
             metavar="<FILE>",
             nargs="+",
             type=argparse.FileType("r", encoding="UTF-8"),
-            default=sys.stdin,
-            help="input GEDCOM files [stdin]",
+            default=[sys.stdin],
+            help="input GEDCOM files, possibly compressed, or tree snapshots [stdin]",
         )
         parser.add_argument(
             "-o",
             metavar="<FILE>",
             nargs="?",
-            type=argparse.FileType("w", encoding="UTF-8"),
+            type=gt.output_file,
             default=sys.stdout,
-            help="output GEDCOM files [stdout]",
+            help="output GEDCOM file, compressed if it ends with .gz or .zst [stdout]",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            metavar="<INT>",
+            type=int,
+            default=None,
+            help="Number of processes parsing input files [number of processors]",
+        )
+        parser.add_argument(
+            "-s",
+            "--stream",
+            action="store_true",
+            default=False,
+            help="Merge through sorted temporary files with a bounded memory [False]",
+        )
+        parser.add_argument(
+            "-c",
+            "--conflicts",
+            metavar="<FILE>",
+            type=argparse.FileType("w", encoding="UTF-8"),
+            default=None,
+            help="Report the records differing between input files",
+        )
+        parser.add_argument(
+            "--snapshot",
+            metavar="<FILE>",
+            type=argparse.FileType("wb"),
+            default=None,
+            help="Save a binary snapshot of the merged tree (not with --stream)",
+        )
+        parser.add_argument(
+            "--columns",
+            metavar="<DIR>",
+            type=str,
+            default=None,
+            help="Export the merged tree as columnar .npy tables (not with --stream)",
+        )
+        parser.add_argument(
+            "--sqlite",
+            metavar="<FILE>",
+            type=str,
+            default=None,
+            help="Export the merged tree into a new SQLite database (not with --stream)",
         )
     except TypeError:
         sys.stderr.write("Python >= 3.4 is required to run this script\n")
@@ -386,70 +1296,16 @@ if __name__ == "__main__":
         parser.print_help()
         exit(2)
 
-    tree = gt.Tree()
-
-    indi_counter = 0
-    fam_counter = 0
-
-    # read the GEDCOM data
-    for file in args.i:
-        ged = Gedcom(file, tree)
-
-        # add informations about individuals
-        for num in ged.indi:
-            fid = ged.indi[num].fid
-            if fid not in tree.indi:
-                indi_counter += 1
-                tree.indi[fid] = gt.Indi(tree=tree, num=indi_counter)
-                tree.indi[fid].tree = tree
-                tree.indi[fid].fid = ged.indi[num].fid
-            tree.indi[fid].fams_fid |= ged.indi[num].fams_fid
-            tree.indi[fid].famc_fid |= ged.indi[num].famc_fid
-            tree.indi[fid].name = ged.indi[num].name
-            tree.indi[fid].birthnames = ged.indi[num].birthnames
-            tree.indi[fid].nicknames = ged.indi[num].nicknames
-            tree.indi[fid].aka = ged.indi[num].aka
-            tree.indi[fid].married = ged.indi[num].married
-            tree.indi[fid].gender = ged.indi[num].gender
-            tree.indi[fid].facts = ged.indi[num].facts
-            tree.indi[fid].notes = ged.indi[num].notes
-            tree.indi[fid].sources = ged.indi[num].sources
-            tree.indi[fid].memories = ged.indi[num].memories
-            tree.indi[fid].baptism = ged.indi[num].baptism
-            tree.indi[fid].confirmation = ged.indi[num].confirmation
-            tree.indi[fid].endowment = ged.indi[num].endowment
-            if not (tree.indi[fid].sealing_child and tree.indi[fid].sealing_child.famc):
-                tree.indi[fid].sealing_child = ged.indi[num].sealing_child
-
-        # add informations about families
-        for num in ged.fam:
-            husb, wife = (ged.fam[num].husb_fid, ged.fam[num].wife_fid)
-            if (husb, wife) not in tree.fam:
-                fam_counter += 1
-                tree.fam[(husb, wife)] = gt.Fam(husb, wife, tree, fam_counter)
-                tree.fam[(husb, wife)].tree = tree
-            tree.fam[(husb, wife)].chil_fid |= ged.fam[num].chil_fid
-            if ged.fam[num].fid:
-                tree.fam[(husb, wife)].fid = ged.fam[num].fid
-            if ged.fam[num].facts:
-                tree.fam[(husb, wife)].facts = ged.fam[num].facts
-            if ged.fam[num].notes:
-                tree.fam[(husb, wife)].notes = ged.fam[num].notes
-            if ged.fam[num].sources:
-                tree.fam[(husb, wife)].sources = ged.fam[num].sources
-            tree.fam[(husb, wife)].sealing_spouse = ged.fam[num].sealing_spouse
-
-    # merge notes by text
-    tree.notes = sorted(tree.notes, key=lambda x: x.text)
-    for i, n in enumerate(tree.notes):
-        if i == 0:
-            n.num = 1
-            continue
-        if n.text == tree.notes[i - 1].text:
-            n.num = tree.notes[i - 1].num
-        else:
-            n.num = tree.notes[i - 1].num + 1
+    if args.stream and (args.snapshot or args.columns or args.sqlite):
+        sys.stderr.write("--snapshot, --columns and --sqlite cannot be used with --stream\n")
+        exit(2)
 
-    # compute number for family relationships and print GEDCOM file
-    tree.reset_num()
-    tree.print(args.o)
+    tree = merge_files(
+        args.i, args.o, args.jobs, args.stream, conflicts=args.conflicts, snapshot=args.snapshot
+    )
+    if args.o and args.o is not sys.stdout:
+        args.o.close()
+    if args.columns:
+        tree.save_columns(args.columns)
+    if args.sqlite:
+        tree.save_sqlite(args.sqlite)
@@ -136,6 +136,7 @@ translations = {
     "Quit": {"fr": "Quitter"},
     "Save as": {"fr": "Enregistrer sous"},
     "All files": {"fr": "Tous les fichiers"},
+    "Snapshot": {"fr": "Instantané"},
     "Login to FamilySearch...": {"fr": "Connection à FamilySearch..."},
     "The username or password was incorrect": {
         "fr": "Le nom d'utilisateur ou le mot de passe est incorrect"
@@ -156,6 +157,8 @@ translations = {
     "Open": {"fr": "Ouvrir"},
     "File not found: ": {"fr": "Fichier non trouvé: "},
     "Files successfully merged": {"fr": "Fichiers fusionnés avec succès"},
+    "Files read: %s/%s": {"fr": "Fichiers lus : %s/%s"},
+    "Merge failed: ": {"fr": "La fusion a échoué : "},
     "Files": {"fr": "Fichiers"},
     "Please add GEDCOM files": {"fr": "Veuillez ajouter des fichiers GEDCOM"},
     "Error": {"fr": "Erreur"},
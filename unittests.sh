@@ -1,3 +1,9 @@
 #!/bin/sh
 python3 -m unittest checkmyancestors/databasemodule.py
 python3 -m unittest checkmyancestors/sessionmodule.py
+python3 -m unittest checkmyancestors/app.py
+python3 -m unittest mergemyancestors.py
+python3 -m unittest extractmyancestors.py
+python3 -m unittest diffmyancestors.py
+python3 -m unittest validatemyancestors.py
+python3 -m unittest benchmyancestors.py
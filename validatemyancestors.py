@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+   validatemyancestors.py - Check GEDCOM files before merging them
+   Copyright (C) 2014-2016 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+   and by Benoît Fontaine <benoitfontaine.ba@gmail.com>
+"""
+
+from __future__ import print_function
+
+# global import
+import io
+import os
+import re
+import sys
+import mmap
+import unittest
+import argparse
+
+# local import
+import getmyancestors as gt
+import mergemyancestors as mm
+
+sys.path.append(os.path.dirname(sys.argv[0]))
+
+LINE = re.compile(rb"(0|[1-9][0-9]?) (?:(@[^@ ]+@) )?([A-Za-z0-9_]+)(?: (.*))?")
+# type of the record expected by the pointers of each tag
+LINKS = {
+    b"HUSB": b"INDI",
+    b"WIFE": b"INDI",
+    b"CHIL": b"INDI",
+    b"FAMS": b"FAM",
+    b"FAMC": b"FAM",
+    b"NOTE": b"NOTE",
+    b"SOUR": b"SOUR",
+    b"SUBM": b"SUBM",
+}
+# longest line in bytes, level and tag included, as split by getmyancestors.cont
+# with CONC and CONT lines
+MAX_LINE = 255
+
+
+def chunks(buf, chunk=1 << 20):
+    """ iterate over chunks of whole lines of a byte buffer """
+    pos, size = 0, len(buf)
+    while pos < size:
+        end = buf.rfind(b"\n", pos, pos + chunk) + 1 if pos + chunk < size else size
+        if end <= pos:
+            end = buf.find(b"\n", pos + chunk) + 1 or size
+        yield buf[pos:end]
+        pos = end
+
+
+def lines(buf, errors):
+    """ iterate over the lines of a byte buffer, adding the lines which are not UTF-8 to errors """
+    number = 0
+    for chunk in chunks(buf):
+        try:
+            chunk.decode("utf-8")
+            valid = True
+        except UnicodeDecodeError:
+            valid = False
+        for line in chunk.splitlines():
+            number += 1
+            if not valid:
+                try:
+                    line.decode("utf-8")
+                except UnicodeDecodeError:
+                    errors.append((number, "invalid UTF-8"))
+            yield line
+
+
+def validate(file):
+    """ Check a GEDCOM file in a single pass: line syntax and encoding, level nesting,
+        line length, pointers to missing records or to records of the wrong type,
+        records defined twice, duplicate _FSFTID and truncated files
+        only the record pointers, the first forward reference to each of them by type of
+        link and the FamilySearch IDs are kept in memory
+        :param file: a GEDCOM file object or file name, possibly compressed
+        return a sorted list of (line number, message)
+    """
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return validate(f)
+    buf = mm.map_file(file)
+    errors = list()
+    records = dict()
+    references = dict()
+    fids = dict()
+    previous = -1
+    tag = None
+    number = 0
+
+    def check(line, pointer, expected):
+        """ check the record of a pointer, expected to be of a given type """
+        if pointer not in records:
+            errors.append((line, "pointer %s to a missing record" % pointer.decode()))
+        elif expected and records[pointer] != expected:
+            errors.append(
+                (
+                    line,
+                    "pointer %s to a %s record instead of %s"
+                    % (pointer.decode(), records[pointer].decode(), expected.decode()),
+                )
+            )
+
+    for number, line in enumerate(lines(buf, errors), 1):
+        if number == 1 and line[:3] == b"\xef\xbb\xbf":
+            line = line[3:]
+        match = LINE.fullmatch(line)
+        if not match:
+            if line.strip():
+                errors.append((number, "malformed line"))
+            continue
+        level, pointer, tag, value = match.groups()
+        level = mm.LEVELS[level]
+        if level > previous + 1:
+            errors.append((number, "level %s after level %s" % (level, previous)))
+        previous = level
+        if len(line) > MAX_LINE:
+            errors.append((number, "line longer than %s bytes" % MAX_LINE))
+        if pointer:
+            if level > 0:
+                message = "pointer %s on a level %s line" % (pointer.decode(), level)
+                errors.append((number, message))
+            elif pointer in records:
+                errors.append((number, "record %s defined twice" % pointer.decode()))
+            else:
+                records[pointer] = tag
+        elif value and value[:1] == b"@" and value[-1:] == b"@" and len(value) > 2:
+            key = (value, LINKS.get(tag))
+            if value in records:
+                check(number, *key)
+            elif key not in references:
+                references[key] = number
+        if tag == b"_FSFTID":
+            if value in fids:
+                errors.append(
+                    (number, "_FSFTID %s already on line %s" % (value.decode(), fids[value]))
+                )
+            else:
+                fids[value] = number
+    if isinstance(buf, mmap.mmap):
+        buf.close()
+    if number == 0:
+        errors.append((0, "empty file"))
+    elif tag != b"TRLR" or previous != 0:
+        errors.append((number, "truncated file: no 0 TRLR line at the end"))
+    for (pointer, expected), line in references.items():
+        check(line, pointer, expected)
+    return sorted(errors)
+
+
+class TestValidate(unittest.TestCase):
+    def setUp(self):
+        """ a couple and a child, the child having a note """
+        tree = gt.Tree()
+        tree.display_name, tree.lang = "Tester", "English"
+        for fid in ("AAAA-001", "AAAA-002", "AAAA-003"):
+            tree.indi[fid] = gt.Indi(fid, tree)
+        tree.add_trio("AAAA-001", "AAAA-002", "AAAA-003")
+        tree.indi["AAAA-003"].notes.add(gt.Note("x" * 1000, tree))
+        tree.reset_num()
+        file = io.StringIO()
+        tree.print(file)
+        self.gedcom = file.getvalue()
+
+    def validate(self, gedcom):
+        return [message for _, message in validate(io.StringIO(gedcom))]
+
+    def test_valid(self):
+        self.assertEqual(self.validate(self.gedcom), [])
+
+    def test_truncated(self):
+        gedcom = self.gedcom[: self.gedcom.index("0 @F")]
+        errors = self.validate(gedcom)
+        self.assertIn("truncated file: no 0 TRLR line at the end", errors)
+        # the family, and the note which comes after it, reported once each
+        missing = re.findall(r"pointer @([FN])[0-9]+@ to a missing record", "\n".join(errors))
+        self.assertEqual(sorted(missing), ["F", "N"])
+
+    def test_line_length(self):
+        """ the lines written by getmyancestors.cont are valid, longer lines are not """
+        for text in ("x" * 248, "é" * 200, "x " * 300):
+            note = "0 @N99@ NOTE\n" + gt.cont("1 CONC " + text)
+            gedcom = self.gedcom.replace("0 TRLR", note + "0 TRLR")
+            self.assertEqual(self.validate(gedcom), [])
+        # a value of 250 bytes, but a line of 257
+        gedcom = self.gedcom.replace("0 TRLR", "0 @N99@ NOTE\n1 CONC %s\n0 TRLR" % ("x" * 250))
+        self.assertEqual(self.validate(gedcom), ["line longer than 255 bytes"])
+
+    def test_errors(self):
+        fam = re.search(r"\n0 (@F[0-9]+@) FAM\n", self.gedcom).group(1)
+        gedcom = (
+            self.gedcom.replace("1 _FSFTID AAAA-002", "1 _FSFTID AAAA-001")
+            .replace("\n1 CONC ", "", 1)
+            .replace(" FAM\n", " FAM\n2 DATE 1900\n")
+        )
+        gedcom = re.sub(r"1 CHIL @I[0-9]+@", "1 CHIL " + fam, gedcom)
+        errors = self.validate(gedcom)
+        self.assertEqual(len(errors), 4)
+        self.assertIn("_FSFTID AAAA-001 already on line", errors[0])
+        self.assertIn("line longer than 255 bytes", errors)
+        self.assertIn("level 2 after level 0", errors)
+        self.assertIn("pointer %s to a FAM record instead of INDI" % fam, errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check GEDCOM files from FamilySearch Tree (4 Jul 2016)",
+        add_help=False,
+        usage="validatemyancestors.py -i input1.ged input2.ged ... [options]",
+    )
+    try:
+        parser.add_argument(
+            "-i",
+            metavar="<FILE>",
+            nargs="+",
+            type=argparse.FileType("r", encoding="UTF-8"),
+            default=[sys.stdin],
+            help="input GEDCOM files, possibly compressed [stdin]",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            metavar="<INT>",
+            type=int,
+            default=None,
+            help="Number of processes checking input files [number of processors]",
+        )
+    except TypeError:
+        sys.stderr.write("Python >= 3.4 is required to run this script\n")
+        sys.stderr.write("(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n")
+        exit(2)
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit as e:
+        print(e.code)
+        parser.print_help()
+        exit(2)
+
+    invalid = 0
+    for file, errors in zip(args.i, mm.map_files(validate, args.i, args.jobs)):
+        for line, message in errors:
+            print("%s:%s: %s" % (file.name, line, message))
+        invalid += bool(errors)
+    exit(1 if invalid else 0)